@@ -3,24 +3,74 @@
 """
 import os
 import json
+import contextvars
+import time
+import random
 import psycopg2
 import bcrypt
 import jwt
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+READ_REPLICA_URLS = [url.strip() for url in DATABASE_READ_URL.split(',') if url.strip()]
+REPLICA_CONNECT_TIMEOUT = 3
+REPLICA_RETRY_SECONDS = 30
+READ_YOUR_WRITES_SECONDS = 10
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+FUNCTION_NAME = 'auth'
 JWT_SECRET = os.environ.get('JWT_SECRET', 'change-me-in-production')
 JWT_ALGORITHM = 'HS256'
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 REFRESH_TOKEN_EXPIRE_DAYS = 30
 
+_replica_down_until = {}
+_request_timer = contextvars.ContextVar('request_timer', default=None)
+
 
 def get_db_connection():
     conn = psycopg2.connect(DATABASE_URL)
     return conn
 
 
+def get_read_connection(event):
+    if not READ_REPLICA_URLS or reads_from_primary(event):
+        return get_db_connection()
+    
+    now = time.time()
+    healthy = [url for url in READ_REPLICA_URLS if _replica_down_until.get(url, 0) <= now]
+    random.shuffle(healthy)
+    
+    for url in healthy:
+        try:
+            return psycopg2.connect(url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            _replica_down_until[url] = now + REPLICA_RETRY_SECONDS
+    
+    return get_db_connection()
+
+
+def reads_from_primary(event):
+    primary_until = (event.get('headers', {}) or {}).get('X-Primary-Until', '')
+    try:
+        primary_until = float(primary_until)
+    except ValueError:
+        return False
+    
+    now = time.time()
+    return now < primary_until <= now + READ_YOUR_WRITES_SECONDS
+
+
+def primary_window_headers():
+    return {
+        'X-Primary-Until': str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+        'Access-Control-Expose-Headers': 'X-Primary-Until'
+    }
+
+
 def create_tokens(user_id: str):
     access_token = jwt.encode(
         {'user_id': user_id, 'exp': datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)},
@@ -35,7 +85,117 @@ def create_tokens(user_id: str):
     return access_token, refresh_token
 
 
+class TimedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, (time.perf_counter() - started) * 1000)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = []
+    
+    def add(self, phase, duration_ms):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration_ms
+    
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def server_timing(self):
+        entries = [f'{phase};dur={duration:.1f}' for phase, duration in self.phases.items()]
+        entries.append(f'total;dur={self.total_ms():.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def timed(phase):
+    timer = _request_timer.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, (time.perf_counter() - started) * 1000)
+
+
+def record_query(query, params, duration_ms):
+    timer = _request_timer.get()
+    statement = ' '.join(str(query).split())
+    
+    if timer is not None:
+        timer.add('db', duration_ms)
+        timer.queries.append({'statement': statement[:80], 'durationMs': round(duration_ms, 2)})
+    
+    if duration_ms >= SLOW_QUERY_MS:
+        log_event({
+            'event': 'slow_query',
+            'function': FUNCTION_NAME,
+            'durationMs': round(duration_ms, 2),
+            'statement': statement,
+            'params': redact_params(params)
+        })
+
+
+def redact_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: f'<{type(value).__name__}>' for key, value in params.items()}
+    return [f'<{type(value).__name__}>' for value in params]
+
+
+def dump_json(payload):
+    with timed('serialize'):
+        return json.dumps(payload)
+
+
+def log_event(fields):
+    if REQUEST_LOG:
+        print(json.dumps(fields, default=str), flush=True)
+
+
+def request_action(event):
+    action = (event.get('queryStringParameters') or {}).get('action')
+    if action or event.get('httpMethod') != 'POST':
+        return action
+    try:
+        return json.loads(event.get('body') or '{}').get('action')
+    except (ValueError, AttributeError):
+        return None
+
+
 def handler(event, context):
+    timer = RequestTimer()
+    token = _request_timer.set(timer)
+    try:
+        response = handle(event, context)
+    finally:
+        _request_timer.reset(token)
+    
+    response['headers'] = {
+        **response.get('headers', {}),
+        'Server-Timing': timer.server_timing(),
+        'Timing-Allow-Origin': '*'
+    }
+    log_event({
+        'event': 'request',
+        'function': FUNCTION_NAME,
+        'method': event.get('httpMethod', 'GET'),
+        'action': request_action(event),
+        'status': response.get('statusCode'),
+        'durationMs': round(timer.total_ms(), 2),
+        'phases': {phase: round(duration, 2) for phase, duration in timer.phases.items()},
+        'queries': timer.queries
+    })
+    return response
+
+
+def handle(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -44,14 +204,15 @@ def handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, X-Primary-Until'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    with timed('connect'):
+        conn = get_read_connection(event) if method == 'GET' else get_db_connection()
+    cursor = conn.cursor(cursor_factory=TimedCursor)
     
     try:
         if method == 'POST':
@@ -68,7 +229,7 @@ def handler(event, context):
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Все поля обязательны'}),
+                        'body': dump_json({'error': 'Все поля обязательны'}),
                         'isBase64Encoded': False
                     }
                 
@@ -76,7 +237,7 @@ def handler(event, context):
                     return {
                         'statusCode': 403,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Требуется инвайт-код'}),
+                        'body': dump_json({'error': 'Требуется инвайт-код'}),
                         'isBase64Encoded': False
                     }
                 
@@ -90,7 +251,7 @@ def handler(event, context):
                     return {
                         'statusCode': 403,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Инвайт недействителен'}),
+                        'body': dump_json({'error': 'Инвайт недействителен'}),
                         'isBase64Encoded': False
                     }
                 
@@ -98,7 +259,7 @@ def handler(event, context):
                     return {
                         'statusCode': 403,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Срок действия инвайта истёк'}),
+                        'body': dump_json({'error': 'Срок действия инвайта истёк'}),
                         'isBase64Encoded': False
                     }
                 
@@ -106,7 +267,7 @@ def handler(event, context):
                     return {
                         'statusCode': 403,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Инвайт уже использован'}),
+                        'body': dump_json({'error': 'Инвайт уже использован'}),
                         'isBase64Encoded': False
                     }
                 
@@ -115,11 +276,12 @@ def handler(event, context):
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Имя пользователя уже занято'}),
+                        'body': dump_json({'error': 'Имя пользователя уже занято'}),
                         'isBase64Encoded': False
                     }
                 
-                password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+                with timed('hash'):
+                    password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
                 
                 cursor.execute("SELECT COUNT(*) as count FROM users")
                 user_count = cursor.fetchone()['count']
@@ -138,12 +300,13 @@ def handler(event, context):
                 
                 conn.commit()
                 
-                access_token, refresh_token = create_tokens(str(user['id']))
+                with timed('auth'):
+                    access_token, refresh_token = create_tokens(str(user['id']))
                 
                 return {
                     'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **primary_window_headers()},
+                    'body': dump_json({
                         'user': {
                             'id': str(user['id']),
                             'username': user['username'],
@@ -165,7 +328,7 @@ def handler(event, context):
                     return {
                         'statusCode': 400,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Все поля обязательны'}),
+                        'body': dump_json({'error': 'Все поля обязательны'}),
                         'isBase64Encoded': False
                     }
                 
@@ -175,11 +338,14 @@ def handler(event, context):
                 )
                 user = cursor.fetchone()
                 
-                if not user or not bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8')):
+                with timed('hash'):
+                    password_ok = bool(user) and bcrypt.checkpw(password.encode('utf-8'), user['password_hash'].encode('utf-8'))
+                
+                if not password_ok:
                     return {
                         'statusCode': 401,
                         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Неверное имя пользователя или пароль'}),
+                        'body': dump_json({'error': 'Неверное имя пользователя или пароль'}),
                         'isBase64Encoded': False
                     }
                 
@@ -189,12 +355,13 @@ def handler(event, context):
                 )
                 conn.commit()
                 
-                access_token, refresh_token = create_tokens(str(user['id']))
+                with timed('auth'):
+                    access_token, refresh_token = create_tokens(str(user['id']))
                 
                 return {
                     'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **primary_window_headers()},
+                    'body': dump_json({
                         'user': {
                             'id': str(user['id']),
                             'username': user['username'],
@@ -214,27 +381,28 @@ def handler(event, context):
                 return {
                     'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Не авторизован'}),
+                    'body': dump_json({'error': 'Не авторизован'}),
                     'isBase64Encoded': False
                 }
             
             token = auth_header.replace('Bearer ', '')
             
             try:
-                payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+                with timed('auth'):
+                    payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
                 user_id = payload['user_id']
             except jwt.ExpiredSignatureError:
                 return {
                     'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Токен истёк'}),
+                    'body': dump_json({'error': 'Токен истёк'}),
                     'isBase64Encoded': False
                 }
             except jwt.InvalidTokenError:
                 return {
                     'statusCode': 401,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Невалидный токен'}),
+                    'body': dump_json({'error': 'Невалидный токен'}),
                     'isBase64Encoded': False
                 }
             
@@ -248,14 +416,14 @@ def handler(event, context):
                 return {
                     'statusCode': 404,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователь не найден'}),
+                    'body': dump_json({'error': 'Пользователь не найден'}),
                     'isBase64Encoded': False
                 }
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
+                'body': dump_json({
                     'user': {
                         'id': str(user['id']),
                         'username': user['username'],
@@ -270,7 +438,7 @@ def handler(event, context):
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
+            'body': dump_json({'error': 'Метод не поддерживается'}),
             'isBase64Encoded': False
         }
     
@@ -279,7 +447,7 @@ def handler(event, context):
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
+            'body': dump_json({'error': f'Ошибка сервера: {str(e)}'}),
             'isBase64Encoded': False
         }
     
@@ -2,22 +2,424 @@
 API для работы с чатами и сообщениями
 """
 import os
+import re
+import sys
 import json
+import fcntl
+import base64
+import binascii
+import hashlib
+import uuid
+import contextvars
+import time
+import random
+import threading
+import cProfile
 import psycopg2
+import psycopg2.extensions
 import jwt
 from datetime import datetime
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import quote
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+READ_REPLICA_URLS = [url.strip() for url in DATABASE_READ_URL.split(',') if url.strip()]
+CHAT_SHARD_URLS = os.environ.get('CHAT_SHARD_URLS', '')
+# Шард main — сама DATABASE_URL: там же users и invites, туда же попадают бакеты без записи в карте
+SHARD_URLS = {
+    'main': DATABASE_URL,
+    **dict(entry.strip().split('=', 1) for entry in CHAT_SHARD_URLS.split(',') if entry.strip())
+}
+SHARD_BUCKETS = 1024
+SHARD_MAP_TTL_SECONDS = float(os.environ.get('SHARD_MAP_TTL_SECONDS', '5'))
+SHARD_QUERY_THREADS = 8
+REPLICA_CONNECT_TIMEOUT = 3
+REPLICA_RETRY_SECONDS = 30
+CONNECTION_MAX_IDLE_SECONDS = 60
+READ_YOUR_WRITES_SECONDS = 10
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+FUNCTION_NAME = 'chats'
 JWT_SECRET = os.environ.get('JWT_SECRET', 'change-me-in-production')
 JWT_ALGORITHM = 'HS256'
+EVENTS_CHANNEL = 'chat_events'
+SIGNALS_CHANNEL = 'chat_signals'
+SIGNAL_BACKEND = os.environ.get('SIGNAL_BACKEND', 'notify')
+SIGNAL_TTL_SECONDS = {'typing': 6, 'online': 30}
+SIGNAL_RATE_PER_SECOND = 2
+SIGNAL_BURST = 5
+SIGNAL_STATE_LIMIT = 10000
+NOTIFY_PAYLOAD_LIMIT = 7900
+SEND_MESSAGE_FUNCTION = 'send_message_v1'
+ATTACHMENT_STORAGE = os.environ.get('ATTACHMENT_STORAGE', 'local')
+ATTACHMENTS_DIR = os.environ.get('ATTACHMENTS_DIR', '/tmp/messenger-attachments')
+MAX_ATTACHMENT_BYTES = int(os.environ.get('MAX_ATTACHMENT_BYTES', str(50 * 1024 * 1024)))
+MAX_MESSAGE_ATTACHMENTS = 10
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+MAX_RANGE_BYTES = 4 * 1024 * 1024
+STREAM_CHUNK_BYTES = 64 * 1024
+MAX_GROUP_MEMBERS = 500
+CHAT_PREVIEW_MEMBERS = 3
+MEMBERS_PAGE_SIZE = 50
+MAX_MEMBERS_PAGE_SIZE = 200
+MESSAGES_PAGE_SIZE = 50
+MAX_MESSAGES_PAGE_SIZE = 200
+# Хвост последних сообщений по чатам в памяти тёплого инстанса; 0 отключает кэш
+TAIL_CACHE_MESSAGES = int(os.environ.get('TAIL_CACHE_MESSAGES', str(MESSAGES_PAGE_SIZE)))
+TAIL_CACHE_CHATS = int(os.environ.get('TAIL_CACHE_CHATS', '1000'))
+TAIL_CACHE_MAX_BYTES = int(os.environ.get('TAIL_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+TAIL_CACHE_MAX_AGE_SECONDS = 300
+# Профиль запроса: по заголовку X-Profile (только админам) или случайной доле запросов
+PROFILE_DIR = os.environ.get('PROFILE_DIR', '/tmp/messenger-profiles')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', '50'))
+PROFILE_SAMPLE_INTERVAL_SECONDS = 0.005
+SHA256_RE = re.compile(r'[0-9a-f]{64}')
+RANGE_RE = re.compile(r'bytes=(\d*)-(\d*)')
+
+_replica_down_until = {}
+_request_timer = contextvars.ContextVar('request_timer', default=None)
+_current_event = contextvars.ContextVar('current_event', default=None)
+_storage = None
+_pool = threading.local()
+_signal_lock = threading.Lock()
+_signal_last_sent = {}
+_signal_buckets = {}
+_shard_map = {}
+_shard_map_loaded_at = None
+_shard_executor = None
+
+# Горячие запросы готовятся один раз на соединение (PREPARE) и дальше
+# выполняются через EXECUTE без повторного разбора и планирования
+PREPARED_STATEMENTS = {
+    'is_member': "SELECT user_id FROM chat_members WHERE chat_id = $1 AND user_id = $2",
+    # Для больших групп не собираем всех участников: превью из нескольких человек
+    # (собеседники раньше себя) и число участников, полный список — действие members.
+    # Профили берутся отдельно из основной базы: чаты могут лежать на другом шарде
+    'list_chats': f"""
+        SELECT 
+            c.id,
+            c.type,
+            c.title,
+            c.created_at,
+            ARRAY(
+                SELECT pm.user_id::text
+                FROM chat_members pm
+                WHERE pm.chat_id = c.id
+                ORDER BY pm.user_id = $1, pm.joined_at
+                LIMIT {CHAT_PREVIEW_MEMBERS}
+            ) as preview_ids,
+            (
+                SELECT COUNT(*)
+                FROM chat_members mc
+                WHERE mc.chat_id = c.id
+            ) as member_count,
+            (
+                SELECT json_build_object(
+                    'id', m.id,
+                    'body', m.body,
+                    'senderId', m.sender_id,
+                    'createdAt', m.created_at
+                )
+                FROM messages m
+                WHERE m.chat_id = c.id
+                ORDER BY m.created_at DESC
+                LIMIT 1
+            ) as last_message,
+            (
+                SELECT COUNT(*)
+                FROM messages m
+                WHERE m.chat_id = c.id 
+                AND m.sender_id != $1
+                AND m.read_at IS NULL
+            ) as unread_count
+        FROM chats c
+        JOIN chat_members cm ON c.id = cm.chat_id AND cm.user_id = $1
+        ORDER BY c.created_at DESC
+    """,
+    # Версия хвоста чата для кэша: последнее сообщение меняется при отправке, а число
+    # непрочитанных — при прочтении (read_at только выставляется). Оба подзапроса идут по индексам
+    'tail_version': """
+        SELECT
+            EXISTS(SELECT 1 FROM chat_members WHERE chat_id = $1 AND user_id = $2) as is_member,
+            (
+                SELECT m.id
+                FROM messages m
+                WHERE m.chat_id = $1
+                ORDER BY m.created_at DESC
+                LIMIT 1
+            ) as last_id,
+            (
+                SELECT COUNT(*)
+                FROM messages m
+                WHERE m.chat_id = $1 AND m.read_at IS NULL
+            ) as unread
+    """,
+    # Страница с конца истории: последние $2 сообщений. Отдельный запрос для более
+    # старых страниц, чтобы у обоих был обратный проход по idx_messages_chat_created_at
+    'fetch_messages': """
+        SELECT page.*
+        FROM (
+            SELECT 
+                m.id,
+                m.body,
+                m.sender_id,
+                m.created_at,
+                m.read_at,
+                (
+                    SELECT json_agg(json_build_object(
+                        'id', a.id,
+                        'fileName', a.file_name,
+                        'contentType', a.content_type,
+                        'size', a.size
+                    ))
+                    FROM attachments a
+                    WHERE a.message_id = m.id
+                ) as attachments
+            FROM messages m
+            WHERE m.chat_id = $1
+            ORDER BY m.created_at DESC
+            LIMIT $2
+        ) page
+        ORDER BY page.created_at ASC
+    """,
+    # Последние $3 сообщений раньше сообщения $2
+    'fetch_messages_before': """
+        SELECT page.*
+        FROM (
+            SELECT 
+                m.id,
+                m.body,
+                m.sender_id,
+                m.created_at,
+                m.read_at,
+                (
+                    SELECT json_agg(json_build_object(
+                        'id', a.id,
+                        'fileName', a.file_name,
+                        'contentType', a.content_type,
+                        'size', a.size
+                    ))
+                    FROM attachments a
+                    WHERE a.message_id = m.id
+                ) as attachments
+            FROM messages m
+            WHERE m.chat_id = $1
+            AND m.created_at < (SELECT created_at FROM messages WHERE id = $2::uuid)
+            ORDER BY m.created_at DESC
+            LIMIT $3
+        ) page
+        ORDER BY page.created_at ASC
+    """,
+    'mark_read': "UPDATE messages SET read_at = CURRENT_TIMESTAMP WHERE chat_id = $1 AND sender_id != $2 AND read_at IS NULL AND created_at <= $3",
+    # Весь путь отправки — одна функция в базе (V0007): проверка участия, вставка,
+    # счётчики чата, строка outbox и NOTIFY за один вызов. Имя версионное: новая
+    # логика появляется как send_message_v2, старые инстансы продолжают работать
+    'send_message': f"SELECT * FROM {SEND_MESSAGE_FUNCTION}($1, $2, $3, $4)",
+}
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+        self.last_used = time.monotonic()
 
 
 def get_db_connection():
-    conn = psycopg2.connect(DATABASE_URL)
+    return get_pooled_connection(DATABASE_URL)
+
+
+def get_pooled_connection(url, **kwargs):
+    # Соединение живёт между вызовами тёплого инстанса (по одному на поток),
+    # чтобы подготовленные запросы переиспользовались
+    connections = getattr(_pool, 'connections', None)
+    if connections is None:
+        connections = _pool.connections = {}
+    
+    conn = connections.get(url)
+    if conn is not None and (conn.closed or time.monotonic() - conn.last_used > CONNECTION_MAX_IDLE_SECONDS):
+        conn.close()
+        conn = None
+    
+    if conn is None:
+        conn = psycopg2.connect(url, connection_factory=PooledConnection, **kwargs)
+        connections[url] = conn
+    
+    conn.last_used = time.monotonic()
     return conn
 
 
+def release_connections():
+    # Завершаем транзакции, но не закрываем соединения; сломанные выбрасываем
+    connections = getattr(_pool, 'connections', {})
+    for url, conn in list(connections.items()):
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+        if conn.closed:
+            del connections[url]
+
+
+def execute_prepared(cursor, name, params):
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {PREPARED_STATEMENTS[name]}")
+        conn.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+class ShardMoving(Exception):
+    pass
+
+
+def chat_bucket(chat_id):
+    # Та же формула, что у SQL-функции chat_bucket (V0006): первые 32 бита md5 от uuid
+    digest = hashlib.md5(str(uuid.UUID(str(chat_id))).encode()).hexdigest()
+    return int(digest[:8], 16) % SHARD_BUCKETS
+
+
+def load_shard_map():
+    global _shard_map, _shard_map_loaded_at
+    now = time.monotonic()
+    if _shard_map_loaded_at is None or now - _shard_map_loaded_at > SHARD_MAP_TTL_SECONDS:
+        conn = get_db_connection()
+        # Если транзакции запроса на соединении ещё нет, своё чтение сразу завершаем,
+        # чтобы соединение не висело idle in transaction до конца запроса
+        idle = conn.get_transaction_status() == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT bucket, shard, state FROM chat_shard_buckets")
+            _shard_map = {bucket: (shard, state) for bucket, shard, state in cursor.fetchall()}
+        if idle:
+            conn.rollback()
+        _shard_map_loaded_at = now
+    return _shard_map
+
+
+def shard_for_chat(chat_id, write=False):
+    if len(SHARD_URLS) == 1:
+        return 'main'
+    
+    shard, state = load_shard_map().get(chat_bucket(chat_id), ('main', 'active'))
+    if write and state != 'active':
+        # Бакет переносится на другой шард: запись подождёт, чтение идёт со старого места
+        raise ShardMoving(chat_id)
+    return shard
+
+
+def on_chat_shard(conn, cursor, chat_id, write=False):
+    # Для основного шарда остаются переданные соединение и курсор (в том числе реплика)
+    shard = shard_for_chat(chat_id, write)
+    if shard != 'main':
+        conn = get_pooled_connection(SHARD_URLS[shard])
+        cursor = None
+    if cursor is None:
+        cursor = conn.cursor(cursor_factory=TimedCursor)
+    return conn, cursor
+
+
+def get_shard_executor():
+    global _shard_executor
+    if _shard_executor is None:
+        _shard_executor = ThreadPoolExecutor(max_workers=SHARD_QUERY_THREADS, thread_name_prefix='shard')
+    return _shard_executor
+
+
+def query_remote_shard(url, query):
+    conn = get_pooled_connection(url)
+    try:
+        with conn.cursor(cursor_factory=TimedCursor) as cursor:
+            return query(cursor)
+    finally:
+        conn.rollback()
+
+
+def scatter_shards(cursor, query, chat_key='id'):
+    # query(cursor) выполняется на всех шардах параллельно, основной — в текущем потоке.
+    # Во время переноса чат лежит на двух шардах: оставляем строки только с его шарда по карте
+    remote = {
+        shard: get_shard_executor().submit(contextvars.copy_context().run, query_remote_shard, url, query)
+        for shard, url in SHARD_URLS.items() if shard != 'main'
+    }
+    results = {'main': query(cursor)}
+    for shard, future in remote.items():
+        results[shard] = future.result()
+    
+    if not remote:
+        return results['main']
+    
+    return [
+        row
+        for shard, rows in results.items()
+        for row in rows
+        if shard_for_chat(row[chat_key]) == shard
+    ]
+
+
+def existing_user_ids(cursor, user_ids):
+    cursor.execute("SELECT id::text as id FROM users WHERE id = ANY(%s::uuid[])", (user_ids,))
+    return [row['id'] for row in cursor.fetchall()]
+
+
+def load_profiles(cursor, user_ids):
+    if not user_ids:
+        return {}
+    cursor.execute(
+        "SELECT id::text as id, username, display_name, is_admin FROM users WHERE id = ANY(%s::uuid[])",
+        (sorted(user_ids),)
+    )
+    return {
+        row['id']: {
+            'id': row['id'],
+            'username': row['username'],
+            'displayName': row['display_name'],
+            'isAdmin': row['is_admin']
+        }
+        for row in cursor.fetchall()
+    }
+
+
+def get_read_connection(event):
+    if not READ_REPLICA_URLS or reads_from_primary(event):
+        return get_db_connection()
+    
+    now = time.time()
+    healthy = [url for url in READ_REPLICA_URLS if _replica_down_until.get(url, 0) <= now]
+    random.shuffle(healthy)
+    
+    for url in healthy:
+        try:
+            return get_pooled_connection(url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            _replica_down_until[url] = now + REPLICA_RETRY_SECONDS
+    
+    return get_db_connection()
+
+
+def reads_from_primary(event):
+    primary_until = (event.get('headers', {}) or {}).get('X-Primary-Until', '')
+    try:
+        primary_until = float(primary_until)
+    except ValueError:
+        return False
+    
+    now = time.time()
+    return now < primary_until <= now + READ_YOUR_WRITES_SECONDS
+
+
+def primary_window_headers():
+    return {
+        'X-Primary-Until': str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+        'Access-Control-Expose-Headers': 'X-Primary-Until'
+    }
+
+
 def verify_token(auth_header):
     if not auth_header or not auth_header.startswith('Bearer '):
         return None
@@ -31,7 +433,1308 @@ def verify_token(auth_header):
         return None
 
 
+class TimedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, (time.perf_counter() - started) * 1000)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = []
+        self.profile_id = None
+        # Запросы scatter_shards пишут в таймер из потоков пула
+        self.lock = threading.Lock()
+    
+    def add(self, phase, duration_ms):
+        with self.lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + duration_ms
+    
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def server_timing(self):
+        entries = [f'{phase};dur={duration:.1f}' for phase, duration in self.phases.items()]
+        entries.append(f'total;dur={self.total_ms():.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def timed(phase):
+    timer = _request_timer.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, (time.perf_counter() - started) * 1000)
+
+
+class StackSampler(threading.Thread):
+    # Раз в интервал снимает стек потока запроса; свёрнутые стеки (файл.collapsed)
+    # открываются flamegraph.pl или speedscope и показывают и время ожидания базы
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL_SECONDS):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+    
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f'{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+    
+    def stop(self):
+        self.stopped.set()
+        self.join()
+    
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+def wants_profile(event, cursor, user_id):
+    if (event.get('headers') or {}).get('X-Profile'):
+        # Профиль пишет файлы на диск инстанса, поэтому по заголовку — только админам
+        cursor.execute("SELECT is_admin FROM users WHERE id = %s", (user_id,))
+        user = cursor.fetchone()
+        return bool(user and user['is_admin'])
+    return PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
+
+def prune_profiles():
+    # Имена начинаются со времени, поэтому старейшие — первые по алфавиту
+    dumps = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith('.pstats'))
+    for name in dumps[:max(0, len(dumps) - PROFILE_KEEP)]:
+        for suffix in ('.pstats', '.collapsed'):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, name[:-len('.pstats')] + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def save_profile(action_name, profiler, sampler):
+    profile_id = f'{datetime.utcnow():%Y%m%dT%H%M%S}-{action_name}-{uuid.uuid4().hex[:8]}'
+    path = os.path.join(PROFILE_DIR, profile_id)
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    profiler.dump_stats(f'{path}.pstats')
+    with open(f'{path}.collapsed', 'w') as fp:
+        fp.write(sampler.collapsed())
+    prune_profiles()
+    return profile_id
+
+
+@contextmanager
+def profiled(action_name):
+    # cProfile даёт точные вызовы и время функций, сэмплер — стеки с ожиданием I/O
+    profiler = cProfile.Profile()
+    sampler = StackSampler(threading.get_ident())
+    sampler.start()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        sampler.stop()
+        timer = _request_timer.get()
+        try:
+            profile_id = save_profile(action_name, profiler, sampler)
+        except OSError as e:
+            log_event({'event': 'profile_error', 'function': FUNCTION_NAME, 'error': str(e)})
+        else:
+            if timer is not None:
+                timer.profile_id = profile_id
+
+
+def record_query(query, params, duration_ms):
+    timer = _request_timer.get()
+    statement = ' '.join(str(query).split())
+    
+    if timer is not None:
+        timer.add('db', duration_ms)
+        with timer.lock:
+            timer.queries.append({'statement': statement[:80], 'durationMs': round(duration_ms, 2)})
+    
+    if duration_ms >= SLOW_QUERY_MS:
+        log_event({
+            'event': 'slow_query',
+            'function': FUNCTION_NAME,
+            'durationMs': round(duration_ms, 2),
+            'statement': statement,
+            'params': redact_params(params)
+        })
+
+
+def redact_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: f'<{type(value).__name__}>' for key, value in params.items()}
+    return [f'<{type(value).__name__}>' for value in params]
+
+
+def dump_json(payload):
+    with timed('serialize'):
+        return json.dumps(payload)
+
+
+def log_event(fields):
+    if REQUEST_LOG:
+        print(json.dumps(fields, default=str), flush=True)
+
+
+def request_action(event):
+    action = (event.get('queryStringParameters') or {}).get('action')
+    if action or event.get('httpMethod') != 'POST':
+        return action
+    try:
+        return json.loads(event.get('body') or '{}').get('action')
+    except (ValueError, AttributeError):
+        return None
+
+
 def handler(event, context):
+    timer = RequestTimer()
+    token = _request_timer.set(timer)
+    try:
+        response = handle(event, context)
+    finally:
+        _request_timer.reset(token)
+    
+    response['headers'] = {
+        **response.get('headers', {}),
+        'Server-Timing': timer.server_timing(),
+        'Timing-Allow-Origin': '*'
+    }
+    if timer.profile_id:
+        response['headers']['X-Profile-Id'] = timer.profile_id
+    action = request_action(event)
+    fields = {
+        'event': 'request',
+        'function': FUNCTION_NAME,
+        'method': event.get('httpMethod', 'GET'),
+        'action': action,
+        'status': response.get('statusCode'),
+        'durationMs': round(timer.total_ms(), 2),
+        'phases': {phase: round(duration, 2) for phase, duration in timer.phases.items()},
+        'queries': timer.queries
+    }
+    if action == 'messages' and TAIL_CACHE_MESSAGES > 0:
+        # Счётчики кэша хвоста накоплены с запуска инстанса
+        fields['tailCache'] = tail_cache.stats()
+    if timer.profile_id:
+        fields['profile'] = timer.profile_id
+    log_event(fields)
+    return response
+
+
+class LocalStorage:
+    # Контентно-адресуемое хранилище на локальном диске: имя файла — sha256 содержимого,
+    # поэтому одинаковые файлы хранятся один раз. Другие бэкенды (S3 и т.п.) реализуют
+    # те же методы и регистрируются в STORAGE_BACKENDS.
+    def __init__(self, root=ATTACHMENTS_DIR):
+        self.root = root
+    
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256[2:4], sha256)
+    
+    def partial_path(self, upload_id):
+        return os.path.join(self.root, 'partial', str(upload_id))
+    
+    def exists(self, sha256):
+        return os.path.exists(self.blob_path(sha256))
+    
+    def uploaded_size(self, upload_id):
+        try:
+            return os.path.getsize(self.partial_path(upload_id))
+        except FileNotFoundError:
+            return 0
+    
+    def append(self, upload_id, offset, data):
+        # Дописываем кусок, только если он начинается ровно с конца уже загруженного
+        path = self.partial_path(upload_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'ab') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            size = fp.seek(0, os.SEEK_END)
+            if offset == size:
+                fp.write(data)
+                size += len(data)
+            return size
+    
+    def digest(self, upload_id):
+        sha256 = hashlib.sha256()
+        with open(self.partial_path(upload_id), 'rb') as fp:
+            for chunk in iter(lambda: fp.read(STREAM_CHUNK_BYTES), b''):
+                sha256.update(chunk)
+        return sha256.hexdigest()
+    
+    def commit(self, upload_id, sha256):
+        path = self.blob_path(sha256)
+        if os.path.exists(path):
+            self.discard(upload_id)
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self.partial_path(upload_id), path)
+    
+    def discard(self, upload_id):
+        try:
+            os.remove(self.partial_path(upload_id))
+        except FileNotFoundError:
+            pass
+    
+    def read_range(self, sha256, start, length):
+        with open(self.blob_path(sha256), 'rb') as fp:
+            fp.seek(start)
+            return fp.read(length)
+    
+    def local_path(self, sha256):
+        return self.blob_path(sha256)
+
+
+STORAGE_BACKENDS = {
+    'local': LocalStorage,
+}
+
+
+def get_storage():
+    global _storage
+    if _storage is None:
+        _storage = STORAGE_BACKENDS[ATTACHMENT_STORAGE]()
+    return _storage
+
+
+class LocalSignalBus:
+    # Замена NOTIFY внутри одного процесса: собственный сервер подписывает шлюз напрямую
+    def __init__(self):
+        self.subscribers = []
+    
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+    
+    def publish(self, signal):
+        for callback in list(self.subscribers):
+            callback(signal)
+
+
+signal_bus = LocalSignalBus()
+
+
+def prune_signal_state(now):
+    if len(_signal_last_sent) > SIGNAL_STATE_LIMIT:
+        for key, sent_at in list(_signal_last_sent.items()):
+            if now - sent_at > SIGNAL_TTL_SECONDS[key[2]]:
+                del _signal_last_sent[key]
+    if len(_signal_buckets) > SIGNAL_STATE_LIMIT:
+        for user_id, (tokens, updated_at) in list(_signal_buckets.items()):
+            if tokens + (now - updated_at) * SIGNAL_RATE_PER_SECOND >= SIGNAL_BURST:
+                del _signal_buckets[user_id]
+
+
+def admit_signal(user_id, chat_id, kind):
+    # Повтор того же сигнала, пока предыдущий ещё не истёк наполовину, схлопываем:
+    # у получателей он и так отображается. Остальное ограничено token bucket на отправителя.
+    now = time.monotonic()
+    with _signal_lock:
+        prune_signal_state(now)
+        
+        sent_at = _signal_last_sent.get((user_id, chat_id, kind))
+        if sent_at is not None and now - sent_at < SIGNAL_TTL_SECONDS[kind] / 2:
+            return 'coalesced'
+        
+        tokens, updated_at = _signal_buckets.get(user_id, (SIGNAL_BURST, now))
+        tokens = min(SIGNAL_BURST, tokens + (now - updated_at) * SIGNAL_RATE_PER_SECOND)
+        if tokens < 1:
+            _signal_buckets[user_id] = (tokens, now)
+            return 'limited'
+        
+        _signal_buckets[user_id] = (tokens - 1, now)
+        _signal_last_sent[(user_id, chat_id, kind)] = now
+        return 'accepted'
+
+
+def publish_signal(conn, cursor, signal):
+    if SIGNAL_BACKEND == 'local':
+        signal_bus.publish(signal)
+        return
+    # NOTIFY без записи в таблицы: доставляется при коммите пустой транзакции
+    cursor.execute("SELECT pg_notify(%s, %s)", (SIGNALS_CHANNEL, json.dumps(signal)))
+    conn.commit()
+
+
+def notify_chat_event(cursor, event):
+    # NOTIFY уходит слушателям только после коммита транзакции
+    payload = json.dumps(event)
+    if len(payload.encode('utf-8')) > NOTIFY_PAYLOAD_LIMIT and 'message' in event:
+        # Не влезает в лимит NOTIFY: шлём без тела, шлюз дочитает сообщение из базы
+        payload = json.dumps({**event, 'message': {'id': event['message']['id']}})
+    cursor.execute("SELECT pg_notify(%s, %s)", (EVENTS_CHANNEL, payload))
+
+
+class MessageTailCache:
+    # Последние сообщения чатов в памяти тёплого инстанса. Запись отдаётся, только
+    # пока совпадает версия чата из базы (tail_version): новое сообщение меняет
+    # last_id, прочтение — число непрочитанных. Чаты вытесняются по LRU
+    def __init__(self, per_chat, max_chats, max_bytes, max_age):
+        self.per_chat = per_chat
+        self.max_chats = max_chats
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.chats = OrderedDict()
+        self.lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, chat_id, version, limit):
+        with self.lock:
+            entry = self.chats.get(chat_id)
+            if entry is not None and (entry['version'] != version or time.monotonic() - entry['stored_at'] > self.max_age):
+                self.drop(chat_id)
+                entry = None
+            if entry is None or (limit > len(entry['messages']) and not entry['complete']):
+                self.misses += 1
+                return None
+            
+            self.chats.move_to_end(chat_id)
+            self.hits += 1
+            messages = list(entry['messages'])[-limit:]
+            has_more = len(entry['messages']) > limit or not entry['complete']
+            return [(created_at, dict(payload)) for created_at, payload, _ in messages], has_more
+    
+    def put(self, chat_id, version, messages, complete):
+        # messages — (created_at, payload) от старых к новым
+        entry = {
+            'version': version,
+            'messages': deque(maxlen=self.per_chat),
+            'complete': complete and len(messages) <= self.per_chat,
+            'stored_at': time.monotonic(),
+            'bytes': 0
+        }
+        for created_at, payload in messages[-self.per_chat:]:
+            size = len(json.dumps(payload))
+            entry['messages'].append((created_at, dict(payload), size))
+            entry['bytes'] += size
+        
+        with self.lock:
+            self.drop(chat_id)
+            self.chats[chat_id] = entry
+            self.bytes += entry['bytes']
+            self.evict()
+    
+    def append(self, chat_id, previous_id, created_at, payload):
+        # Дописываем, только если кэш видел предыдущее сообщение чата; иначе
+        # в хвосте была бы дыра — запись выбрасываем, её заполнит следующее чтение
+        with self.lock:
+            entry = self.chats.get(chat_id)
+            if entry is None:
+                return
+            last_id, unread = entry['version']
+            if last_id != previous_id:
+                self.drop(chat_id)
+                return
+            
+            if len(entry['messages']) == self.per_chat:
+                _, _, size = entry['messages'][0]
+                entry['bytes'] -= size
+                self.bytes -= size
+                entry['complete'] = False
+            size = len(json.dumps(payload))
+            entry['messages'].append((created_at, dict(payload), size))
+            entry['bytes'] += size
+            self.bytes += size
+            entry['version'] = (payload['id'], unread + 1)
+            self.chats.move_to_end(chat_id)
+            self.evict()
+    
+    def mark_read(self, chat_id, reader_id, until, count):
+        with self.lock:
+            entry = self.chats.get(chat_id)
+            if entry is None:
+                return
+            for created_at, payload, _ in entry['messages']:
+                if payload['senderId'] != reader_id and created_at <= until:
+                    payload['status'] = 'read'
+            last_id, unread = entry['version']
+            entry['version'] = (last_id, unread - count)
+    
+    def drop(self, chat_id):
+        entry = self.chats.pop(chat_id, None)
+        if entry is not None:
+            self.bytes -= entry['bytes']
+    
+    def evict(self):
+        while self.chats and (len(self.chats) > self.max_chats or self.bytes > self.max_bytes):
+            _, entry = self.chats.popitem(last=False)
+            self.bytes -= entry['bytes']
+    
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else None,
+                'chats': len(self.chats),
+                'messages': sum(len(entry['messages']) for entry in self.chats.values()),
+                'bytes': self.bytes
+            }
+
+
+tail_cache = MessageTailCache(TAIL_CACHE_MESSAGES, TAIL_CACHE_CHATS, TAIL_CACHE_MAX_BYTES, TAIL_CACHE_MAX_AGE_SECONDS)
+
+
+def json_response(status, payload, headers=None):
+    return {
+        'statusCode': status,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **(headers or {})},
+        'body': dump_json(payload),
+        'isBase64Encoded': False
+    }
+
+
+def list_chats(conn, cursor, user_id, params):
+    def query(shard_cursor):
+        execute_prepared(shard_cursor, 'list_chats', (user_id,))
+        return shard_cursor.fetchall()
+    
+    chats = scatter_shards(cursor, query)
+    chats.sort(key=lambda chat: chat['created_at'], reverse=True)
+    
+    profiles = load_profiles(cursor, {member_id for chat in chats for member_id in chat['preview_ids']})
+    
+    return 200, {
+        'chats': [
+            {
+                'id': str(chat['id']),
+                'type': chat['type'],
+                'title': chat['title'],
+                'participants': [profiles[member_id] for member_id in chat['preview_ids'] if member_id in profiles],
+                'memberCount': chat['member_count'],
+                'lastMessage': chat['last_message'],
+                'unreadCount': chat['unread_count'],
+                'createdAt': chat['created_at'].isoformat()
+            }
+            for chat in chats
+        ]
+    }
+
+
+def message_payload(msg):
+    return {
+        'id': str(msg['id']),
+        'body': msg['body'],
+        'senderId': str(msg['sender_id']),
+        'createdAt': msg['created_at'].isoformat(),
+        'status': 'read' if msg['read_at'] else 'sent',
+        'attachments': msg['attachments'] or []
+    }
+
+
+def get_messages(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    before = params.get('before')
+    
+    if not chat_id:
+        return 400, {'error': 'chatId обязателен'}
+    
+    try:
+        limit = max(1, min(int(params.get('limit', MESSAGES_PAGE_SIZE)), MAX_MESSAGES_PAGE_SIZE))
+        before = str(uuid.UUID(before)) if before else None
+    except ValueError:
+        return 400, {'error': 'Некорректные параметры страницы'}
+    
+    conn, cursor = on_chat_shard(conn, cursor, chat_id)
+    
+    # Проверка доступа и версия хвоста одним запросом: последняя страница
+    # отдаётся из памяти, если с прошлого чтения в чате ничего не менялось
+    execute_prepared(cursor, 'tail_version', (chat_id, user_id))
+    state = cursor.fetchone()
+    
+    if not state['is_member']:
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    version = (str(state['last_id']) if state['last_id'] else None, state['unread'])
+    use_cache = TAIL_CACHE_MESSAGES > 0 and before is None
+    cached = tail_cache.get(chat_id, version, limit) if use_cache else None
+    
+    if cached is not None:
+        messages, has_more = cached
+    else:
+        if before is None:
+            execute_prepared(cursor, 'fetch_messages', (chat_id, limit + 1))
+        else:
+            execute_prepared(cursor, 'fetch_messages_before', (chat_id, before, limit + 1))
+        rows = cursor.fetchall()
+        has_more = len(rows) > limit
+        messages = [(msg['created_at'], message_payload(msg)) for msg in rows[-limit:]]
+        if use_cache:
+            tail_cache.put(chat_id, version, messages, complete=not has_more)
+    
+    has_unread = any(msg['senderId'] != user_id and msg['status'] == 'sent' for _, msg in messages)
+    
+    try:
+        write_conn, write_cursor = on_chat_shard(get_db_connection(), None, chat_id, write=True) if has_unread else (None, None)
+    except ShardMoving:
+        # Отметка о прочтении подождёт следующего чтения после переноса
+        write_conn, write_cursor = None, None
+    
+    if write_conn is not None:
+        # Чтение могло идти с реплики: отметку о прочтении пишем в primary
+        # и только для тех сообщений, которые реально отдали клиенту
+        read_until = messages[-1][0]
+        with write_cursor:
+            execute_prepared(write_cursor, 'mark_read', (chat_id, user_id, read_until))
+            marked = write_cursor.rowcount
+            if marked:
+                notify_chat_event(write_cursor, {
+                    'type': 'read',
+                    'chatId': chat_id,
+                    'readerId': user_id,
+                    'readUntil': read_until.isoformat()
+                })
+        write_conn.commit()
+        if marked and use_cache:
+            tail_cache.mark_read(chat_id, user_id, read_until, marked)
+    
+    return 200, {
+        'messages': [msg for _, msg in messages],
+        'nextCursor': messages[0][1]['id'] if has_more else None
+    }
+
+
+def create_chat(conn, cursor, user_id, params):
+    other_user_id = params.get('userId')
+    
+    if not other_user_id or not parse_user_ids([other_user_id]):
+        return 400, {'error': 'userId обязателен'}
+    
+    def query(shard_cursor):
+        shard_cursor.execute("""
+            SELECT c.id 
+            FROM chats c
+            JOIN chat_members cm1 ON c.id = cm1.chat_id
+            JOIN chat_members cm2 ON c.id = cm2.chat_id
+            WHERE cm1.user_id = %s AND cm2.user_id = %s
+            AND c.type = 'direct'
+            LIMIT 1
+        """, (user_id, other_user_id))
+        return shard_cursor.fetchall()
+    
+    existing_chats = scatter_shards(cursor, query)
+    
+    if existing_chats:
+        return 200, {'chatId': str(existing_chats[0]['id'])}
+    
+    if not existing_user_ids(cursor, [other_user_id]):
+        return 404, {'error': 'Пользователь не найден'}
+    
+    # id выбирается до вставки: по нему определяется шард чата
+    chat_id = str(uuid.uuid4())
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    cursor.execute("INSERT INTO chats (id, type) VALUES (%s, 'direct')", (chat_id,))
+    
+    cursor.execute(
+        "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
+        (chat_id, user_id, chat_id, other_user_id)
+    )
+    
+    notify_chat_event(cursor, {'type': 'chat', 'chatId': str(chat_id), 'memberIds': [user_id, other_user_id]})
+    
+    conn.commit()
+    
+    return 201, {'chatId': str(chat_id)}
+
+
+def parse_user_ids(value):
+    if not isinstance(value, list) or not value or len(value) > MAX_GROUP_MEMBERS:
+        return None
+    try:
+        return sorted({str(uuid.UUID(str(user_id))) for user_id in value})
+    except ValueError:
+        return None
+
+
+def insert_members(cursor, chat_id, user_ids):
+    # Одна вставка на весь список (id уже проверены по users); состоящие в чате пропускаются
+    cursor.execute("""
+        INSERT INTO chat_members (chat_id, user_id)
+        SELECT %s, unnest(%s::uuid[])
+        ON CONFLICT (chat_id, user_id) DO NOTHING
+        RETURNING user_id
+    """, (chat_id, user_ids))
+    return [str(row['user_id']) for row in cursor.fetchall()]
+
+
+def lock_group(cursor, chat_id, user_id):
+    # Блокируем строку чата: параллельные add/remove одной группы выполняются по очереди,
+    # и проверка лимита участников не обгоняет чужую вставку
+    cursor.execute("""
+        SELECT c.id, cm.role
+        FROM chats c
+        LEFT JOIN chat_members cm ON cm.chat_id = c.id AND cm.user_id = %s
+        WHERE c.id = %s AND c.type = 'group'
+        FOR UPDATE OF c
+    """, (user_id, chat_id))
+    return cursor.fetchone()
+
+
+def create_group(conn, cursor, user_id, params):
+    title = str(params.get('title') or '').strip()[:100]
+    member_ids = parse_user_ids(params.get('memberIds') or [user_id])
+    
+    if not title or member_ids is None:
+        return 400, {'error': 'title и memberIds обязательны'}
+    
+    member_ids = [member_id for member_id in member_ids if member_id != user_id]
+    if len(member_ids) + 1 > MAX_GROUP_MEMBERS:
+        return 400, {'error': f'В группе не больше {MAX_GROUP_MEMBERS} участников'}
+    
+    member_ids = existing_user_ids(cursor, member_ids)
+    
+    chat_id = str(uuid.uuid4())
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    cursor.execute(
+        "INSERT INTO chats (id, type, title, created_by) VALUES (%s, 'group', %s, %s)",
+        (chat_id, title, user_id)
+    )
+    
+    cursor.execute(
+        "INSERT INTO chat_members (chat_id, user_id, role) VALUES (%s, %s, 'owner')",
+        (chat_id, user_id)
+    )
+    added = insert_members(cursor, chat_id, member_ids)
+    
+    notify_chat_event(cursor, {'type': 'chat', 'chatId': chat_id, 'memberIds': [user_id] + added})
+    
+    conn.commit()
+    
+    return 201, {'chatId': str(chat_id), 'memberCount': len(added) + 1}
+
+
+def add_members(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    member_ids = parse_user_ids(params.get('userIds'))
+    
+    if not chat_id or member_ids is None:
+        return 400, {'error': 'chatId и userIds обязательны'}
+    
+    member_ids = existing_user_ids(cursor, member_ids)
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    group = lock_group(cursor, chat_id, user_id)
+    
+    if not group or group['role'] not in ('owner', 'admin'):
+        return 403, {'error': 'Добавлять участников может только администратор группы'}
+    
+    added = insert_members(cursor, chat_id, member_ids)
+    
+    cursor.execute("SELECT COUNT(*) as count FROM chat_members WHERE chat_id = %s", (chat_id,))
+    member_count = cursor.fetchone()['count']
+    
+    if member_count > MAX_GROUP_MEMBERS:
+        conn.rollback()
+        return 400, {'error': f'В группе не больше {MAX_GROUP_MEMBERS} участников'}
+    
+    if added:
+        notify_chat_event(cursor, {'type': 'chat', 'chatId': chat_id, 'memberIds': added})
+    
+    conn.commit()
+    
+    return 200, {'added': added, 'memberCount': member_count}
+
+
+def remove_members(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    member_ids = parse_user_ids(params.get('userIds'))
+    
+    if not chat_id or member_ids is None:
+        return 400, {'error': 'chatId и userIds обязательны'}
+    
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    group = lock_group(cursor, chat_id, user_id)
+    
+    if not group or not group['role']:
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    # Участник может только выйти сам, владельца удалить нельзя
+    if group['role'] not in ('owner', 'admin') and member_ids != [user_id]:
+        return 403, {'error': 'Удалять участников может только администратор группы'}
+    
+    cursor.execute("""
+        DELETE FROM chat_members
+        WHERE chat_id = %s AND user_id = ANY(%s::uuid[]) AND role != 'owner'
+        RETURNING user_id
+    """, (chat_id, member_ids))
+    removed = [str(row['user_id']) for row in cursor.fetchall()]
+    
+    if removed:
+        notify_chat_event(cursor, {'type': 'members_removed', 'chatId': chat_id, 'memberIds': removed})
+    
+    conn.commit()
+    
+    return 200, {'removed': removed}
+
+
+def list_members(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    after = params.get('after')
+    
+    if not chat_id:
+        return 400, {'error': 'chatId обязателен'}
+    
+    try:
+        limit = max(1, min(int(params.get('limit', MEMBERS_PAGE_SIZE)), MAX_MEMBERS_PAGE_SIZE))
+        after = str(uuid.UUID(after)) if after else None
+    except ValueError:
+        return 400, {'error': 'Некорректные параметры страницы'}
+    
+    global_cursor = cursor
+    conn, cursor = on_chat_shard(conn, cursor, chat_id)
+    
+    execute_prepared(cursor, 'is_member', (chat_id, user_id))
+    
+    if not cursor.fetchone():
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    # Keyset-пагинация по первичному ключу (chat_id, user_id): страница не дороже первой
+    cursor.execute("""
+        SELECT cm.user_id::text as id, cm.role, cm.joined_at
+        FROM chat_members cm
+        WHERE cm.chat_id = %s AND (%s::uuid IS NULL OR cm.user_id > %s::uuid)
+        ORDER BY cm.user_id
+        LIMIT %s
+    """, (chat_id, after, after, limit + 1))
+    members = cursor.fetchall()
+    
+    has_more = len(members) > limit
+    members = members[:limit]
+    profiles = load_profiles(global_cursor, {member['id'] for member in members})
+    
+    return 200, {
+        'members': [
+            {
+                **profiles[member['id']],
+                'role': member['role'],
+                'joinedAt': member['joined_at'].isoformat()
+            }
+            for member in members
+            if member['id'] in profiles
+        ],
+        'nextCursor': members[-1]['id'] if has_more else None
+    }
+
+
+def send_message(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    message_body = (params.get('body') or '').strip()
+    attachment_ids = params.get('attachmentIds') or []
+    
+    if not isinstance(attachment_ids, list) or len(attachment_ids) > MAX_MESSAGE_ATTACHMENTS:
+        return 400, {'error': f'Не больше {MAX_MESSAGE_ATTACHMENTS} вложений'}
+    
+    if not chat_id or not (message_body or attachment_ids):
+        return 400, {'error': 'chatId и body обязательны'}
+    
+    global_cursor = cursor
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    # Без вложений функция сама шлёт NOTIFY; вложения прикрепляются здесь (пересылаемые
+    # могут лежать на другом шарде), и уведомление с ними отправляется после этого.
+    # Побочные эффекты выполняет воркер server/outbox.py по строке, записанной функцией
+    execute_prepared(cursor, 'send_message', (chat_id, user_id, message_body, not attachment_ids))
+    inserted = cursor.fetchone()
+    
+    if inserted['error'] == 'not_member':
+        conn.rollback()
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    attachments = []
+    if attachment_ids:
+        attachments = attach_to_message(cursor, global_cursor, user_id, chat_id, inserted['id'], attachment_ids)
+        if attachments is None:
+            conn.rollback()
+            return 403, {'error': 'Нет доступа к вложению'}
+    
+    message = {
+        'id': str(inserted['id']),
+        'chatId': chat_id,
+        'senderId': user_id,
+        'body': message_body,
+        'createdAt': inserted['created_at'].isoformat(),
+        'status': 'sent',
+        'attachments': attachments
+    }
+    
+    if attachment_ids:
+        notify_chat_event(cursor, {'type': 'message', 'chatId': chat_id, 'message': message})
+    
+    conn.commit()
+    
+    if TAIL_CACHE_MESSAGES > 0:
+        previous_id = str(inserted['previous_id']) if inserted['previous_id'] else None
+        tail_cache.append(chat_id, previous_id, inserted['created_at'], {
+            key: value for key, value in message.items() if key != 'chatId'
+        })
+    
+    return 201, {'message': message}
+
+
+def attachment_payload(attachment):
+    return {
+        'id': str(attachment['id']),
+        'fileName': attachment['file_name'],
+        'contentType': attachment['content_type'],
+        'size': attachment['size']
+    }
+
+
+def find_forwardable(cursor, user_id, attachment_ids):
+    cursor.execute("""
+        SELECT a.id::text as id, m.chat_id, a.sha256, a.size, a.file_name, a.content_type
+        FROM attachments a
+        JOIN messages m ON m.id = a.message_id
+        JOIN chat_members cm ON cm.chat_id = m.chat_id AND cm.user_id = %s
+        WHERE a.id = ANY(%s::uuid[]) AND a.status = 'ready'
+    """, (user_id, attachment_ids))
+    return cursor.fetchall()
+
+
+def attach_to_message(cursor, global_cursor, user_id, chat_id, message_id, attachment_ids):
+    # Свои ещё не отправленные загрузки прикрепляем как есть
+    cursor.execute("""
+        UPDATE attachments SET message_id = %s, chat_id = %s
+        WHERE id = ANY(%s::uuid[]) AND uploader_id = %s AND status = 'ready' AND message_id IS NULL
+        RETURNING id, file_name, content_type, size
+    """, (message_id, chat_id, attachment_ids, user_id))
+    attached = cursor.fetchall()
+    
+    # Пересылка: новая запись метаданных на тот же blob, байты не копируются.
+    # Исходное вложение может лежать на другом шарде — ищем на всех
+    remaining = sorted(set(attachment_ids) - {str(attachment['id']) for attachment in attached})
+    if remaining:
+        sources = scatter_shards(global_cursor, lambda shard_cursor: find_forwardable(shard_cursor, user_id, remaining), 'chat_id')
+        for source in {source['id']: source for source in sources}.values():
+            cursor.execute("""
+                INSERT INTO attachments (uploader_id, message_id, chat_id, sha256, size, file_name, content_type, status)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, 'ready')
+                RETURNING id, file_name, content_type, size
+            """, (user_id, message_id, chat_id, source['sha256'], source['size'], source['file_name'], source['content_type']))
+            attached.append(cursor.fetchone())
+    
+    if len(attached) != len(set(attachment_ids)):
+        return None
+    return [attachment_payload(attachment) for attachment in attached]
+
+
+def load_upload(conn, cursor, user_id, params, write=False):
+    # Вложения лежат на шарде своего чата, поэтому запросы о загрузке несут chatId
+    attachment_id = params.get('attachmentId')
+    chat_id = params.get('chatId')
+    if not attachment_id or not chat_id:
+        return conn, cursor, None
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write)
+    cursor.execute(
+        "SELECT id, sha256, size, file_name, content_type, status FROM attachments WHERE id = %s AND uploader_id = %s AND chat_id = %s",
+        (attachment_id, user_id, chat_id)
+    )
+    return conn, cursor, cursor.fetchone()
+
+
+def init_upload(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    file_name = str(params.get('fileName') or '').strip()[:255]
+    content_type = str(params.get('contentType') or 'application/octet-stream')[:100]
+    size = params.get('size')
+    sha256 = str(params.get('sha256') or '').lower()
+    
+    if not chat_id or not file_name or not isinstance(size, int) or size <= 0 or not SHA256_RE.fullmatch(sha256):
+        return 400, {'error': 'chatId, fileName, size и sha256 обязательны'}
+    
+    if size > MAX_ATTACHMENT_BYTES:
+        return 413, {'error': 'Файл слишком большой'}
+    
+    conn, cursor = on_chat_shard(conn, cursor, chat_id, write=True)
+    
+    execute_prepared(cursor, 'is_member', (chat_id, user_id))
+    
+    if not cursor.fetchone():
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    # Без загрузки байтов отдаём только то содержимое, к которому у пользователя уже есть доступ:
+    # иначе знание хэша давало бы доступ к чужому файлу
+    cursor.execute("""
+        SELECT 1
+        FROM attachments a
+        LEFT JOIN messages m ON m.id = a.message_id
+        WHERE a.sha256 = %s AND a.size = %s AND a.status = 'ready'
+        AND (
+            a.uploader_id = %s
+            OR m.chat_id IN (SELECT chat_id FROM chat_members WHERE user_id = %s)
+        )
+        LIMIT 1
+    """, (sha256, size, user_id, user_id))
+    complete = cursor.fetchone() is not None and get_storage().exists(sha256)
+    
+    cursor.execute("""
+        INSERT INTO attachments (uploader_id, chat_id, sha256, size, file_name, content_type, status)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING id, file_name, content_type, size
+    """, (user_id, chat_id, sha256, size, file_name, content_type, 'ready' if complete else 'uploading'))
+    attachment = cursor.fetchone()
+    
+    conn.commit()
+    
+    return 201, {
+        'attachment': attachment_payload(attachment),
+        'complete': complete,
+        'uploaded': size if complete else 0,
+        'chunkSize': UPLOAD_CHUNK_BYTES
+    }
+
+
+def upload_chunk(conn, cursor, user_id, params):
+    conn, cursor, attachment = load_upload(conn, cursor, user_id, params)
+    
+    if not attachment or attachment['status'] != 'uploading':
+        return 404, {'error': 'Загрузка не найдена'}
+    
+    offset = params.get('offset')
+    try:
+        data = base64.b64decode(params.get('data') or '', validate=True)
+    except (binascii.Error, ValueError):
+        data = b''
+    
+    if not isinstance(offset, int) or offset < 0 or not data or len(data) > UPLOAD_CHUNK_BYTES:
+        return 400, {'error': 'offset и data обязательны'}
+    
+    if offset + len(data) > attachment['size']:
+        return 400, {'error': 'Кусок выходит за размер файла'}
+    
+    uploaded = get_storage().append(attachment['id'], offset, data)
+    
+    if uploaded < offset + len(data):
+        # Кусок не примыкает к загруженному: клиент продолжает с uploaded
+        return 409, {'error': 'Неверное смещение', 'uploaded': uploaded}
+    
+    return 200, {'uploaded': uploaded}
+
+
+def complete_upload(conn, cursor, user_id, params):
+    conn, cursor, attachment = load_upload(conn, cursor, user_id, params, write=True)
+    
+    if not attachment:
+        return 404, {'error': 'Загрузка не найдена'}
+    
+    if attachment['status'] == 'ready':
+        return 200, {'attachment': attachment_payload(attachment)}
+    
+    storage = get_storage()
+    uploaded = storage.uploaded_size(attachment['id'])
+    
+    if uploaded != attachment['size']:
+        return 409, {'error': 'Файл загружен не полностью', 'uploaded': uploaded}
+    
+    if storage.digest(attachment['id']) != attachment['sha256'].strip():
+        storage.discard(attachment['id'])
+        return 422, {'error': 'Контрольная сумма не совпадает', 'uploaded': 0}
+    
+    storage.commit(attachment['id'], attachment['sha256'].strip())
+    
+    cursor.execute(
+        "INSERT INTO attachment_blobs (sha256, size) VALUES (%s, %s) ON CONFLICT (sha256) DO NOTHING",
+        (attachment['sha256'], attachment['size'])
+    )
+    cursor.execute("UPDATE attachments SET status = 'ready' WHERE id = %s", (attachment['id'],))
+    
+    conn.commit()
+    
+    return 200, {'attachment': attachment_payload(attachment)}
+
+
+def upload_status(conn, cursor, user_id, params):
+    conn, cursor, attachment = load_upload(conn, cursor, user_id, params)
+    
+    if not attachment:
+        return 404, {'error': 'Загрузка не найдена'}
+    
+    complete = attachment['status'] == 'ready'
+    return 200, {
+        'complete': complete,
+        'uploaded': attachment['size'] if complete else get_storage().uploaded_size(attachment['id'])
+    }
+
+
+def parse_range(range_header, size):
+    match = RANGE_RE.fullmatch((range_header or '').strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if not match.group(1):
+        # bytes=-N — последние N байт; пустой суффикс (bytes=-0) не выбирает ничего
+        suffix = int(match.group(2))
+        if suffix == 0 or size == 0:
+            return None
+        return max(0, size - suffix), size - 1
+    start = int(match.group(1))
+    end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    if start > end:
+        return None
+    return start, end
+
+
+def download_attachment(conn, cursor, user_id, params):
+    if not params.get('chatId') or not params.get('attachmentId'):
+        return 400, {'error': 'chatId и attachmentId обязательны'}
+    
+    conn, cursor = on_chat_shard(conn, cursor, params['chatId'])
+    
+    cursor.execute("""
+        SELECT a.id, a.sha256, a.size, a.file_name, a.content_type
+        FROM attachments a
+        LEFT JOIN messages m ON m.id = a.message_id
+        WHERE a.id = %s AND a.status = 'ready'
+        AND (
+            a.uploader_id = %s
+            OR EXISTS (SELECT 1 FROM chat_members cm WHERE cm.chat_id = m.chat_id AND cm.user_id = %s)
+        )
+    """, (params.get('attachmentId'), user_id, user_id))
+    attachment = cursor.fetchone()
+    
+    if not attachment:
+        return 404, {'error': 'Вложение не найдено'}
+    
+    event = _current_event.get() or {}
+    range_header = (event.get('headers', {}) or {}).get('Range')
+    size = attachment['size']
+    sha256 = attachment['sha256'].strip()
+    
+    if range_header:
+        byte_range = parse_range(range_header, size)
+        if byte_range is None:
+            return {
+                'statusCode': 416,
+                'headers': {'Content-Range': f'bytes */{size}', 'Access-Control-Allow-Origin': '*'},
+                'body': '',
+                'isBase64Encoded': False
+            }
+        start, end = byte_range
+    else:
+        start, end = 0, size - 1
+    
+    sendfile = (event.get('requestContext', {}) or {}).get('sendfile')
+    if not sendfile:
+        # Облачная функция отдаёт тело целиком: ограничиваем кусок, остальное клиент дочитает Range-запросами
+        end = min(end, start + MAX_RANGE_BYTES - 1)
+    
+    headers = {
+        'Content-Type': attachment['content_type'],
+        'Content-Disposition': f"inline; filename*=UTF-8''{quote(attachment['file_name'])}",
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=31536000, immutable',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'Content-Range, Content-Disposition'
+    }
+    status = 200
+    if range_header or end < size - 1:
+        status = 206
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    
+    if sendfile:
+        # Рантайм сам стримит диапазон файла, не загружая его в память
+        headers['X-Sendfile'] = get_storage().local_path(sha256)
+        return {'statusCode': status, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    
+    data = get_storage().read_range(sha256, start, end - start + 1)
+    return {
+        'statusCode': status,
+        'headers': headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def send_signal(conn, cursor, user_id, params):
+    chat_id = params.get('chatId')
+    kind = params.get('kind')
+    
+    if not chat_id or kind not in SIGNAL_TTL_SECONDS:
+        return 400, {'error': 'chatId и kind (typing или online) обязательны'}
+    
+    # Участие проверяем до лимитов: чужой чат не должен тратить token bucket
+    # и слот схлопывания отправителя
+    _, member_cursor = on_chat_shard(conn, cursor, chat_id)
+    execute_prepared(member_cursor, 'is_member', (chat_id, user_id))
+    
+    if not member_cursor.fetchone():
+        return 403, {'error': 'Нет доступа к этому чату'}
+    
+    ttl = SIGNAL_TTL_SECONDS[kind]
+    decision = admit_signal(user_id, chat_id, kind)
+    
+    if decision == 'coalesced':
+        return 202, {'delivered': False, 'ttl': ttl}
+    
+    if decision == 'limited':
+        return 429, {'error': 'Слишком много сигналов'}
+    
+    publish_signal(conn, cursor, {'type': 'signal', 'chatId': chat_id, 'userId': user_id, 'kind': kind, 'ttl': ttl})
+    
+    return 202, {'delivered': True, 'ttl': ttl}
+
+
+def current_user(conn, cursor, user_id, params):
+    # То же, что GET функции auth
+    cursor.execute(
+        "SELECT id, username, display_name, is_admin, created_at FROM users WHERE id = %s",
+        (user_id,)
+    )
+    user = cursor.fetchone()
+    
+    if not user:
+        return 404, {'error': 'Пользователь не найден'}
+    
+    return 200, {
+        'user': {
+            'id': str(user['id']),
+            'username': user['username'],
+            'displayName': user['display_name'],
+            'isAdmin': user['is_admin'],
+            'createdAt': user['created_at'].isoformat()
+        }
+    }
+
+
+def list_users(conn, cursor, user_id, params):
+    # То же, что GET функции users
+    cursor.execute("""
+        SELECT 
+            id,
+            username,
+            display_name,
+            is_admin,
+            created_at,
+            last_seen,
+            CASE 
+                WHEN last_seen > NOW() - INTERVAL '5 minutes' THEN true
+                ELSE false
+            END as is_online
+        FROM users
+        ORDER BY display_name ASC
+    """)
+    
+    users = cursor.fetchall()
+    
+    return 200, {
+        'users': [
+            {
+                'id': str(user['id']),
+                'username': user['username'],
+                'displayName': user['display_name'],
+                'isAdmin': user['is_admin'],
+                'isOnline': user['is_online'],
+                'lastSeen': user['last_seen'].isoformat(),
+                'createdAt': user['created_at'].isoformat()
+            }
+            for user in users
+        ]
+    }
+
+
+def run_batch(conn, cursor, user_id, params):
+    requests = params.get('requests')
+    
+    if not isinstance(requests, list) or not requests:
+        return 400, {'error': 'requests обязателен'}
+    
+    if len(requests) > MAX_BATCH_SIZE:
+        return 400, {'error': f'Не больше {MAX_BATCH_SIZE} запросов в пакете'}
+    
+    responses = []
+    for request in requests:
+        action = BATCH_ACTIONS.get(request.get('action')) if isinstance(request, dict) else None
+        
+        if action is None:
+            responses.append({'status': 400, 'body': {'error': 'Неизвестное действие'}})
+            continue
+        
+        try:
+            status, payload = action(conn, cursor, user_id, request)
+        except ShardMoving:
+            release_connections()
+            status, payload = 503, {'error': 'Чат переносится, повторите запрос'}
+        except Exception as e:
+            # Откатываем и соединения шардов, которые действие могло открыть
+            release_connections()
+            status, payload = 500, {'error': f'Ошибка сервера: {str(e)}'}
+        
+        responses.append({'status': status, 'body': payload})
+    
+    return 200, {'responses': responses}
+
+
+def is_read_only(action, params):
+    if action == 'batch':
+        requests = params.get('requests')
+        return isinstance(requests, list) and all(
+            isinstance(request, dict) and request.get('action') in READ_ACTIONS for request in requests
+        )
+    return action in READ_ACTIONS
+
+
+GET_ACTIONS = {
+    'list_chats': list_chats,
+    'messages': get_messages,
+    'members': list_members,
+    'upload_status': upload_status,
+    'attachment': download_attachment,
+}
+
+POST_ACTIONS = {
+    'create_chat': create_chat,
+    'send_message': send_message,
+    'batch': run_batch,
+    'create_group': create_group,
+    'add_members': add_members,
+    'remove_members': remove_members,
+    'signal': send_signal,
+    'init_upload': init_upload,
+    'upload_chunk': upload_chunk,
+    'complete_upload': complete_upload,
+}
+
+# Действия, доступные внутри batch: всё, что нужно при открытии мессенджера, за один вызов
+BATCH_ACTIONS = {
+    'list_chats': list_chats,
+    'messages': get_messages,
+    'create_chat': create_chat,
+    'send_message': send_message,
+    'current_user': current_user,
+    'users': list_users,
+    'members': list_members,
+}
+
+# Ничего не пишут в базу: ответ не переводит последующие чтения клиента на primary
+EPHEMERAL_ACTIONS = {'signal'}
+
+READ_ACTIONS = {'list_chats', 'messages', 'current_user', 'users', 'members', 'attachment'}
+
+MAX_BATCH_SIZE = 20
+
+
+def handle(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -40,277 +1743,69 @@ def handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, X-Primary-Until, Range, X-Profile'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
     auth_header = event.get('headers', {}).get('X-Authorization', '')
-    user_id = verify_token(auth_header)
+    with timed('auth'):
+        user_id = verify_token(auth_header)
     
     if not user_id:
-        return {
-            'statusCode': 401,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Не авторизован'}),
-            'isBase64Encoded': False
-        }
+        return json_response(401, {'error': 'Не авторизован'})
+    
+    _current_event.set(event)
+    
+    if method == 'GET':
+        params = event.get('queryStringParameters', {}) or {}
+        action = GET_ACTIONS.get(params.get('action', 'list_chats'))
+    elif method == 'POST':
+        try:
+            params = json.loads(event.get('body') or '{}')
+        except ValueError:
+            params = None
+        if not isinstance(params, dict):
+            return json_response(400, {'error': 'Некорректное тело запроса'})
+        action = POST_ACTIONS.get(params.get('action'))
+    else:
+        action = None
     
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    if action is None:
+        return json_response(405, {'error': 'Метод не поддерживается'})
+    
+    action_name = params.get('action', 'list_chats')
+    read_only = is_read_only(action_name, params)
+    
+    with timed('connect'):
+        conn = get_read_connection(event) if read_only else get_db_connection()
+    cursor = conn.cursor(cursor_factory=TimedCursor)
     
     try:
-        if method == 'GET':
-            query_params = event.get('queryStringParameters', {}) or {}
-            action = query_params.get('action', 'list_chats')
-            
-            if action == 'list_chats':
-                cursor.execute("""
-                    SELECT 
-                        c.id,
-                        c.type,
-                        c.created_at,
-                        json_agg(
-                            json_build_object(
-                                'id', u.id,
-                                'username', u.username,
-                                'displayName', u.display_name,
-                                'isAdmin', u.is_admin
-                            )
-                        ) as participants,
-                        (
-                            SELECT json_build_object(
-                                'id', m.id,
-                                'body', m.body,
-                                'senderId', m.sender_id,
-                                'createdAt', m.created_at
-                            )
-                            FROM messages m
-                            WHERE m.chat_id = c.id
-                            ORDER BY m.created_at DESC
-                            LIMIT 1
-                        ) as last_message,
-                        (
-                            SELECT COUNT(*)
-                            FROM messages m
-                            WHERE m.chat_id = c.id 
-                            AND m.sender_id != %s
-                            AND m.read_at IS NULL
-                        ) as unread_count
-                    FROM chats c
-                    JOIN chat_members cm ON c.id = cm.chat_id
-                    JOIN users u ON cm.user_id = u.id
-                    WHERE c.id IN (
-                        SELECT chat_id FROM chat_members WHERE user_id = %s
-                    )
-                    GROUP BY c.id
-                    ORDER BY c.created_at DESC
-                """, (user_id, user_id))
-                
-                chats = cursor.fetchall()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'chats': [
-                            {
-                                'id': str(chat['id']),
-                                'type': chat['type'],
-                                'participants': chat['participants'],
-                                'lastMessage': chat['last_message'],
-                                'unreadCount': chat['unread_count'],
-                                'createdAt': chat['created_at'].isoformat()
-                            }
-                            for chat in chats
-                        ]
-                    }),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'messages':
-                chat_id = query_params.get('chatId')
-                
-                if not chat_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chatId обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "SELECT user_id FROM chat_members WHERE chat_id = %s AND user_id = %s",
-                    (chat_id, user_id)
-                )
-                
-                if not cursor.fetchone():
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Нет доступа к этому чату'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    SELECT 
-                        m.id,
-                        m.body,
-                        m.sender_id,
-                        m.created_at,
-                        m.read_at
-                    FROM messages m
-                    WHERE m.chat_id = %s
-                    ORDER BY m.created_at ASC
-                """, (chat_id,))
-                
-                messages = cursor.fetchall()
-                
-                cursor.execute(
-                    "UPDATE messages SET read_at = CURRENT_TIMESTAMP WHERE chat_id = %s AND sender_id != %s AND read_at IS NULL",
-                    (chat_id, user_id)
-                )
-                conn.commit()
-                
-                return {
-                    'statusCode': 200,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'messages': [
-                            {
-                                'id': str(msg['id']),
-                                'body': msg['body'],
-                                'senderId': str(msg['sender_id']),
-                                'createdAt': msg['created_at'].isoformat(),
-                                'status': 'read' if msg['read_at'] else 'sent'
-                            }
-                            for msg in messages
-                        ]
-                    }),
-                    'isBase64Encoded': False
-                }
+        if wants_profile(event, cursor, user_id):
+            with profiled(action_name):
+                result = action(conn, cursor, user_id, params)
+        else:
+            result = action(conn, cursor, user_id, params)
         
-        elif method == 'POST':
-            body = json.loads(event.get('body', '{}'))
-            action = body.get('action')
-            
-            if action == 'create_chat':
-                other_user_id = body.get('userId')
-                
-                if not other_user_id:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'userId обязателен'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute("""
-                    SELECT c.id 
-                    FROM chats c
-                    JOIN chat_members cm1 ON c.id = cm1.chat_id
-                    JOIN chat_members cm2 ON c.id = cm2.chat_id
-                    WHERE cm1.user_id = %s AND cm2.user_id = %s
-                    AND c.type = 'direct'
-                    LIMIT 1
-                """, (user_id, other_user_id))
-                
-                existing_chat = cursor.fetchone()
-                
-                if existing_chat:
-                    return {
-                        'statusCode': 200,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'chatId': str(existing_chat['id'])}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "INSERT INTO chats (type) VALUES ('direct') RETURNING id"
-                )
-                chat = cursor.fetchone()
-                chat_id = chat['id']
-                
-                cursor.execute(
-                    "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-                    (chat_id, user_id, chat_id, other_user_id)
-                )
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'chatId': str(chat_id)}),
-                    'isBase64Encoded': False
-                }
-            
-            elif action == 'send_message':
-                chat_id = body.get('chatId')
-                message_body = body.get('body', '').strip()
-                
-                if not chat_id or not message_body:
-                    return {
-                        'statusCode': 400,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'chatId и body обязательны'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "SELECT user_id FROM chat_members WHERE chat_id = %s AND user_id = %s",
-                    (chat_id, user_id)
-                )
-                
-                if not cursor.fetchone():
-                    return {
-                        'statusCode': 403,
-                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                        'body': json.dumps({'error': 'Нет доступа к этому чату'}),
-                        'isBase64Encoded': False
-                    }
-                
-                cursor.execute(
-                    "INSERT INTO messages (chat_id, sender_id, body) VALUES (%s, %s, %s) RETURNING id, created_at",
-                    (chat_id, user_id, message_body)
-                )
-                message = cursor.fetchone()
-                
-                conn.commit()
-                
-                return {
-                    'statusCode': 201,
-                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({
-                        'message': {
-                            'id': str(message['id']),
-                            'chatId': chat_id,
-                            'senderId': user_id,
-                            'body': message_body,
-                            'createdAt': message['created_at'].isoformat(),
-                            'status': 'sent'
-                        }
-                    }),
-                    'isBase64Encoded': False
-                }
+        if isinstance(result, dict):
+            # Действие само собрало ответ (например, бинарное тело вложения)
+            return result
         
-        return {
-            'statusCode': 405,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
-            'isBase64Encoded': False
-        }
+        status, payload = result
+        
+        if not read_only and action_name not in EPHEMERAL_ACTIONS and status < 300:
+            return json_response(status, payload, primary_window_headers())
+        
+        return json_response(status, payload)
+    
+    except ShardMoving:
+        return json_response(503, {'error': 'Чат переносится, повторите запрос'}, {'Retry-After': '1'})
     
     except Exception as e:
-        conn.rollback()
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
-            'isBase64Encoded': False
-        }
+        return json_response(500, {'error': f'Ошибка сервера: {str(e)}'})
     
     finally:
         cursor.close()
-        conn.close()
+        release_connections()
@@ -3,12 +3,27 @@
 """
 import os
 import json
+import contextvars
+import time
+import random
 import psycopg2
 import secrets
 from datetime import datetime, timedelta
+from contextlib import contextmanager
 from psycopg2.extras import RealDictCursor
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL', '')
+READ_REPLICA_URLS = [url.strip() for url in DATABASE_READ_URL.split(',') if url.strip()]
+REPLICA_CONNECT_TIMEOUT = 3
+REPLICA_RETRY_SECONDS = 30
+READ_YOUR_WRITES_SECONDS = 10
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', '200'))
+REQUEST_LOG = os.environ.get('REQUEST_LOG', '1') != '0'
+FUNCTION_NAME = 'init'
+
+_replica_down_until = {}
+_request_timer = contextvars.ContextVar('request_timer', default=None)
 
 
 def get_db_connection():
@@ -16,11 +31,156 @@ def get_db_connection():
     return conn
 
 
+def get_read_connection(event):
+    if not READ_REPLICA_URLS or reads_from_primary(event):
+        return get_db_connection()
+    
+    now = time.time()
+    healthy = [url for url in READ_REPLICA_URLS if _replica_down_until.get(url, 0) <= now]
+    random.shuffle(healthy)
+    
+    for url in healthy:
+        try:
+            return psycopg2.connect(url, connect_timeout=REPLICA_CONNECT_TIMEOUT)
+        except psycopg2.OperationalError:
+            _replica_down_until[url] = now + REPLICA_RETRY_SECONDS
+    
+    return get_db_connection()
+
+
+def reads_from_primary(event):
+    primary_until = (event.get('headers', {}) or {}).get('X-Primary-Until', '')
+    try:
+        primary_until = float(primary_until)
+    except ValueError:
+        return False
+    
+    now = time.time()
+    return now < primary_until <= now + READ_YOUR_WRITES_SECONDS
+
+
+def primary_window_headers():
+    return {
+        'X-Primary-Until': str(int(time.time()) + READ_YOUR_WRITES_SECONDS),
+        'Access-Control-Expose-Headers': 'X-Primary-Until'
+    }
+
+
 def generate_invite_token():
     return secrets.token_urlsafe(16)
 
 
+class TimedCursor(RealDictCursor):
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, vars, (time.perf_counter() - started) * 1000)
+
+
+class RequestTimer:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = {}
+        self.queries = []
+    
+    def add(self, phase, duration_ms):
+        self.phases[phase] = self.phases.get(phase, 0.0) + duration_ms
+    
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+    
+    def server_timing(self):
+        entries = [f'{phase};dur={duration:.1f}' for phase, duration in self.phases.items()]
+        entries.append(f'total;dur={self.total_ms():.1f}')
+        return ', '.join(entries)
+
+
+@contextmanager
+def timed(phase):
+    timer = _request_timer.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timer is not None:
+            timer.add(phase, (time.perf_counter() - started) * 1000)
+
+
+def record_query(query, params, duration_ms):
+    timer = _request_timer.get()
+    statement = ' '.join(str(query).split())
+    
+    if timer is not None:
+        timer.add('db', duration_ms)
+        timer.queries.append({'statement': statement[:80], 'durationMs': round(duration_ms, 2)})
+    
+    if duration_ms >= SLOW_QUERY_MS:
+        log_event({
+            'event': 'slow_query',
+            'function': FUNCTION_NAME,
+            'durationMs': round(duration_ms, 2),
+            'statement': statement,
+            'params': redact_params(params)
+        })
+
+
+def redact_params(params):
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: f'<{type(value).__name__}>' for key, value in params.items()}
+    return [f'<{type(value).__name__}>' for value in params]
+
+
+def dump_json(payload):
+    with timed('serialize'):
+        return json.dumps(payload)
+
+
+def log_event(fields):
+    if REQUEST_LOG:
+        print(json.dumps(fields, default=str), flush=True)
+
+
+def request_action(event):
+    action = (event.get('queryStringParameters') or {}).get('action')
+    if action or event.get('httpMethod') != 'POST':
+        return action
+    try:
+        return json.loads(event.get('body') or '{}').get('action')
+    except (ValueError, AttributeError):
+        return None
+
+
 def handler(event, context):
+    timer = RequestTimer()
+    token = _request_timer.set(timer)
+    try:
+        response = handle(event, context)
+    finally:
+        _request_timer.reset(token)
+    
+    response['headers'] = {
+        **response.get('headers', {}),
+        'Server-Timing': timer.server_timing(),
+        'Timing-Allow-Origin': '*'
+    }
+    log_event({
+        'event': 'request',
+        'function': FUNCTION_NAME,
+        'method': event.get('httpMethod', 'GET'),
+        'action': request_action(event),
+        'status': response.get('statusCode'),
+        'durationMs': round(timer.total_ms(), 2),
+        'phases': {phase: round(duration, 2) for phase, duration in timer.phases.items()},
+        'queries': timer.queries
+    })
+    return response
+
+
+def handle(event, context):
     method = event.get('httpMethod', 'GET')
     
     if method == 'OPTIONS':
@@ -29,14 +189,15 @@ def handler(event, context):
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Primary-Until'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    with timed('connect'):
+        conn = get_read_connection(event) if method == 'GET' else get_db_connection()
+    cursor = conn.cursor(cursor_factory=TimedCursor)
     
     try:
         if method == 'POST':
@@ -47,7 +208,7 @@ def handler(event, context):
                 return {
                     'statusCode': 400,
                     'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                    'body': json.dumps({'error': 'Пользователи уже существуют'}),
+                    'body': dump_json({'error': 'Пользователи уже существуют'}),
                     'isBase64Encoded': False
                 }
             
@@ -64,8 +225,8 @@ def handler(event, context):
             
             return {
                 'statusCode': 201,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*', **primary_window_headers()},
+                'body': dump_json({
                     'invite': {
                         'id': str(invite['id']),
                         'token': token,
@@ -83,7 +244,7 @@ def handler(event, context):
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'body': json.dumps({
+                'body': dump_json({
                     'initialized': user_count > 0,
                     'userCount': user_count
                 }),
@@ -93,7 +254,7 @@ def handler(event, context):
         return {
             'statusCode': 405,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Метод не поддерживается'}),
+            'body': dump_json({'error': 'Метод не поддерживается'}),
             'isBase64Encoded': False
         }
     
@@ -102,7 +263,7 @@ def handler(event, context):
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': f'Ошибка сервера: {str(e)}'}),
+            'body': dump_json({'error': f'Ошибка сервера: {str(e)}'}),
             'isBase64Encoded': False
         }
     
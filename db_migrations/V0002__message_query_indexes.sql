@@ -0,0 +1,8 @@
+-- Messages of a chat are always read ordered by time: history, last message, hot tail
+CREATE INDEX IF NOT EXISTS idx_messages_chat_created_at ON messages(chat_id, created_at);
+
+-- Unread counters and read-state updates only touch unread messages
+CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(chat_id, sender_id) WHERE read_at IS NULL;
+
+-- Covered by idx_messages_chat_created_at
+DROP INDEX IF EXISTS idx_messages_chat_id;
@@ -0,0 +1,23 @@
+-- Content-addressed blobs: one row (and one stored file) per distinct content
+CREATE TABLE IF NOT EXISTS attachment_blobs (
+    sha256 CHAR(64) PRIMARY KEY,
+    size BIGINT NOT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Attachment metadata; forwarding creates a new row pointing at the same blob
+CREATE TABLE IF NOT EXISTS attachments (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    uploader_id UUID REFERENCES users(id),
+    message_id UUID REFERENCES messages(id),
+    sha256 CHAR(64) NOT NULL,
+    size BIGINT NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    content_type VARCHAR(100) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'uploading',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_attachments_message_id ON attachments(message_id);
+CREATE INDEX IF NOT EXISTS idx_attachments_uploader_id ON attachments(uploader_id);
+CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments(sha256);
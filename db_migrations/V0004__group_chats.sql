@@ -0,0 +1,5 @@
+-- Group chats: a title on the chat and a role per member
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS title VARCHAR(100);
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS created_by UUID REFERENCES users(id);
+
+ALTER TABLE chat_members ADD COLUMN IF NOT EXISTS role VARCHAR(20) NOT NULL DEFAULT 'member';
@@ -0,0 +1,19 @@
+-- Shard map: chat-scoped tables (chats, chat_members, messages, attachments, outbox) may live
+-- in several databases; a chat is routed by chat_bucket(chat_id) through this table.
+-- Buckets without a row stay in this (main) database.
+CREATE TABLE IF NOT EXISTS chat_shard_buckets (
+    bucket INTEGER PRIMARY KEY,
+    shard VARCHAR(50) NOT NULL,
+    state VARCHAR(20) NOT NULL DEFAULT 'active',
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Same formula as chat_bucket() in backend/chats/index.py: first 32 bits of md5 of the uuid text
+CREATE OR REPLACE FUNCTION chat_bucket(chat_id UUID, buckets INTEGER) RETURNS INTEGER AS $$
+    SELECT ((('x' || lpad(substr(md5(chat_id::text), 1, 8), 16, '0'))::bit(64)::bigint) % buckets)::integer
+$$ LANGUAGE SQL IMMUTABLE;
+
+-- Attachments belong to a chat so they can move with it
+ALTER TABLE attachments ADD COLUMN IF NOT EXISTS chat_id UUID;
+UPDATE attachments a SET chat_id = m.chat_id FROM messages m WHERE m.id = a.message_id AND a.chat_id IS NULL;
+CREATE INDEX IF NOT EXISTS idx_attachments_chat_id ON attachments(chat_id);
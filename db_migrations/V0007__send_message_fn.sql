@@ -0,0 +1,90 @@
+-- Per-chat counters maintained by the send path
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS last_message_at TIMESTAMP;
+ALTER TABLE chats ADD COLUMN IF NOT EXISTS message_count BIGINT NOT NULL DEFAULT 0;
+
+UPDATE chats c
+SET last_message_at = s.last_message_at, message_count = s.message_count
+FROM (
+    SELECT chat_id, MAX(created_at) as last_message_at, COUNT(*) as message_count
+    FROM messages
+    GROUP BY chat_id
+) s
+WHERE s.chat_id = c.id AND c.message_count = 0;
+
+-- The whole send path in one call: membership check, insert, counters, outbox row and
+-- NOTIFY. Versioned by name: a changed signature or behaviour goes into send_message_v2
+-- in a new migration, so instances still running the old code keep working during deploy.
+-- error is NULL on success or 'not_member'. With notify = false the caller sends the
+-- chat_events notification itself (messages with attachments, see backend/chats).
+CREATE OR REPLACE FUNCTION send_message_v1(
+    p_chat_id UUID,
+    p_sender_id UUID,
+    p_body TEXT,
+    p_notify BOOLEAN DEFAULT TRUE
+) RETURNS TABLE (error TEXT, id UUID, created_at TIMESTAMP, previous_id UUID) AS $$
+DECLARE
+    v_id UUID;
+    v_created_at TIMESTAMP;
+    v_previous_id UUID;
+    v_message JSON;
+    v_event TEXT;
+BEGIN
+    PERFORM 1 FROM chat_members cm WHERE cm.chat_id = p_chat_id AND cm.user_id = p_sender_id;
+    IF NOT FOUND THEN
+        RETURN QUERY SELECT 'not_member'::TEXT, NULL::UUID, NULL::TIMESTAMP, NULL::UUID;
+        RETURN;
+    END IF;
+
+    -- The chat row lock orders concurrent sends: previous_id is exactly the message before
+    -- this one, and created_at is taken after the lock so it grows with that order.
+    -- NO KEY UPDATE is enough for the counters and does not conflict with the KEY SHARE
+    -- locks that foreign key checks take on the chat row (inserts into chat_members,
+    -- attachments and other messages of the chat do not queue behind a send)
+    PERFORM 1 FROM chats c WHERE c.id = p_chat_id FOR NO KEY UPDATE;
+
+    SELECT m.id INTO v_previous_id
+    FROM messages m
+    WHERE m.chat_id = p_chat_id
+    ORDER BY m.created_at DESC
+    LIMIT 1;
+
+    v_created_at := clock_timestamp()::TIMESTAMP;
+    INSERT INTO messages (chat_id, sender_id, body, created_at)
+    VALUES (p_chat_id, p_sender_id, p_body, v_created_at)
+    RETURNING messages.id INTO v_id;
+
+    UPDATE chats
+    SET last_message_at = v_created_at, message_count = message_count + 1
+    WHERE chats.id = p_chat_id;
+
+    INSERT INTO outbox (topic, payload)
+    VALUES ('message_sent', json_build_object(
+        'messageId', v_id,
+        'chatId', p_chat_id,
+        'senderId', p_sender_id,
+        'createdAt', v_created_at
+    ));
+
+    IF p_notify THEN
+        v_message := json_build_object(
+            'id', v_id,
+            'chatId', p_chat_id,
+            'senderId', p_sender_id,
+            'body', p_body,
+            'createdAt', v_created_at,
+            'status', 'sent',
+            'attachments', json_build_array()
+        );
+        v_event := json_build_object('type', 'message', 'chatId', p_chat_id, 'message', v_message)::TEXT;
+        -- Same limit as NOTIFY_PAYLOAD_LIMIT in backend/chats: the gateway refetches the body by id
+        IF octet_length(v_event) > 7900 THEN
+            v_event := json_build_object(
+                'type', 'message', 'chatId', p_chat_id, 'message', json_build_object('id', v_id)
+            )::TEXT;
+        END IF;
+        PERFORM pg_notify('chat_events', v_event);
+    END IF;
+
+    RETURN QUERY SELECT NULL::TEXT, v_id, v_created_at, v_previous_id;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,14 @@
+-- Bulk history import (tools/import_history.py): per-database progress, so a batch and
+-- its checkpoint commit together and a restart resumes after the last committed batch
+CREATE TABLE IF NOT EXISTS import_checkpoints (
+    source VARCHAR(200) PRIMARY KEY,
+    record BIGINT NOT NULL DEFAULT 0,
+    messages BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- Secondary indexes dropped for the duration of an import, rebuilt from here at the end
+CREATE TABLE IF NOT EXISTS import_deferred_indexes (
+    name VARCHAR(200) PRIMARY KEY,
+    definition TEXT NOT NULL
+);
@@ -0,0 +1,18 @@
+"""
+Запуск рантайма: python -m server [--host 0.0.0.0] [--port 8000]
+"""
+import argparse
+
+import uvicorn
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ASGI-рантайм функций мессенджера')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    args = parser.parse_args()
+    uvicorn.run('server.app:app', host=args.host, port=args.port, lifespan='on')
+
+
+if __name__ == '__main__':
+    main()
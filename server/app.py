@@ -0,0 +1,187 @@
+"""
+ASGI-рантайм, который поднимает все функции из backend/ в одном процессе.
+
+Каждая функция монтируется по своему имени из backend/func2url.json
+(`/auth`, `/chats`, ...), WebSocket-шлюз чатов — по пути /chats/ws. HTTP-запрос переводится в событие того же вида,
+что присылает облачная платформа, а `handler(event, context)` выполняется
+в ограниченном пуле потоков: event loop держит тысячи соединений, а к базе
+одновременно обращается не больше SERVER_DB_THREADS обработчиков.
+
+    uvicorn server.app:app --host 0.0.0.0 --port 8000
+"""
+import os
+import re
+import json
+import uuid
+import base64
+import asyncio
+import importlib.util
+from pathlib import Path
+from types import SimpleNamespace
+from urllib.parse import parse_qsl
+from concurrent.futures import ThreadPoolExecutor
+
+from server.realtime import WS_PATH, RealtimeGateway
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / 'backend'
+FUNCTION_NAMES = tuple(json.loads((BACKEND_DIR / 'func2url.json').read_text()))
+SERVER_DB_THREADS = int(os.environ.get('SERVER_DB_THREADS', '32'))
+TEXT_CONTENT_TYPES = ('application/json', 'text/', 'application/x-www-form-urlencoded')
+SENDFILE_CHUNK_BYTES = 64 * 1024
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/\d+')
+
+
+def load_function(name):
+    spec = importlib.util.spec_from_file_location(f'backend_{name}', BACKEND_DIR / name / 'index.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def canonical_header(name):
+    # Платформа отдаёт заголовки в каноничном регистре (X-Authorization), ASGI — в нижнем
+    return '-'.join(part.capitalize() for part in name.split('-'))
+
+
+def build_event(scope, body):
+    headers = {}
+    for raw_name, raw_value in scope['headers']:
+        headers[canonical_header(raw_name.decode('latin-1'))] = raw_value.decode('latin-1')
+    
+    content_type = headers.get('Content-Type', 'application/json')
+    is_text = not body or content_type.startswith(TEXT_CONTENT_TYPES)
+    
+    return {
+        'httpMethod': scope['method'],
+        'path': scope['path'],
+        'headers': headers,
+        'queryStringParameters': dict(parse_qsl(scope['query_string'].decode('latin-1'))),
+        'body': body.decode('utf-8') if is_text else base64.b64encode(body).decode('ascii'),
+        'isBase64Encoded': not is_text,
+        'requestContext': {'requestId': str(uuid.uuid4()), 'sendfile': True},
+    }
+
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            return b''.join(chunks)
+
+
+async def send_response(send, status, headers, body):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+def read_file_range(path, start, length):
+    with open(path, 'rb') as fp:
+        fp.seek(start)
+        return fp.read(length)
+
+
+class FunctionsApp:
+    def __init__(self, function_names=FUNCTION_NAMES, db_threads=SERVER_DB_THREADS):
+        self.functions = {name: load_function(name) for name in function_names}
+        self.executor = ThreadPoolExecutor(max_workers=db_threads, thread_name_prefix='handler')
+        self.gateway = RealtimeGateway(self.executor)
+        chats = self.functions.get('chats')
+        if chats is not None and chats.SIGNAL_BACKEND == 'local':
+            chats.signal_bus.subscribe(self.gateway.publish_local_signal)
+    
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self.http(scope, receive, send)
+        elif scope['type'] == 'websocket':
+            if scope['path'] == WS_PATH:
+                await self.gateway(scope, receive, send)
+            else:
+                await send({'type': 'websocket.close', 'code': 4404})
+    
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await self.gateway.start()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.gateway.stop()
+                self.executor.shutdown(wait=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    
+    def route(self, path):
+        name = path.strip('/').split('/', 1)[0]
+        return self.functions.get(name)
+    
+    async def http(self, scope, receive, send):
+        if scope['path'] == '/healthz':
+            await send_response(send, 200, {'Content-Type': 'application/json'}, b'{"ok": true}')
+            return
+        
+        function = self.route(scope['path'])
+        if function is None:
+            await send_response(send, 404, {'Content-Type': 'application/json'}, b'{"error": "Not found"}')
+            return
+        
+        event = build_event(scope, await read_body(receive))
+        context = SimpleNamespace(request_id=event['requestContext']['requestId'], function_name=function.FUNCTION_NAME)
+        
+        loop = asyncio.get_running_loop()
+        try:
+            response = await loop.run_in_executor(self.executor, function.handler, event, context)
+        except Exception as e:
+            body = json.dumps({'error': f'Ошибка сервера: {str(e)}'}).encode('utf-8')
+            await send_response(send, 500, {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'}, body)
+            return
+        
+        headers = dict(response.get('headers', {}))
+        sendfile_path = headers.pop('X-Sendfile', None)
+        if sendfile_path:
+            await self.sendfile(send, response.get('statusCode', 200), headers, sendfile_path)
+            return
+        
+        body = response.get('body') or ''
+        if response.get('isBase64Encoded'):
+            body = base64.b64decode(body)
+        elif isinstance(body, str):
+            body = body.encode('utf-8')
+        await send_response(send, response.get('statusCode', 200), headers, body)
+    
+    async def sendfile(self, send, status, headers, path):
+        # Функция вернула путь к файлу вместо тела: отдаём диапазон кусками, не держа файл в памяти
+        match = CONTENT_RANGE_RE.fullmatch(headers.get('Content-Range', ''))
+        if match:
+            start, end = int(match.group(1)), int(match.group(2))
+        else:
+            start, end = 0, os.path.getsize(path) - 1
+        headers['Content-Length'] = end - start + 1
+        
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [(name.lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in headers.items()],
+        })
+        
+        loop = asyncio.get_running_loop()
+        offset = start
+        while offset <= end:
+            length = min(SENDFILE_CHUNK_BYTES, end - offset + 1)
+            chunk = await loop.run_in_executor(self.executor, read_file_range, path, offset, length)
+            if not chunk:
+                break
+            offset += len(chunk)
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': offset <= end})
+        if offset <= end:
+            await send({'type': 'http.response.body', 'body': b''})
+
+
+app = FunctionsApp()
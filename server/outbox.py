@@ -0,0 +1,259 @@
+"""
+Воркер транзакционного outbox.
+
+Функция chats пишет в таблицу outbox строку в той же транзакции, что и само
+сообщение, а побочные эффекты (счётчики, уведомления, индексация, вебхуки)
+выполняются здесь, вне пути отправки. Воркер забирает пачки строк через
+FOR UPDATE SKIP LOCKED, поэтому несколько процессов делят очередь без
+повторной обработки; обработчики темы регистрируются декоратором @handles.
+
+Обработчик получает курсор транзакции воркера и payload. Изменения в базе
+фиксируются вместе с удалением строки из outbox; внешние эффекты выполняются
+не меньше одного раза и должны быть идемпотентными. Ошибка откатывает только
+свою строку, строка повторяется с экспоненциальной задержкой, а после
+OUTBOX_MAX_ATTEMPTS попыток помечается failed_at и больше не берётся.
+
+При шардировании чатов outbox есть в базе каждого шарда: воркер запускается
+на шард с OUTBOX_DATABASE_URL, а курсор обработчиков остаётся в основной базе
+(DATABASE_URL). Тогда их изменения фиксируются перед удалением строк outbox,
+и при сбое между двумя коммитами обработчик выполнится повторно.
+
+Без воркера (только облачные функции) строки копятся: --purge DAYS удаляет
+строки старше DAYS дней, его можно запускать по расписанию.
+
+    python -m server.outbox [--once] [--lag] [--purge DAYS]
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import defaultdict
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+OUTBOX_DATABASE_URL = os.environ.get('OUTBOX_DATABASE_URL') or DATABASE_URL
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', '1'))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_MAX_BACKOFF_SECONDS = 300
+OUTBOX_REPORT_SECONDS = 30
+RECONNECT_SECONDS = 2
+
+HANDLERS = defaultdict(list)
+
+
+def handles(topic):
+    def register(handler):
+        HANDLERS[topic].append(handler)
+        return handler
+    return register
+
+
+@handles('message_sent')
+def touch_last_seen(cursor, payload):
+    cursor.execute(
+        "UPDATE users SET last_seen = %s WHERE id = %s AND last_seen < %s",
+        (payload['createdAt'], payload['senderId'], payload['createdAt'])
+    )
+
+
+def log_event(fields):
+    print(json.dumps(fields, default=str), flush=True)
+
+
+def backoff_seconds(attempts):
+    delay = min(OUTBOX_MAX_BACKOFF_SECONDS, 2 ** attempts)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class OutboxWorker:
+    def __init__(self, database_url=OUTBOX_DATABASE_URL, global_url=DATABASE_URL, batch_size=OUTBOX_BATCH_SIZE):
+        self.database_url = database_url
+        self.global_url = global_url
+        self.batch_size = batch_size
+        self.conn = None
+        self.global_conn = None
+        self.processed = 0
+        self.retried = 0
+    
+    def connect(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = psycopg2.connect(self.database_url)
+        return self.conn
+    
+    def connect_global(self):
+        if self.global_url == self.database_url:
+            return self.connect()
+        if self.global_conn is None or self.global_conn.closed:
+            self.global_conn = psycopg2.connect(self.global_url)
+        return self.global_conn
+    
+    def close(self):
+        for conn in (self.conn, self.global_conn):
+            if conn is not None:
+                conn.close()
+        self.conn = None
+        self.global_conn = None
+    
+    def rollback(self):
+        for conn in (self.conn, self.global_conn):
+            if conn is not None and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    conn.close()
+    
+    def run_batch(self):
+        conn = self.connect()
+        global_conn = self.connect_global()
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT id, topic, payload, attempts
+                FROM outbox
+                WHERE failed_at IS NULL AND available_at <= NOW()
+                ORDER BY available_at, id
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            """, (self.batch_size,))
+            rows = cursor.fetchall()
+            
+            handler_cursor = cursor if global_conn is conn else global_conn.cursor(cursor_factory=RealDictCursor)
+            done = []
+            failed = []
+            for row in rows:
+                handler_cursor.execute("SAVEPOINT outbox_row")
+                try:
+                    for handler in HANDLERS.get(row['topic'], ()):
+                        handler(handler_cursor, row['payload'])
+                except Exception as e:
+                    handler_cursor.execute("ROLLBACK TO SAVEPOINT outbox_row")
+                    failed.append((row, e))
+                else:
+                    handler_cursor.execute("RELEASE SAVEPOINT outbox_row")
+                    done.append(row['id'])
+            
+            if global_conn is not conn:
+                handler_cursor.close()
+                global_conn.commit()
+            
+            for row, error in failed:
+                self.reschedule(cursor, row, error)
+            
+            if done:
+                cursor.execute("DELETE FROM outbox WHERE id = ANY(%s)", (done,))
+        conn.commit()
+        
+        self.processed += len(done)
+        return len(rows)
+    
+    def reschedule(self, cursor, row, error):
+        attempts = row['attempts'] + 1
+        self.retried += 1
+        failed = attempts >= OUTBOX_MAX_ATTEMPTS
+        cursor.execute("""
+            UPDATE outbox
+            SET attempts = %s,
+                available_at = NOW() + make_interval(secs => %s),
+                last_error = %s,
+                failed_at = CASE WHEN %s THEN NOW() END
+            WHERE id = %s
+        """, (attempts, backoff_seconds(attempts), repr(error)[:1000], failed, row['id']))
+        log_event({
+            'event': 'outbox_failed' if failed else 'outbox_retry',
+            'id': row['id'],
+            'topic': row['topic'],
+            'attempts': attempts,
+            'error': repr(error)[:1000]
+        })
+    
+    def lag(self):
+        conn = self.connect()
+        with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+            cursor.execute("""
+                SELECT
+                    COUNT(*) FILTER (WHERE failed_at IS NULL) as pending,
+                    COUNT(*) FILTER (WHERE failed_at IS NOT NULL) as failed,
+                    EXTRACT(EPOCH FROM NOW() - MIN(created_at) FILTER (WHERE failed_at IS NULL)) as oldest_seconds
+                FROM outbox
+            """)
+            row = cursor.fetchone()
+        conn.commit()
+        return {
+            'pending': row['pending'],
+            'failed': row['failed'],
+            'oldestSeconds': round(float(row['oldest_seconds'] or 0), 3)
+        }
+    
+    def purge(self, days):
+        conn = self.connect()
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM outbox WHERE created_at < NOW() - make_interval(days => %s)", (days,))
+            deleted = cursor.rowcount
+        conn.commit()
+        return deleted
+    
+    def report(self):
+        log_event({
+            'event': 'outbox_lag',
+            **self.lag(),
+            'processed': self.processed,
+            'retried': self.retried
+        })
+        self.processed = 0
+        self.retried = 0
+    
+    def run_forever(self, poll_seconds=OUTBOX_POLL_SECONDS):
+        next_report = time.monotonic()
+        while True:
+            try:
+                claimed = self.run_batch()
+                if time.monotonic() >= next_report:
+                    self.report()
+                    next_report = time.monotonic() + OUTBOX_REPORT_SECONDS
+            except psycopg2.OperationalError as e:
+                log_event({'event': 'outbox_reconnect', 'error': str(e)})
+                self.close()
+                time.sleep(RECONNECT_SECONDS)
+                continue
+            except psycopg2.Error as e:
+                # Ошибка пачки целиком (сериализация, ограничение при reschedule): строки
+                # остаются в очереди и будут взяты снова, воркер продолжает работу
+                log_event({'event': 'outbox_error', 'error': repr(e)[:1000]})
+                self.rollback()
+                time.sleep(RECONNECT_SECONDS)
+                continue
+            
+            # Полная пачка — очередь не разобрана, берём следующую сразу
+            if claimed < self.batch_size:
+                time.sleep(poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Воркер outbox мессенджера')
+    parser.add_argument('--once', action='store_true', help='разобрать доступные строки и выйти')
+    parser.add_argument('--lag', action='store_true', help='вывести отставание очереди и выйти')
+    parser.add_argument('--purge', type=int, metavar='DAYS', help='удалить строки старше DAYS дней и выйти')
+    args = parser.parse_args()
+    
+    if not DATABASE_URL:
+        sys.exit('DATABASE_URL не задан')
+    
+    worker = OutboxWorker()
+    if args.lag:
+        print(json.dumps(worker.lag()))
+    elif args.purge is not None:
+        log_event({'event': 'outbox_purge', 'days': args.purge, 'deleted': worker.purge(args.purge)})
+    elif args.once:
+        while worker.run_batch() == worker.batch_size:
+            pass
+        worker.report()
+    else:
+        worker.run_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,303 @@
+"""
+WebSocket-шлюз реального времени для чатов.
+
+Клиент подключается к /chats/ws?token=<access token>, шлюз проверяет тот же JWT,
+что и функция chats, и подписывает соединение на все чаты пользователя из
+chat_members. Функция chats после коммита шлёт события через NOTIFY в канал
+chat_events; каждый процесс шлюза слушает канал сам, поэтому несколько процессов
+остаются согласованными без внешнего брокера.
+
+События клиенту: ready (подписка готова, пора перечитать состояние), message,
+read, chat (новый чат), members_removed, signal (печатает / в сети, живёт ttl секунд),
+resync (события могли потеряться — перечитать состояние). Сигналы приходят из канала
+chat_signals или, при SIGNAL_BACKEND=local, напрямую из функции chats в том же процессе.
+
+При шардировании (CHAT_SHARD_URLS) события чата публикуются в базе его шарда,
+поэтому шлюз слушает DATABASE_URL и все шарды.
+"""
+import os
+import json
+import asyncio
+from collections import defaultdict
+from urllib.parse import parse_qs
+
+import jwt
+import psycopg2
+import psycopg2.extensions
+from psycopg2.extras import RealDictCursor
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+CHAT_SHARD_URLS = os.environ.get('CHAT_SHARD_URLS', '')
+LISTEN_URLS = [DATABASE_URL] + [
+    entry.strip().split('=', 1)[1] for entry in CHAT_SHARD_URLS.split(',') if entry.strip()
+]
+JWT_SECRET = os.environ.get('JWT_SECRET', 'change-me-in-production')
+JWT_ALGORITHM = 'HS256'
+EVENTS_CHANNEL = 'chat_events'
+SIGNALS_CHANNEL = 'chat_signals'
+WS_PATH = '/chats/ws'
+CLIENT_QUEUE_SIZE = 256
+LISTENER_RETRY_SECONDS = 2
+
+
+def verify_token(token):
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        return payload['user_id']
+    except (jwt.InvalidTokenError, KeyError):
+        return None
+
+
+class ClientConnection:
+    def __init__(self, user_id, send):
+        self.user_id = user_id
+        self.send = send
+        self.chat_ids = set()
+        self.queue = asyncio.Queue(maxsize=CLIENT_QUEUE_SIZE)
+    
+    def push(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # Клиент не успевает читать: вместо хвоста событий просим перечитать состояние
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({'type': 'resync'})
+    
+    async def pump(self):
+        try:
+            while True:
+                event = await self.queue.get()
+                await self.send({'type': 'websocket.send', 'text': json.dumps(event)})
+        except OSError:
+            # Соединение уже закрыто, отписка произойдёт при websocket.disconnect
+            return
+
+
+class RealtimeGateway:
+    def __init__(self, executor, database_urls=None):
+        self.executor = executor
+        self.database_urls = database_urls or LISTEN_URLS
+        self.chat_clients = defaultdict(set)
+        self.user_clients = defaultdict(set)
+        self.listener_tasks = []
+        self.loop = None
+    
+    async def start(self):
+        if not self.listener_tasks:
+            self.loop = asyncio.get_running_loop()
+            self.listener_tasks = [self.loop.create_task(self.listen(url)) for url in self.database_urls]
+    
+    async def stop(self):
+        for task in self.listener_tasks:
+            task.cancel()
+        self.listener_tasks = []
+    
+    def open_listener(self, url):
+        conn = psycopg2.connect(url)
+        conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+        with conn.cursor() as cursor:
+            cursor.execute(f"LISTEN {EVENTS_CHANNEL}")
+            cursor.execute(f"LISTEN {SIGNALS_CHANNEL}")
+        return conn
+    
+    async def listen(self, url):
+        loop = asyncio.get_running_loop()
+        reconnecting = False
+        
+        while True:
+            try:
+                conn = await loop.run_in_executor(self.executor, self.open_listener, url)
+            except psycopg2.OperationalError:
+                await asyncio.sleep(LISTENER_RETRY_SECONDS)
+                continue
+            
+            if reconnecting:
+                # Пока слушатель был отключён, события могли пройти мимо
+                self.broadcast({'type': 'resync'})
+            reconnecting = True
+            
+            readable = asyncio.Event()
+            loop.add_reader(conn.fileno(), readable.set)
+            try:
+                while True:
+                    await readable.wait()
+                    readable.clear()
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        if notify.channel == SIGNALS_CHANNEL:
+                            self.deliver_signal(notify.payload)
+                        else:
+                            await self.dispatch(notify.payload, url)
+            except psycopg2.Error:
+                pass
+            finally:
+                loop.remove_reader(conn.fileno())
+                conn.close()
+            
+            await asyncio.sleep(LISTENER_RETRY_SECONDS)
+    
+    async def dispatch(self, payload, url):
+        try:
+            event = json.loads(payload)
+            chat_id = event['chatId']
+        except (ValueError, KeyError, TypeError):
+            return
+        
+        if event.get('type') == 'chat':
+            for user_id in event.get('memberIds', []):
+                for client in self.user_clients.get(user_id, ()):
+                    self.subscribe(client, chat_id)
+        elif event.get('type') == 'members_removed':
+            # Удалённые получают событие последним и больше не видят сообщений чата
+            for user_id in event.get('memberIds', []):
+                for client in self.user_clients.get(user_id, ()):
+                    client.push(event)
+                    self.unsubscribe(client, chat_id)
+        
+        clients = list(self.chat_clients.get(chat_id, ()))
+        if not clients:
+            return
+        
+        if event.get('type') == 'message' and 'body' not in event.get('message', {}):
+            loop = asyncio.get_running_loop()
+            message = await loop.run_in_executor(self.executor, self.fetch_message, url, event['message']['id'])
+            if message is None:
+                return
+            event = {**event, 'message': message}
+        
+        for client in clients:
+            client.push(event)
+    
+    def deliver_signal(self, signal):
+        if isinstance(signal, str):
+            try:
+                signal = json.loads(signal)
+            except ValueError:
+                return
+        # Сигналы не буферизуются и не догоняются после resync: устаревший «печатает» не нужен
+        for client in list(self.chat_clients.get(signal.get('chatId'), ())):
+            if client.user_id != signal.get('userId'):
+                client.push(signal)
+    
+    def publish_local_signal(self, signal):
+        # Вызывается из потока обработчика chats, доставка — в event loop шлюза
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.deliver_signal, signal)
+    
+    def broadcast(self, event):
+        for clients in self.user_clients.values():
+            for client in clients:
+                client.push(event)
+    
+    def query(self, url, sql, params):
+        conn = psycopg2.connect(url)
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(sql, params)
+                return cursor.fetchall()
+        finally:
+            conn.close()
+    
+    def load_chat_ids(self, user_id):
+        # Во время переноса чат есть на двух шардах — множество убирает повтор
+        return sorted({
+            str(row['chat_id'])
+            for url in self.database_urls
+            for row in self.query(url, "SELECT chat_id FROM chat_members WHERE user_id = %s", (user_id,))
+        })
+    
+    def fetch_message(self, url, message_id):
+        # Вложения — тем же подзапросом, что и в get_messages функции chats
+        rows = self.query(
+            url,
+            """
+                SELECT
+                    m.id,
+                    m.chat_id,
+                    m.sender_id,
+                    m.body,
+                    m.created_at,
+                    m.read_at,
+                    (
+                        SELECT json_agg(json_build_object(
+                            'id', a.id,
+                            'fileName', a.file_name,
+                            'contentType', a.content_type,
+                            'size', a.size
+                        ))
+                        FROM attachments a
+                        WHERE a.message_id = m.id
+                    ) as attachments
+                FROM messages m
+                WHERE m.id = %s
+            """,
+            (message_id,)
+        )
+        if not rows:
+            return None
+        message = rows[0]
+        return {
+            'id': str(message['id']),
+            'chatId': str(message['chat_id']),
+            'senderId': str(message['sender_id']),
+            'body': message['body'],
+            'createdAt': message['created_at'].isoformat(),
+            'status': 'read' if message['read_at'] else 'sent',
+            'attachments': message['attachments'] or []
+        }
+    
+    def subscribe(self, client, chat_id):
+        client.chat_ids.add(chat_id)
+        self.chat_clients[chat_id].add(client)
+    
+    def unsubscribe(self, client, chat_id):
+        client.chat_ids.discard(chat_id)
+        self.chat_clients[chat_id].discard(client)
+        if not self.chat_clients[chat_id]:
+            del self.chat_clients[chat_id]
+    
+    def unregister(self, client):
+        self.user_clients[client.user_id].discard(client)
+        if not self.user_clients[client.user_id]:
+            del self.user_clients[client.user_id]
+        for chat_id in client.chat_ids:
+            self.chat_clients[chat_id].discard(client)
+            if not self.chat_clients[chat_id]:
+                del self.chat_clients[chat_id]
+    
+    async def __call__(self, scope, receive, send):
+        await self.start()
+        
+        message = await receive()
+        if message['type'] != 'websocket.connect':
+            return
+        
+        token = parse_qs(scope['query_string'].decode('latin-1')).get('token', [''])[0]
+        user_id = verify_token(token)
+        if not user_id:
+            await send({'type': 'websocket.close', 'code': 4401})
+            return
+        
+        await send({'type': 'websocket.accept'})
+        client = ClientConnection(user_id, send)
+        # Сначала регистрируемся, потом читаем членство: события о новых чатах не потеряются
+        self.user_clients[user_id].add(client)
+        pump = asyncio.get_running_loop().create_task(client.pump())
+        
+        try:
+            loop = asyncio.get_running_loop()
+            for chat_id in await loop.run_in_executor(self.executor, self.load_chat_ids, user_id):
+                self.subscribe(client, chat_id)
+            client.push({'type': 'ready', 'chatIds': sorted(client.chat_ids)})
+            
+            while True:
+                message = await receive()
+                if message['type'] == 'websocket.disconnect':
+                    break
+                if message.get('text') == 'ping':
+                    client.push({'type': 'pong'})
+        finally:
+            self.unregister(client)
+            pump.cancel()
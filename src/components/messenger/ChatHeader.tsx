@@ -1,4 +1,4 @@
-import { User } from '@/types';
+import { Chat, User } from '@/types';
 import { Avatar, AvatarFallback } from '@/components/ui/avatar';
 import { Button } from '@/components/ui/button';
 import Icon from '@/components/ui/icon';
@@ -10,12 +10,22 @@ import {
 } from '@/components/ui/dropdown-menu';
 
 interface ChatHeaderProps {
-  otherUser: User;
+  chat: Chat;
+  otherUser?: User;
+  typingUsers?: User[];
   onBack?: () => void;
   onUserClick: () => void;
 }
 
-export const ChatHeader = ({ otherUser, onBack, onUserClick }: ChatHeaderProps) => {
+const formatMemberCount = (count: number): string => {
+  const mod10 = count % 10;
+  const mod100 = count % 100;
+  if (mod10 === 1 && mod100 !== 11) return `${count} участник`;
+  if (mod10 >= 2 && mod10 <= 4 && (mod100 < 12 || mod100 > 14)) return `${count} участника`;
+  return `${count} участников`;
+};
+
+export const ChatHeader = ({ chat, otherUser, typingUsers = [], onBack, onUserClick }: ChatHeaderProps) => {
   const getInitials = (name: string): string => {
     return name
       .split(' ')
@@ -25,6 +35,20 @@ export const ChatHeader = ({ otherUser, onBack, onUserClick }: ChatHeaderProps)
       .slice(0, 2);
   };
 
+  const isGroup = chat.type === 'group';
+  const title = isGroup ? chat.title || 'Группа' : otherUser?.displayName || '';
+  const isOnline = !isGroup && otherUser?.isOnline;
+
+  const status = () => {
+    if (typingUsers.length > 0) {
+      if (!isGroup) return 'печатает…';
+      const names = typingUsers.map(user => user.displayName).join(', ');
+      return typingUsers.length === 1 ? `${names} печатает…` : `${names} печатают…`;
+    }
+    if (isGroup) return formatMemberCount(chat.memberCount);
+    return isOnline ? 'В сети' : 'Не в сети';
+  };
+
   return (
     <div className="border-b bg-card/50 backdrop-blur-sm sticky top-0 z-10">
       <div className="flex items-center gap-3 p-4">
@@ -46,19 +70,17 @@ export const ChatHeader = ({ otherUser, onBack, onUserClick }: ChatHeaderProps)
           <div className="relative">
             <Avatar className="h-10 w-10 border-2 border-primary/20">
               <AvatarFallback className="gradient-primary text-white font-semibold text-sm">
-                {getInitials(otherUser.displayName)}
+                {isGroup ? <Icon name="Users" size={18} /> : getInitials(title)}
               </AvatarFallback>
             </Avatar>
-            {otherUser.isOnline && (
+            {isOnline && (
               <div className="absolute -bottom-0.5 -right-0.5 h-3 w-3 bg-green-500 border-2 border-card rounded-full" />
             )}
           </div>
 
           <div className="flex-1 min-w-0">
-            <h3 className="font-semibold truncate">{otherUser.displayName}</h3>
-            <p className="text-sm text-muted-foreground">
-              {otherUser.isOnline ? 'В сети' : 'Не в сети'}
-            </p>
+            <h3 className="font-semibold truncate">{title}</h3>
+            <p className="text-sm text-muted-foreground truncate">{status()}</p>
           </div>
         </button>
 
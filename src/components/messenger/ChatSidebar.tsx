@@ -71,6 +71,7 @@ export const ChatSidebar = ({
         <div className="p-2 space-y-1">
           {chats.map((chat) => {
             const otherUser = getOtherParticipant(chat);
+            const chatName = chat.type === 'group' ? chat.title || 'Группа' : otherUser.displayName;
             const isSelected = chat.id === selectedChatId;
 
             return (
@@ -86,10 +87,10 @@ export const ChatSidebar = ({
                 <div className="relative">
                   <Avatar className="h-12 w-12 border-2 border-primary/20">
                     <AvatarFallback className="gradient-primary text-white font-semibold">
-                      {getInitials(otherUser.displayName)}
+                      {getInitials(chatName)}
                     </AvatarFallback>
                   </Avatar>
-                  {otherUser.isOnline && (
+                  {chat.type === 'direct' && otherUser.isOnline && (
                     <div className="absolute -bottom-0.5 -right-0.5 h-3.5 w-3.5 bg-green-500 border-2 border-card rounded-full" />
                   )}
                 </div>
@@ -97,7 +98,7 @@ export const ChatSidebar = ({
                 <div className="flex-1 min-w-0">
                   <div className="flex items-center justify-between mb-1">
                     <span className="font-semibold text-sm truncate">
-                      {otherUser.displayName}
+                      {chatName}
                     </span>
                     {chat.lastMessage && (
                       <span className="text-xs text-muted-foreground ml-2">
@@ -5,10 +5,11 @@ import Icon from '@/components/ui/icon';
 
 interface MessageInputProps {
   onSend: (message: string) => void;
+  onTyping?: () => void;
   disabled?: boolean;
 }
 
-export const MessageInput = ({ onSend, disabled }: MessageInputProps) => {
+export const MessageInput = ({ onSend, onTyping, disabled }: MessageInputProps) => {
   const [message, setMessage] = useState('');
 
   const handleSend = () => {
@@ -31,7 +32,12 @@ export const MessageInput = ({ onSend, disabled }: MessageInputProps) => {
       <div className="flex items-end gap-2 max-w-4xl mx-auto">
         <Textarea
           value={message}
-          onChange={(e) => setMessage(e.target.value)}
+          onChange={(e) => {
+            setMessage(e.target.value);
+            if (e.target.value.trim()) {
+              onTyping?.();
+            }
+          }}
           onKeyDown={handleKeyDown}
           placeholder="Напишите сообщение..."
           disabled={disabled}
@@ -1,16 +1,31 @@
 import { Message, User } from '@/types';
 import { ScrollArea } from '@/components/ui/scroll-area';
 import { Avatar, AvatarFallback } from '@/components/ui/avatar';
+import { Button } from '@/components/ui/button';
 import { cn } from '@/lib/utils';
 import Icon from '@/components/ui/icon';
 
 interface MessageListProps {
   messages: Message[];
   currentUserId: string;
-  otherUser: User;
+  chatTitle: string;
+  isGroup?: boolean;
+  getSender: (userId: string) => User | undefined;
+  hasOlder?: boolean;
+  isLoadingOlder?: boolean;
+  onLoadOlder?: () => void;
 }
 
-export const MessageList = ({ messages, currentUserId, otherUser }: MessageListProps) => {
+export const MessageList = ({
+  messages,
+  currentUserId,
+  chatTitle,
+  isGroup = false,
+  getSender,
+  hasOlder = false,
+  isLoadingOlder = false,
+  onLoadOlder,
+}: MessageListProps) => {
   const getInitials = (name: string): string => {
     return name
       .split(' ')
@@ -36,7 +51,9 @@ export const MessageList = ({ messages, currentUserId, otherUser }: MessageListP
           </div>
           <h3 className="text-lg font-semibold">Начните общение</h3>
           <p className="text-sm text-muted-foreground max-w-sm">
-            Отправьте первое сообщение, чтобы начать чат с {otherUser.displayName}
+            {isGroup
+              ? `Отправьте первое сообщение в «${chatTitle}»`
+              : `Отправьте первое сообщение, чтобы начать чат с ${chatTitle}`}
           </p>
         </div>
       </div>
@@ -46,9 +63,18 @@ export const MessageList = ({ messages, currentUserId, otherUser }: MessageListP
   return (
     <ScrollArea className="flex-1 p-4">
       <div className="space-y-4 max-w-4xl mx-auto">
+        {hasOlder && onLoadOlder && (
+          <div className="flex justify-center">
+            <Button variant="ghost" size="sm" onClick={onLoadOlder} disabled={isLoadingOlder}>
+              {isLoadingOlder ? 'Загрузка...' : 'Показать более ранние сообщения'}
+            </Button>
+          </div>
+        )}
         {messages.map((message, index) => {
           const isOwn = message.senderId === currentUserId;
           const showAvatar = !isOwn && (index === 0 || messages[index - 1].senderId !== message.senderId);
+          // Автор — по senderId: в группе входящие сообщения пишут разные участники
+          const senderName = getSender(message.senderId)?.displayName || 'Участник';
 
           return (
             <div
@@ -63,7 +89,7 @@ export const MessageList = ({ messages, currentUserId, otherUser }: MessageListP
                   {showAvatar ? (
                     <Avatar className="h-8 w-8 border border-primary/20">
                       <AvatarFallback className="gradient-primary text-white text-xs font-semibold">
-                        {getInitials(otherUser.displayName)}
+                        {getInitials(senderName)}
                       </AvatarFallback>
                     </Avatar>
                   ) : (
@@ -78,6 +104,9 @@ export const MessageList = ({ messages, currentUserId, otherUser }: MessageListP
                   isOwn && 'flex flex-col items-end'
                 )}
               >
+                {isGroup && showAvatar && (
+                  <span className="text-xs font-medium text-primary px-1">{senderName}</span>
+                )}
                 <div
                   className={cn(
                     'rounded-2xl px-4 py-2.5 shadow-sm',
@@ -23,6 +23,11 @@ export const useAuth = () => {
     setIsLoading(false);
   }, [navigate]);
 
+  const updateCurrentUser = (user: User) => {
+    localStorage.setItem('currentUser', JSON.stringify(user));
+    setCurrentUser(user);
+  };
+
   const logout = () => {
     clearTokens();
     localStorage.removeItem('currentUser');
@@ -30,5 +35,5 @@ export const useAuth = () => {
     navigate('/auth');
   };
 
-  return { currentUser, isLoading, logout };
+  return { currentUser, isLoading, updateCurrentUser, logout };
 };
@@ -1,17 +1,41 @@
-import { useState, useEffect } from 'react';
-import { chatsApi } from '@/lib/api';
-import { Chat, Message } from '@/types';
+import { useState, useEffect, useRef } from 'react';
+import { chatsApi, isRealtimeOpen, subscribeRealtime } from '@/lib/api';
+import { Chat, Message, User } from '@/types';
 
-export const useChats = () => {
+export const useChats = (currentUserId?: string) => {
   const [chats, setChats] = useState<Chat[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [bootstrap, setBootstrap] = useState<{ currentUser?: User; users?: User[] }>({});
+  const userId = useRef(currentUserId);
+  userId.current = currentUserId;
+  const wasConnected = useRef(false);
+  const knownChats = useRef(chats);
+  knownChats.current = chats;
 
-  const loadChats = async () => {
+  const loadChats = async (initial = false) => {
     try {
       setIsLoading(true);
-      const response = await chatsApi.listChats();
-      setChats(response.chats || []);
+      if (initial) {
+        // Открытие мессенджера — один вызов: свежий профиль, список чатов и участники
+        const { responses } = await chatsApi.batch([
+          { action: 'current_user' },
+          { action: 'list_chats' },
+          { action: 'users' },
+        ]);
+        const [user, list, users] = responses;
+        if (list.status !== 200) {
+          throw new Error(list.body.error);
+        }
+        setChats(list.body.chats || []);
+        setBootstrap({
+          currentUser: user.status === 200 ? user.body.user : undefined,
+          users: users.status === 200 ? users.body.users : undefined,
+        });
+      } else {
+        const response = await chatsApi.listChats();
+        setChats(response.chats || []);
+      }
       setError(null);
     } catch (err: any) {
       setError(err.message);
@@ -20,17 +44,105 @@ export const useChats = () => {
     }
   };
 
+  const updateChat = (chatId: string, update: (chat: Chat) => Chat) => {
+    setChats(prev => prev.map(chat => (chat.id === chatId ? update(chat) : chat)));
+  };
+
+  // Список обновляется из самих событий; перечитываем его только при новом
+  // чате (в событии нет его данных) и когда события могли потеряться
+  const applyEvent = (event: any) => {
+    if (event.type === 'ready') {
+      if (wasConnected.current) loadChats();
+      wasConnected.current = true;
+    } else if (event.type === 'resync') {
+      loadChats();
+    } else if (event.type === 'message') {
+      if (!knownChats.current.some(chat => chat.id === event.chatId)) {
+        loadChats();
+        return;
+      }
+      const isIncoming = event.message.senderId !== userId.current;
+      updateChat(event.chatId, chat => ({
+        ...chat,
+        lastMessage: event.message,
+        unreadCount: chat.unreadCount + (isIncoming ? 1 : 0),
+      }));
+    } else if (event.type === 'read') {
+      if (event.readerId === userId.current) {
+        updateChat(event.chatId, chat => ({ ...chat, unreadCount: 0 }));
+      }
+    } else if (event.type === 'chat') {
+      loadChats();
+    } else if (event.type === 'members_removed') {
+      if (event.memberIds.includes(userId.current)) {
+        setChats(prev => prev.filter(chat => chat.id !== event.chatId));
+      } else {
+        updateChat(event.chatId, chat => ({
+          ...chat,
+          memberCount: Math.max(0, chat.memberCount - event.memberIds.length),
+          participants: chat.participants.filter(p => !event.memberIds.includes(p.id)),
+        }));
+      }
+    }
+  };
+
   useEffect(() => {
-    loadChats();
+    loadChats(true);
+    
+    return subscribeRealtime(applyEvent);
   }, []);
 
-  return { chats, isLoading, error, refetch: loadChats };
+  return { chats, isLoading, error, bootstrap, refetch: () => loadChats() };
 };
 
+const ONLINE_HEARTBEAT_MS = 15000;
+const TYPING_THROTTLE_MS = 3000;
+
 export const useMessages = (chatId: string | undefined) => {
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(true);
   const [error, setError] = useState<string | null>(null);
+  const [signals, setSignals] = useState<Record<string, number>>({});
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false);
+  const lastTypingAt = useRef(0);
+  const currentChatId = useRef(chatId);
+  currentChatId.current = chatId;
+
+  const applySignal = (key: string, ttl: number) => {
+    const expiresAt = Date.now() + ttl * 1000;
+    setSignals(prev => ({ ...prev, [key]: expiresAt }));
+    setTimeout(() => {
+      setSignals(prev => {
+        if (prev[key] !== expiresAt) return prev;
+        const { [key]: _expired, ...rest } = prev;
+        return rest;
+      });
+    }, ttl * 1000);
+  };
+
+  const clearSignal = (key: string) => {
+    setSignals(prev => {
+      if (!(key in prev)) return prev;
+      const { [key]: _cleared, ...rest } = prev;
+      return rest;
+    });
+  };
+
+  const sendSignal = (kind: 'typing' | 'online') => {
+    // Без открытого сокета сигналы некому доставить, а каждый стоит вызова функции,
+    // проверки участия и NOTIFY в primary — в облаке без шлюза их не шлём вовсе
+    if (!chatId || !isRealtimeOpen()) return;
+    // Сигналы одноразовые: отказ (в том числе 429) просто пропускаем
+    chatsApi.signal(chatId, kind).catch(() => {});
+  };
+
+  const notifyTyping = () => {
+    const now = Date.now();
+    if (now - lastTypingAt.current < TYPING_THROTTLE_MS) return;
+    lastTypingAt.current = now;
+    sendSignal('typing');
+  };
 
   const loadMessages = async () => {
     if (!chatId) return;
@@ -39,6 +151,7 @@ export const useMessages = (chatId: string | undefined) => {
       setIsLoading(true);
       const response = await chatsApi.getMessages(chatId);
       setMessages(response.messages || []);
+      setNextCursor(response.nextCursor || null);
       setError(null);
     } catch (err: any) {
       setError(err.message);
@@ -47,6 +160,25 @@ export const useMessages = (chatId: string | undefined) => {
     }
   };
 
+  // Сервер отдаёт историю страницами с конца: более ранние сообщения
+  // догружаются по nextCursor и добавляются в начало списка
+  const loadOlder = async () => {
+    if (!chatId || !nextCursor || isLoadingOlder) return;
+    
+    try {
+      setIsLoadingOlder(true);
+      const response = await chatsApi.getMessages(chatId, nextCursor);
+      if (currentChatId.current !== chatId) return;
+      const older: Message[] = response.messages || [];
+      setMessages(prev => [...older.filter(m => !prev.some(p => p.id === m.id)), ...prev]);
+      setNextCursor(response.nextCursor || null);
+    } catch (err: any) {
+      setError(err.message);
+    } finally {
+      setIsLoadingOlder(false);
+    }
+  };
+
   const sendMessage = async (body: string) => {
     if (!chatId) return;
 
@@ -60,7 +192,58 @@ export const useMessages = (chatId: string | undefined) => {
 
   useEffect(() => {
     loadMessages();
+    
+    const unsubscribe = subscribeRealtime((event) => {
+      if (event.type === 'ready' || event.type === 'resync') {
+        loadMessages();
+        if (event.type === 'ready') sendSignal('online');
+      } else if (event.chatId !== chatId) {
+        return;
+      } else if (event.type === 'signal') {
+        applySignal(`${event.kind}:${event.userId}`, event.ttl);
+      } else if (event.type === 'message') {
+        clearSignal(`typing:${event.message.senderId}`);
+        setMessages(prev =>
+          prev.some(m => m.id === event.message.id) ? prev : [...prev, event.message]
+        );
+      } else if (event.type === 'read') {
+        setMessages(prev =>
+          prev.map(m =>
+            m.senderId !== event.readerId && String(m.createdAt) <= event.readUntil
+              ? { ...m, status: 'read' }
+              : m
+          )
+        );
+      }
+    });
+    
+    setSignals({});
+    setNextCursor(null);
+    sendSignal('online');
+    const heartbeat = setInterval(() => sendSignal('online'), ONLINE_HEARTBEAT_MS);
+    
+    return () => {
+      unsubscribe();
+      clearInterval(heartbeat);
+    };
   }, [chatId]);
 
-  return { messages, isLoading, error, sendMessage, refetch: loadMessages };
+  const activeUserIds = (kind: string) =>
+    Object.keys(signals)
+      .filter(key => key.startsWith(`${kind}:`))
+      .map(key => key.slice(kind.length + 1));
+
+  return {
+    messages,
+    isLoading,
+    error,
+    hasOlder: nextCursor !== null,
+    isLoadingOlder,
+    loadOlder,
+    sendMessage,
+    notifyTyping,
+    typingUserIds: activeUserIds('typing'),
+    onlineUserIds: activeUserIds('online'),
+    refetch: loadMessages,
+  };
 };
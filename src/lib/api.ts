@@ -6,6 +6,8 @@ const API_URLS = {
   init: 'https://functions.poehali.dev/209a2754-1be3-4d5f-8ac7-d7ac18ab33ad',
 };
 
+const REALTIME_URL = import.meta.env.VITE_REALTIME_URL as string | undefined;
+
 export const getAuthToken = (): string | null => {
   return localStorage.getItem('accessToken');
 };
@@ -18,11 +20,90 @@ export const setRefreshToken = (token: string) => {
   localStorage.setItem('refreshToken', token);
 };
 
+export const getPrimaryUntil = (): string | null => {
+  const primaryUntil = localStorage.getItem('primaryUntil');
+  if (!primaryUntil || Number(primaryUntil) <= Date.now() / 1000) {
+    return null;
+  }
+  return primaryUntil;
+};
+
+export const setPrimaryUntil = (response: Response) => {
+  const primaryUntil = response.headers.get('X-Primary-Until');
+  if (primaryUntil) {
+    localStorage.setItem('primaryUntil', primaryUntil);
+  }
+};
+
 export const clearTokens = () => {
   localStorage.removeItem('accessToken');
   localStorage.removeItem('refreshToken');
 };
 
+const REALTIME_RETRY_MIN_MS = 1000;
+const REALTIME_RETRY_MAX_MS = 30000;
+
+type RealtimeListener = (event: any) => void;
+
+// Одно соединение на вкладку для всех хуков: события раздаются подписчикам,
+// а после обрыва соединение восстанавливается с экспоненциальной задержкой
+const realtimeListeners = new Set<RealtimeListener>();
+let realtimeSocket: WebSocket | null = null;
+let realtimeRetryTimer: ReturnType<typeof setTimeout> | null = null;
+let realtimeAttempts = 0;
+
+const emitRealtime = (event: any) => {
+  realtimeListeners.forEach((listener) => listener(event));
+};
+
+const connectRealtime = () => {
+  const token = getAuthToken();
+  if (!REALTIME_URL || !token || realtimeSocket || realtimeRetryTimer || realtimeListeners.size === 0) {
+    return;
+  }
+  
+  const socket = new WebSocket(`${REALTIME_URL}?token=${encodeURIComponent(token)}`);
+  realtimeSocket = socket;
+  socket.onopen = () => {
+    realtimeAttempts = 0;
+  };
+  socket.onmessage = (message) => emitRealtime(JSON.parse(message.data));
+  socket.onclose = () => {
+    if (realtimeSocket !== socket) return;
+    realtimeSocket = null;
+    emitRealtime({ type: 'disconnected' });
+    if (realtimeListeners.size === 0) return;
+    
+    const delay = Math.min(REALTIME_RETRY_MAX_MS, REALTIME_RETRY_MIN_MS * 2 ** realtimeAttempts);
+    realtimeAttempts += 1;
+    realtimeRetryTimer = setTimeout(() => {
+      realtimeRetryTimer = null;
+      connectRealtime();
+    }, delay * (0.5 + Math.random() / 2));
+  };
+};
+
+export const subscribeRealtime = (listener: RealtimeListener): (() => void) => {
+  realtimeListeners.add(listener);
+  connectRealtime();
+  
+  return () => {
+    realtimeListeners.delete(listener);
+    if (realtimeListeners.size > 0) return;
+    if (realtimeRetryTimer) {
+      clearTimeout(realtimeRetryTimer);
+      realtimeRetryTimer = null;
+    }
+    const socket = realtimeSocket;
+    realtimeSocket = null;
+    socket?.close();
+  };
+};
+
+export const isRealtimeOpen = (): boolean => {
+  return realtimeSocket?.readyState === WebSocket.OPEN;
+};
+
 export const apiRequest = async (
   url: string,
   options: RequestInit = {}
@@ -38,11 +119,18 @@ export const apiRequest = async (
     headers['Authorization'] = `Bearer ${token}`;
   }
   
+  const primaryUntil = getPrimaryUntil();
+  if (primaryUntil) {
+    headers['X-Primary-Until'] = primaryUntil;
+  }
+  
   const response = await fetch(url, {
     ...options,
     headers,
   });
   
+  setPrimaryUntil(response);
+  
   if (!response.ok && response.status === 401) {
     clearTokens();
     window.location.href = '/auth';
@@ -52,7 +140,11 @@ export const apiRequest = async (
   const data = await response.json();
   
   if (!response.ok) {
-    throw new Error(data.error || 'Request failed');
+    // Статус и тело ответа нужны вызывающему коду, например 409 с подтверждённым смещением
+    const error: any = new Error(data.error || 'Request failed');
+    error.status = response.status;
+    error.data = data;
+    throw error;
   }
   
   return data;
@@ -93,8 +185,9 @@ export const chatsApi = {
     return apiRequest(`${API_URLS.chats}?action=list_chats`);
   },
   
-  getMessages: async (chatId: string) => {
-    return apiRequest(`${API_URLS.chats}?action=messages&chatId=${chatId}`);
+  getMessages: async (chatId: string, before?: string) => {
+    const cursor = before ? `&before=${before}` : '';
+    return apiRequest(`${API_URLS.chats}?action=messages&chatId=${chatId}${cursor}`);
   },
   
   createChat: async (userId: string) => {
@@ -107,13 +200,175 @@ export const chatsApi = {
     });
   },
   
-  sendMessage: async (chatId: string, body: string) => {
+  createGroup: async (title: string, memberIds: string[]) => {
+    return apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'create_group',
+        title,
+        memberIds,
+      }),
+    });
+  },
+  
+  addMembers: async (chatId: string, userIds: string[]) => {
+    return apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'add_members',
+        chatId,
+        userIds,
+      }),
+    });
+  },
+  
+  removeMembers: async (chatId: string, userIds: string[]) => {
+    return apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'remove_members',
+        chatId,
+        userIds,
+      }),
+    });
+  },
+  
+  getMembers: async (chatId: string, after?: string) => {
+    const cursor = after ? `&after=${after}` : '';
+    return apiRequest(`${API_URLS.chats}?action=members&chatId=${chatId}${cursor}`);
+  },
+  
+  sendMessage: async (chatId: string, body: string, attachmentIds: string[] = []) => {
     return apiRequest(API_URLS.chats, {
       method: 'POST',
       body: JSON.stringify({
         action: 'send_message',
         chatId,
         body,
+        attachmentIds,
+      }),
+    });
+  },
+  
+  signal: async (chatId: string, kind: 'typing' | 'online') => {
+    return apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'signal',
+        chatId,
+        kind,
+      }),
+    });
+  },
+  
+  uploadAttachment: async (chatId: string, file: File) => {
+    const digest = await crypto.subtle.digest('SHA-256', await file.arrayBuffer());
+    const sha256 = Array.from(new Uint8Array(digest))
+      .map((byte) => byte.toString(16).padStart(2, '0'))
+      .join('');
+    
+    const upload = await apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'init_upload',
+        chatId,
+        fileName: file.name,
+        contentType: file.type,
+        size: file.size,
+        sha256,
+      }),
+    });
+    
+    if (upload.complete) {
+      return upload.attachment;
+    }
+    
+    // Загрузка возобновляется с того места, которое подтвердил сервер
+    let offset = upload.uploaded;
+    while (offset < file.size) {
+      const chunk = new Uint8Array(await file.slice(offset, offset + upload.chunkSize).arrayBuffer());
+      let binary = '';
+      chunk.forEach((byte) => {
+        binary += String.fromCharCode(byte);
+      });
+      try {
+        const result = await apiRequest(API_URLS.chats, {
+          method: 'POST',
+          body: JSON.stringify({
+            action: 'upload_chunk',
+            chatId,
+            attachmentId: upload.attachment.id,
+            offset,
+            data: btoa(binary),
+          }),
+        });
+        offset = result.uploaded;
+      } catch (err: any) {
+        // Смещение разошлось с сервером (повтор после обрыва, параллельная вкладка):
+        // продолжаем с того места, которое сервер подтвердил
+        if (err.status !== 409 || typeof err.data?.uploaded !== 'number') {
+          throw err;
+        }
+        offset = err.data.uploaded;
+      }
+    }
+    
+    const completed = await apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'complete_upload',
+        chatId,
+        attachmentId: upload.attachment.id,
+      }),
+    });
+    return completed.attachment;
+  },
+  
+  downloadAttachment: async (chatId: string, attachmentId: string) => {
+    const token = getAuthToken();
+    const url = `${API_URLS.chats}?action=attachment&chatId=${chatId}&attachmentId=${attachmentId}`;
+    const parts: Blob[] = [];
+    let received = 0;
+    let total = 0;
+    let contentType = '';
+    
+    // Функция отдаёт не больше MAX_RANGE_BYTES за ответ (206 с Content-Range):
+    // дочитываем файл Range-запросами, пока не получим его целиком
+    do {
+      const headers: Record<string, string> = token ? { Authorization: `Bearer ${token}` } : {};
+      if (received > 0) {
+        headers['Range'] = `bytes=${received}-`;
+      }
+      const response = await fetch(url, { headers });
+      
+      if (!response.ok) {
+        throw new Error('Request failed');
+      }
+      
+      const part = await response.blob();
+      parts.push(part);
+      received += part.size;
+      contentType = contentType || response.headers.get('Content-Type') || '';
+      
+      const contentRange = response.headers.get('Content-Range');
+      if (response.status !== 206 || !contentRange) {
+        break;
+      }
+      total = Number(contentRange.split('/')[1]);
+      if (part.size === 0 || !Number.isFinite(total)) {
+        throw new Error('Не удалось скачать файл целиком');
+      }
+    } while (received < total);
+    
+    return new Blob(parts, { type: contentType });
+  },
+  
+  batch: async (requests: Array<{ action: string; [key: string]: unknown }>) => {
+    return apiRequest(API_URLS.chats, {
+      method: 'POST',
+      body: JSON.stringify({
+        action: 'batch',
+        requests,
       }),
     });
   },
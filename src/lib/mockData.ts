@@ -98,6 +98,7 @@ export const mockChats: Chat[] = [
     id: 'chat-1',
     type: 'direct',
     participants: [currentUser, mockUsers[1]],
+    memberCount: 2,
     lastMessage: mockMessages[3],
     unreadCount: 0,
     createdAt: new Date(Date.now() - 86400000),
@@ -106,6 +107,7 @@ export const mockChats: Chat[] = [
     id: 'chat-2',
     type: 'direct',
     participants: [currentUser, mockUsers[2]],
+    memberCount: 2,
     lastMessage: mockMessages[5],
     unreadCount: 0,
     createdAt: new Date(Date.now() - 172800000),
@@ -114,6 +116,7 @@ export const mockChats: Chat[] = [
     id: 'chat-3',
     type: 'direct',
     participants: [currentUser, mockUsers[3]],
+    memberCount: 2,
     lastMessage: mockMessages[6],
     unreadCount: 1,
     createdAt: new Date(Date.now() - 259200000),
@@ -14,8 +14,8 @@ import { User, Invite } from '@/types';
 import { useToast } from '@/hooks/use-toast';
 
 export default function Messenger() {
-  const { currentUser, isLoading: authLoading, logout } = useAuth();
-  const { chats, isLoading: chatsLoading, refetch: refetchChats } = useChats();
+  const { currentUser, isLoading: authLoading, updateCurrentUser, logout } = useAuth();
+  const { chats, isLoading: chatsLoading, bootstrap, refetch: refetchChats } = useChats(currentUser?.id);
   const { toast } = useToast();
   const [activeView, setActiveView] = useState<'chats' | 'profile' | 'admin' | 'members'>('chats');
   const [selectedChatId, setSelectedChatId] = useState<string | undefined>();
@@ -23,10 +23,33 @@ export default function Messenger() {
   const [users, setUsers] = useState<User[]>([]);
   const [invites, setInvites] = useState<Invite[]>([]);
   
-  const { messages, sendMessage, refetch: refetchMessages } = useMessages(selectedChatId);
+  const {
+    messages,
+    hasOlder,
+    isLoadingOlder,
+    loadOlder,
+    sendMessage,
+    notifyTyping,
+    typingUserIds,
+    onlineUserIds,
+    refetch: refetchMessages,
+  } = useMessages(selectedChatId);
 
   const selectedChat = chats.find(c => c.id === selectedChatId);
-  const otherUser = selectedChat?.participants.find(p => p.id !== currentUser?.id);
+  const participant = selectedChat?.participants.find(p => p.id !== currentUser?.id);
+  const otherUser = participant && {
+    ...participant,
+    isOnline: participant.isOnline || onlineUserIds.includes(participant.id),
+  };
+  const isGroup = selectedChat?.type === 'group';
+
+  // Превью участников в списке чатов неполное для больших групп: остальных
+  // авторов ищем в общем списке пользователей
+  const getSender = (userId: string): User | undefined =>
+    selectedChat?.participants.find(p => p.id === userId) || users.find(u => u.id === userId);
+  const typingUsers = typingUserIds
+    .filter(id => id !== currentUser?.id)
+    .map(id => getSender(id) || { id, username: '', displayName: 'Кто-то', isAdmin: false });
 
   useEffect(() => {
     if (chats.length > 0 && !selectedChatId) {
@@ -34,6 +57,15 @@ export default function Messenger() {
     }
   }, [chats]);
 
+  useEffect(() => {
+    if (bootstrap.currentUser) {
+      updateCurrentUser(bootstrap.currentUser);
+    }
+    if (bootstrap.users) {
+      setUsers(bootstrap.users);
+    }
+  }, [bootstrap]);
+
   useEffect(() => {
     if (activeView === 'members') {
       loadUsers();
@@ -256,19 +288,26 @@ export default function Messenger() {
       </div>
 
       <div className={`flex-1 flex flex-col ${!showMobileSidebar ? 'flex' : 'hidden'} md:flex`}>
-        {selectedChat && otherUser ? (
+        {selectedChat && (isGroup || otherUser) ? (
           <>
             <ChatHeader
+              chat={selectedChat}
               otherUser={otherUser}
+              typingUsers={typingUsers}
               onBack={handleBackToList}
               onUserClick={() => {}}
             />
             <MessageList
               messages={messages}
               currentUserId={currentUser.id}
-              otherUser={otherUser}
+              chatTitle={isGroup ? selectedChat.title || 'Группа' : otherUser!.displayName}
+              isGroup={isGroup}
+              getSender={getSender}
+              hasOlder={hasOlder}
+              isLoadingOlder={isLoadingOlder}
+              onLoadOlder={loadOlder}
             />
-            <MessageInput onSend={handleSendMessage} />
+            <MessageInput onSend={handleSendMessage} onTyping={notifyTyping} />
           </>
         ) : (
           <div className="flex-1 flex items-center justify-center p-8 bg-background">
@@ -15,12 +15,22 @@ export interface Message {
   body: string;
   createdAt: Date;
   status: 'sending' | 'sent' | 'read';
+  attachments?: Attachment[];
+}
+
+export interface Attachment {
+  id: string;
+  fileName: string;
+  contentType: string;
+  size: number;
 }
 
 export interface Chat {
   id: string;
-  type: 'direct';
+  type: 'direct' | 'group';
+  title?: string;
   participants: User[];
+  memberCount: number;
   lastMessage?: Message;
   unreadCount: number;
   createdAt: Date;
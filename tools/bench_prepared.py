@@ -0,0 +1,166 @@
+"""
+Сравнение накладных расходов на планирование горячих запросов чатов:
+обычный cursor.execute против PREPARE/EXECUTE из реестра PREPARED_STATEMENTS.
+
+    DATABASE_URL=postgresql://localhost/messenger_bench python tools/bench_prepared.py --iterations 2000
+
+Скрипт засевает базу небольшим набором данных (если в ней нет пользователей bench_*),
+затем для каждого запроса замеряет среднее время вызова и Planning Time из EXPLAIN.
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+from psycopg2.extras import RealDictCursor, execute_values
+
+from harness import apply_migrations, load_function
+
+PARAM_RE = re.compile(r'\$(\d+)')
+
+
+def seed(conn, users, chats, messages):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) FROM users WHERE username LIKE 'bench\\_%%'")
+        if cursor.fetchone()[0]:
+            return
+        
+        cursor.execute(
+            "INSERT INTO users (username, display_name, password_hash) "
+            "SELECT 'bench_' || g, 'Bench ' || g, 'x' FROM generate_series(1, %s) g RETURNING id",
+            (users,)
+        )
+        user_ids = [row[0] for row in cursor.fetchall()]
+        
+        cursor.execute("INSERT INTO chats (type) SELECT 'direct' FROM generate_series(1, %s) RETURNING id", (chats,))
+        chat_ids = [row[0] for row in cursor.fetchall()]
+        
+        members = []
+        for chat_id in chat_ids:
+            first, second = random.sample(user_ids, 2)
+            members += [(chat_id, first), (chat_id, second)]
+        execute_values(cursor, "INSERT INTO chat_members (chat_id, user_id) VALUES %s", members)
+        
+        cursor.execute("""
+            WITH members AS (
+                SELECT array_agg(chat_id) AS chat_ids, array_agg(user_id) AS user_ids, COUNT(*) AS n FROM chat_members
+            )
+            INSERT INTO messages (chat_id, sender_id, body, created_at, read_at)
+            SELECT chat_ids[i], user_ids[i], md5(random()::text),
+                   NOW() - random() * INTERVAL '90 days',
+                   CASE WHEN random() < 0.8 THEN NOW() END
+            FROM (
+                SELECT 1 + floor(random() * n)::int AS i, chat_ids, user_ids
+                FROM members, generate_series(1, %s)
+            ) picks
+        """, (messages,))
+        cursor.execute("ANALYZE")
+    conn.commit()
+
+
+def sample_params(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT
+                cm.chat_id,
+                cm.user_id,
+                (SELECT MAX(created_at) FROM messages m WHERE m.chat_id = cm.chat_id),
+                (SELECT id FROM messages m WHERE m.chat_id = cm.chat_id ORDER BY created_at DESC OFFSET 50 LIMIT 1)
+            FROM chat_members cm
+            JOIN users u ON u.id = cm.user_id AND u.username LIKE 'bench\\_%%'
+            ORDER BY (SELECT COUNT(*) FROM messages m WHERE m.chat_id = cm.chat_id) DESC
+            LIMIT 1
+        """)
+        chat_id, user_id, last_at, page_end = cursor.fetchone()
+    chat_id, user_id, page_end = str(chat_id), str(user_id), str(page_end) if page_end else None
+    return {
+        'is_member': (chat_id, user_id),
+        'list_chats': (user_id,),
+        'tail_version': (chat_id, user_id),
+        'fetch_messages': (chat_id, 50),
+        'fetch_messages_before': (chat_id, page_end, 50),
+        'mark_read': (chat_id, user_id, last_at),
+        'send_message': (chat_id, user_id, 'bench', True),
+    }
+
+
+def plain_sql(sql, params):
+    # $n -> %s с раскладкой параметров в порядке появления
+    return PARAM_RE.sub('%s', sql), [params[int(n) - 1] for n in PARAM_RE.findall(sql)]
+
+
+def planning_time(cursor, sql, params):
+    cursor.execute(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}", params)
+    return cursor.fetchone()[0][0]['Planning Time']
+
+
+def measure(conn, chats_fn, name, params, iterations):
+    sql, plain_params = plain_sql(chats_fn.PREPARED_STATEMENTS[name], params)
+    result = {}
+    
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            cursor.execute(sql, plain_params)
+            if cursor.description is not None:
+                cursor.fetchall()
+            timings.append(time.perf_counter() - started)
+        conn.rollback()
+        result['plain_ms'] = statistics.mean(timings) * 1000
+        
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            chats_fn.execute_prepared(cursor, name, params)
+            # mark_read и другие UPDATE строк не возвращают
+            if cursor.description is not None:
+                cursor.fetchall()
+            timings.append(time.perf_counter() - started)
+        conn.rollback()
+        result['prepared_ms'] = statistics.mean(timings) * 1000
+    
+    with conn.cursor() as cursor:
+        result['plain_planning_ms'] = planning_time(cursor, sql, plain_params)
+        placeholders = ', '.join(['%s'] * len(params))
+        result['prepared_planning_ms'] = planning_time(cursor, f"EXECUTE {name} ({placeholders})", params)
+    conn.rollback()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--chats', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=200000)
+    parser.add_argument('--iterations', type=int, default=1000)
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    args = parser.parse_args()
+    
+    apply_migrations(args.database_url)
+    chats_fn = load_function('chats', {'DATABASE_URL': args.database_url})
+    conn = chats_fn.get_db_connection()
+    
+    seed(conn, args.users, args.chats, args.messages)
+    params = sample_params(conn)
+    
+    results = {}
+    print(f"{'statement':<22}{'plain ms':>12}{'prepared ms':>14}{'plan ms':>10}{'plan ms (prep)':>16}")
+    for name in chats_fn.PREPARED_STATEMENTS:
+        results[name] = row = measure(conn, chats_fn, name, params[name], args.iterations)
+        print(f"{name:<22}{row['plain_ms']:>12.3f}{row['prepared_ms']:>14.3f}"
+              f"{row['plain_planning_ms']:>10.3f}{row['prepared_planning_ms']:>16.3f}")
+    
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'iterations': args.iterations, 'results': results}, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
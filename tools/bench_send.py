@@ -0,0 +1,147 @@
+"""
+Задержка отправки сообщения: прежний путь из нескольких запросов (is_member, INSERT,
+строка outbox, pg_notify, COMMIT) против одного вызова send_message_v1 (V0007).
+
+Оба пути используют подготовленные запросы, поэтому разница — число обращений к базе.
+На локальной базе она невелика; показательнее прогон против базы в другой сети:
+
+    DATABASE_URL=postgresql://db.example/messenger_bench python tools/bench_send.py --iterations 500
+
+Скрипт создаёт отдельный чат bench_send и удаляет его сообщения и строки outbox в конце.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+from psycopg2.extras import RealDictCursor
+
+from harness import apply_migrations, load_function
+
+# Прежний путь send_message без вложений — по запросу на шаг
+LEGACY_STATEMENTS = {
+    'legacy_is_member': "SELECT user_id FROM chat_members WHERE chat_id = $1 AND user_id = $2",
+    'legacy_insert_message': """
+        WITH previous AS (
+            SELECT id FROM messages WHERE chat_id = $1 ORDER BY created_at DESC LIMIT 1
+        )
+        INSERT INTO messages (chat_id, sender_id, body) VALUES ($1, $2, $3)
+        RETURNING id, created_at, (SELECT id FROM previous) as previous_id
+    """,
+    'legacy_enqueue_outbox': "INSERT INTO outbox (topic, payload) VALUES ($1, $2)",
+}
+
+
+def prepare_chat(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO users (username, display_name, password_hash)
+            VALUES ('bench_send', 'Bench send', 'x')
+            ON CONFLICT (username) DO UPDATE SET display_name = EXCLUDED.display_name
+            RETURNING id
+        """)
+        user_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO chats (type, title) VALUES ('group', 'bench_send') RETURNING id")
+        chat_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO chat_members (chat_id, user_id, role) VALUES (%s, %s, 'owner')", (chat_id, user_id))
+    conn.commit()
+    return str(chat_id), str(user_id)
+
+
+def cleanup(conn, chat_id):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM outbox WHERE payload->>'chatId' = %s", (chat_id,))
+        cursor.execute("DELETE FROM messages WHERE chat_id = %s", (chat_id,))
+        cursor.execute("DELETE FROM chat_members WHERE chat_id = %s", (chat_id,))
+        cursor.execute("DELETE FROM chats WHERE id = %s", (chat_id,))
+    conn.commit()
+
+
+def execute_prepared(cursor, name, sql, params):
+    conn = cursor.connection
+    if name not in conn.prepared:
+        cursor.execute(f"PREPARE {name} AS {sql}")
+        conn.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
+def send_legacy(conn, cursor, chats_fn, chat_id, user_id):
+    execute_prepared(cursor, 'legacy_is_member', LEGACY_STATEMENTS['legacy_is_member'], (chat_id, user_id))
+    assert cursor.fetchone()
+    execute_prepared(cursor, 'legacy_insert_message', LEGACY_STATEMENTS['legacy_insert_message'], (chat_id, user_id, 'bench'))
+    inserted = cursor.fetchone()
+    message = {
+        'id': str(inserted['id']),
+        'chatId': chat_id,
+        'senderId': user_id,
+        'body': 'bench',
+        'createdAt': inserted['created_at'].isoformat(),
+        'status': 'sent',
+        'attachments': []
+    }
+    execute_prepared(cursor, 'legacy_enqueue_outbox', LEGACY_STATEMENTS['legacy_enqueue_outbox'], ('message_sent', json.dumps({
+        'messageId': message['id'],
+        'chatId': chat_id,
+        'senderId': user_id,
+        'createdAt': message['createdAt']
+    })))
+    chats_fn.notify_chat_event(cursor, {'type': 'message', 'chatId': chat_id, 'message': message})
+    conn.commit()
+
+
+def send_function(conn, cursor, chats_fn, chat_id, user_id):
+    chats_fn.execute_prepared(cursor, 'send_message', (chat_id, user_id, 'bench', True))
+    assert cursor.fetchone()['error'] is None
+    conn.commit()
+
+
+def measure(conn, chats_fn, send, chat_id, user_id, iterations):
+    timings = []
+    with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+        for _ in range(iterations):
+            started = time.perf_counter()
+            send(conn, cursor, chats_fn, chat_id, user_id)
+            timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'mean_ms': statistics.mean(timings),
+        'p50_ms': timings[len(timings) // 2],
+        'p95_ms': timings[int(len(timings) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--iterations', type=int, default=500)
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    args = parser.parse_args()
+    
+    apply_migrations(args.database_url)
+    chats_fn = load_function('chats', {'DATABASE_URL': args.database_url})
+    conn = chats_fn.get_db_connection()
+    chat_id, user_id = prepare_chat(conn)
+    
+    results = {}
+    try:
+        # Прогрев: PREPARE и первые планы не должны попадать в замер
+        for send in (send_legacy, send_function):
+            measure(conn, chats_fn, send, chat_id, user_id, 20)
+        
+        print(f"{'path':<12}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, send in (('legacy', send_legacy), ('function', send_function)):
+            results[name] = row = measure(conn, chats_fn, send, chat_id, user_id, args.iterations)
+            print(f"{name:<12}{row['mean_ms']:>10.3f}{row['p50_ms']:>10.3f}{row['p95_ms']:>10.3f}")
+    finally:
+        cleanup(conn, chat_id)
+    
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'iterations': args.iterations, 'results': results}, fp, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
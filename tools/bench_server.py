@@ -0,0 +1,124 @@
+"""
+Сравнение пропускной способности: последовательный вызов handler(event, context)
+против ASGI-рантайма из server/app.py с конкурентными запросами.
+
+Запросы в рантайм подаются напрямую по протоколу ASGI, без HTTP-клиента,
+поэтому замер показывает выигрыш от пула потоков, а не от сети.
+Нужна засеянная база (tools/seed_dataset.py).
+
+    DATABASE_URL=postgresql://localhost/messenger_seed \
+    python tools/bench_server.py --requests 2000 --concurrency 200
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import statistics
+from urllib.parse import urlencode
+
+import psycopg2
+
+from harness import ROOT_DIR, issue_token, load_function, make_event
+
+WORKLOAD = (
+    ('chats', {'action': 'list_chats'}),
+    ('users', {}),
+)
+
+
+def sample_tokens(database_url, count):
+    conn = psycopg2.connect(database_url)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT user_id FROM chat_members GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT %s", (count,))
+        user_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    if not user_ids:
+        raise SystemExit('база пуста: сначала запустите tools/seed_dataset.py')
+    return [issue_token(user_id) for user_id in user_ids]
+
+
+def requests_plan(tokens, total):
+    for index in range(total):
+        name, query = WORKLOAD[index % len(WORKLOAD)]
+        yield name, query, tokens[index % len(tokens)]
+
+
+def run_sequential(functions, plan):
+    latencies = []
+    started = time.perf_counter()
+    for name, query, token in plan:
+        request_started = time.perf_counter()
+        response = functions[name].handler(make_event('GET', query=query, token=token), None)
+        assert response['statusCode'] == 200, response
+        latencies.append(time.perf_counter() - request_started)
+    return time.perf_counter() - started, latencies
+
+
+async def asgi_request(app, name, query, token):
+    scope = {
+        'type': 'http',
+        'method': 'GET',
+        'path': f'/{name}',
+        'query_string': urlencode(query).encode(),
+        'headers': [(b'x-authorization', f'Bearer {token}'.encode())],
+    }
+    sent = []
+    
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    
+    async def send(message):
+        sent.append(message)
+    
+    await app(scope, receive, send)
+    assert sent[0]['status'] == 200, sent
+
+
+async def run_concurrent(app, plan, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    
+    async def one(name, query, token):
+        async with semaphore:
+            request_started = time.perf_counter()
+            await asgi_request(app, name, query, token)
+            latencies.append(time.perf_counter() - request_started)
+    
+    started = time.perf_counter()
+    await asyncio.gather(*(one(*request) for request in plan))
+    return time.perf_counter() - started, latencies
+
+
+def report(label, elapsed, latencies):
+    latencies = sorted(latencies)
+    p95 = latencies[max(0, int(len(latencies) * 0.95) - 1)]
+    print(f'{label:<12}{len(latencies) / elapsed:>10.1f} req/s'
+          f'{statistics.median(latencies) * 1000:>10.1f} ms p50{p95 * 1000:>10.1f} ms p95')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=32, help='SERVER_DB_THREADS рантайма')
+    parser.add_argument('--users', type=int, default=100)
+    args = parser.parse_args()
+    
+    env = {'DATABASE_URL': args.database_url, 'DATABASE_READ_URL': None, 'REQUEST_LOG': '0'}
+    functions = {name: load_function(name, env) for name, _ in WORKLOAD}
+    tokens = sample_tokens(args.database_url, args.users)
+    
+    report('sequential', *run_sequential(functions, requests_plan(tokens, args.requests)))
+    
+    sys.path.insert(0, str(ROOT_DIR))
+    from server.app import FunctionsApp
+    app = FunctionsApp([name for name, _ in WORKLOAD], db_threads=args.threads)
+    report('asgi', *asyncio.run(run_concurrent(app, requests_plan(tokens, args.requests), args.concurrency)))
+    app.executor.shutdown()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,49 @@
+"""
+Проверка разбора заголовка Range функцией chats (parse_range) без базы.
+
+None означает ответ 416 с Content-Range: bytes */size.
+
+    python tools/check_ranges.py
+"""
+import sys
+
+from harness import load_function
+
+SIZE = 100
+
+CASES = (
+    ('bytes=0-', (0, 99)),
+    ('bytes=0-9', (0, 9)),
+    ('bytes=90-200', (90, 99)),
+    ('bytes=99-99', (99, 99)),
+    ('bytes=-10', (90, 99)),
+    ('bytes=-500', (0, 99)),
+    ('bytes=-0', None),
+    ('bytes=100-', None),
+    ('bytes=5-2', None),
+    ('bytes=-', None),
+    ('bytes=0-9,20-29', None),
+    ('items=0-9', None),
+)
+
+
+def main():
+    chats_fn = load_function('chats', {'DATABASE_URL': 'postgresql://localhost/unused'})
+    failed = 0
+    for header, expected in CASES:
+        actual = chats_fn.parse_range(header, SIZE)
+        mark = 'ok' if actual == expected else 'FAIL'
+        failed += actual != expected
+        print(f'{mark:<5}{header:<20}{actual!s:<12}ожидалось {expected}')
+    
+    # Пустой файл: любой диапазон непригоден
+    if chats_fn.parse_range('bytes=-10', 0) is not None:
+        print('FAIL bytes=-10 для пустого файла')
+        failed += 1
+    
+    print(f'\nслучаев: {len(CASES) + 1}, с ошибками: {failed}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Проверка маршрутизации чтения на реплики на двух локальных инстансах Postgres.
+
+Реплика здесь — отдельная база с заведомо другими данными, поэтому по ответу
+видно, откуда пришло чтение. Запуск:
+
+    PRIMARY_URL=postgresql://localhost:5432/messenger \
+    REPLICA_URL=postgresql://localhost:5433/messenger \
+    python tools/check_read_routing.py
+"""
+import os
+import sys
+import time
+import uuid
+
+import psycopg2
+
+from harness import apply_migrations, call, issue_token, load_function
+
+PRIMARY_URL = os.environ['PRIMARY_URL']
+REPLICA_URL = os.environ['REPLICA_URL']
+DEAD_URL = 'postgresql://127.0.0.1:1/unreachable'
+
+
+def seed(url, user_id, other_id, display_name, with_chat):
+    conn = psycopg2.connect(url)
+    with conn.cursor() as cursor:
+        cursor.execute("TRUNCATE messages, chat_members, chats, invites, refresh_tokens, users CASCADE")
+        cursor.execute(
+            "INSERT INTO users (id, username, display_name, password_hash) VALUES (%s, 'alice', %s, 'x'), (%s, 'bob', 'Bob', 'x')",
+            (user_id, display_name, other_id)
+        )
+        if with_chat:
+            cursor.execute("INSERT INTO chats (type) VALUES ('direct') RETURNING id")
+            chat_id = cursor.fetchone()[0]
+            cursor.execute(
+                "INSERT INTO chat_members (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
+                (chat_id, user_id, chat_id, other_id)
+            )
+    conn.commit()
+    conn.close()
+
+
+def display_names(users_fn, token, headers=None):
+    status, payload, _ = call(users_fn, 'GET', token=token, headers=headers)
+    assert status == 200, payload
+    return {user['displayName'] for user in payload['users']}
+
+
+def main():
+    for url in (PRIMARY_URL, REPLICA_URL):
+        apply_migrations(url)
+
+    user_id, other_id = str(uuid.uuid4()), str(uuid.uuid4())
+    seed(PRIMARY_URL, user_id, other_id, 'Primary Alice', with_chat=True)
+    seed(REPLICA_URL, user_id, other_id, 'Replica Alice', with_chat=False)
+    token = issue_token(user_id)
+
+    env = {'DATABASE_URL': PRIMARY_URL, 'DATABASE_READ_URL': REPLICA_URL}
+    users_fn = load_function('users', env)
+    chats_fn = load_function('chats', env)
+
+    assert 'Replica Alice' in display_names(users_fn, token), 'GET /users должен читать с реплики'
+
+    window = {'X-Primary-Until': str(int(time.time()) + 5)}
+    assert 'Primary Alice' in display_names(users_fn, token, window), 'окно read-your-writes должно вести в primary'
+
+    forged = {'X-Primary-Until': str(int(time.time()) + 3600)}
+    assert 'Replica Alice' in display_names(users_fn, token, forged), 'окно длиннее допустимого игнорируется'
+
+    status, payload, _ = call(chats_fn, 'GET', query={'action': 'list_chats'}, token=token)
+    assert status == 200 and payload['chats'] == [], 'list_chats должен читать с реплики'
+
+    status, payload, _ = call(chats_fn, 'GET', query={'action': 'list_chats'}, token=token, headers=window)
+    chat_id = payload['chats'][0]['id']
+
+    status, payload, headers = call(
+        chats_fn, 'POST', body={'action': 'send_message', 'chatId': chat_id, 'body': 'hi'}, token=token
+    )
+    assert status == 201, payload
+    assert 'X-Primary-Until' in headers, 'запись должна открывать окно чтения из primary'
+
+    status, payload, _ = call(
+        chats_fn, 'GET', query={'action': 'list_chats'}, token=token,
+        headers={'X-Primary-Until': headers['X-Primary-Until']}
+    )
+    assert payload['chats'][0]['lastMessage']['body'] == 'hi', 'своё сообщение видно сразу после отправки'
+
+    users_fn = load_function('users', {'DATABASE_READ_URL': f'{DEAD_URL},{REPLICA_URL}'})
+    for _ in range(5):
+        assert 'Replica Alice' in display_names(users_fn, token), 'недоступная реплика пропускается'
+    assert DEAD_URL in users_fn._replica_down_until, 'недоступная реплика помечается как больная'
+
+    users_fn = load_function('users', {'DATABASE_READ_URL': DEAD_URL})
+    assert 'Primary Alice' in display_names(users_fn, token), 'без живых реплик чтение уходит в primary'
+
+    print('read routing: OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
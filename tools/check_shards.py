@@ -0,0 +1,142 @@
+"""
+Проверка шардирования чатов на нескольких локальных инстансах Postgres.
+
+Основная база (users, invites, карта бакетов) — DATABASE_URL, шарды — SHARD_URLS.
+Все базы очищаются. Запуск:
+
+    DATABASE_URL=postgresql://localhost:5432/messenger \
+    SHARD_URLS=s1=postgresql://localhost:5433/messenger,s2=postgresql://localhost:5434/messenger \
+    python tools/check_shards.py
+"""
+import os
+import sys
+import uuid
+
+import psycopg2
+
+from harness import call, issue_token, load_function
+from rebalance_shards import SHARD_BUCKETS, init_shards, move_buckets, shard_urls
+
+DATABASE_URL = os.environ['DATABASE_URL']
+SHARD_URLS = os.environ['SHARD_URLS']
+CHATS = 12
+
+
+def reset(urls):
+    for url in urls.values():
+        conn = psycopg2.connect(url)
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                TRUNCATE outbox, attachments, attachment_blobs, messages, chat_members, chats,
+                         chat_shard_buckets, invites, refresh_tokens, users CASCADE
+            """)
+        conn.commit()
+        conn.close()
+
+
+def create_users(count):
+    conn = psycopg2.connect(DATABASE_URL)
+    user_ids = [str(uuid.uuid4()) for _ in range(count)]
+    with conn.cursor() as cursor:
+        for index, user_id in enumerate(user_ids):
+            cursor.execute(
+                "INSERT INTO users (id, username, display_name, password_hash) VALUES (%s, %s, %s, 'x')",
+                (user_id, f'user{index}', f'User {index}')
+            )
+    conn.commit()
+    conn.close()
+    return user_ids
+
+
+def chats_on(url):
+    conn = psycopg2.connect(url)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT id::text FROM chats")
+        chat_ids = {row[0] for row in cursor.fetchall()}
+    conn.close()
+    return chat_ids
+
+
+def main():
+    urls = shard_urls(DATABASE_URL, SHARD_URLS)
+    assert len(urls) >= 3, 'нужно хотя бы два шарда в SHARD_URLS'
+    init_shards(urls)
+    reset(urls)
+
+    # Пустые бакеты раскладываются по шардам поровну, main оставляет себе первую долю
+    names = list(urls)
+    share = SHARD_BUCKETS // len(names)
+    for index, name in enumerate(names[1:], start=1):
+        upper = SHARD_BUCKETS if index == len(names) - 1 else (index + 1) * share
+        move_buckets(urls, list(range(index * share, upper)), name, grace=0, log=lambda line: None)
+
+    env = {'CHAT_SHARD_URLS': SHARD_URLS, 'SHARD_MAP_TTL_SECONDS': '0', 'DATABASE_READ_URL': None}
+    chats_fn = load_function('chats', {'DATABASE_URL': DATABASE_URL, **env})
+
+    alice, *others = create_users(CHATS + 1)
+    alice_token = issue_token(alice)
+
+    chat_ids = []
+    for index, other in enumerate(others):
+        status, payload, _ = call(chats_fn, 'POST', body={'action': 'create_chat', 'userId': other}, token=alice_token)
+        assert status == 201, payload
+        chat_ids.append(payload['chatId'])
+        for number in range(index % 3 + 1):
+            status, payload, _ = call(
+                chats_fn, 'POST', token=issue_token(other),
+                body={'action': 'send_message', 'chatId': chat_ids[-1], 'body': f'msg {number}'}
+            )
+            assert status == 201, payload
+
+    placement = {name: chats_on(url) & set(chat_ids) for name, url in urls.items()}
+    assert sum(len(ids) for ids in placement.values()) == CHATS, 'каждый чат лежит ровно на одном шарде'
+    assert sum(1 for ids in placement.values() if ids) >= 2, 'чаты распределились по нескольким шардам'
+    for chat_id in chat_ids:
+        assert chat_id in placement[chats_fn.shard_for_chat(chat_id)], 'чат лежит на шарде из карты'
+
+    status, payload, _ = call(chats_fn, 'GET', query={'action': 'list_chats'}, token=alice_token)
+    assert status == 200, payload
+    listed = {chat['id']: chat for chat in payload['chats']}
+    assert set(listed) == set(chat_ids), 'list_chats собирает чаты со всех шардов'
+    for index, chat_id in enumerate(chat_ids):
+        assert listed[chat_id]['unreadCount'] == index % 3 + 1, 'непрочитанные считаются на шарде чата'
+        assert {user['id'] for user in listed[chat_id]['participants']} == {alice, others[index]}
+
+    status, payload, _ = call(chats_fn, 'POST', body={'action': 'create_chat', 'userId': others[0]}, token=alice_token)
+    assert status == 200 and payload['chatId'] == chat_ids[0], 'повторный create_chat находит чат на любом шарде'
+
+    # Перенос бакета с данными: сообщения доступны, на старом шарде чата не остаётся
+    moved_chat = chat_ids[-1]
+    bucket = chats_fn.chat_bucket(moved_chat)
+    source = chats_fn.shard_for_chat(moved_chat)
+    target = next(name for name in names if name != source)
+    move_buckets(urls, [bucket], target, grace=0, log=lambda line: None)
+    assert chats_fn.shard_for_chat(moved_chat) == target
+    assert moved_chat in chats_on(urls[target]) and moved_chat not in chats_on(urls[source])
+
+    status, payload, _ = call(chats_fn, 'GET', query={'action': 'messages', 'chatId': moved_chat}, token=alice_token)
+    assert status == 200 and len(payload['messages']) == (CHATS - 1) % 3 + 1, 'сообщения переехали вместе с чатом'
+
+    # Бакет в состоянии moving: запись отклоняется с 503, чтение работает
+    conn = psycopg2.connect(DATABASE_URL)
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE chat_shard_buckets SET state = 'moving' WHERE bucket = %s", (bucket,))
+    conn.commit()
+    status, payload, _ = call(chats_fn, 'POST', body={'action': 'send_message', 'chatId': moved_chat, 'body': 'x'}, token=alice_token)
+    assert status == 503, 'запись в переносимый бакет ждёт'
+    status, payload, _ = call(chats_fn, 'GET', query={'action': 'messages', 'chatId': moved_chat}, token=alice_token)
+    assert status == 200, 'чтение переносимого бакета не блокируется'
+    with conn.cursor() as cursor:
+        cursor.execute("UPDATE chat_shard_buckets SET state = 'active' WHERE bucket = %s", (bucket,))
+    conn.commit()
+    conn.close()
+
+    status, payload, _ = call(chats_fn, 'POST', body={'action': 'send_message', 'chatId': moved_chat, 'body': 'after'}, token=alice_token)
+    assert status == 201, payload
+
+    print('shards: OK')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
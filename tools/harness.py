@@ -0,0 +1,75 @@
+"""
+Общие помощники для локального запуска облачных функций из backend/ прямо в процессе
+"""
+import os
+import json
+import importlib.util
+from pathlib import Path
+from datetime import datetime, timedelta
+
+import jwt
+import psycopg2
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+BACKEND_DIR = ROOT_DIR / 'backend'
+MIGRATIONS_DIR = ROOT_DIR / 'db_migrations'
+FUNCTIONS = tuple(json.loads((BACKEND_DIR / 'func2url.json').read_text()))
+
+_load_counter = 0
+
+
+def load_function(name, env=None):
+    # Функции читают окружение при импорте, поэтому env выставляется до exec_module.
+    # Каждый вызов даёт свежий модуль со своим состоянием тёплого инстанса.
+    global _load_counter
+    if env:
+        os.environ.update({key: value for key, value in env.items() if value is not None})
+        for key in [key for key, value in env.items() if value is None]:
+            os.environ.pop(key, None)
+
+    _load_counter += 1
+    spec = importlib.util.spec_from_file_location(
+        f'backend_{name}_{_load_counter}', BACKEND_DIR / name / 'index.py'
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def apply_migrations(database_url):
+    conn = psycopg2.connect(database_url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("CREATE EXTENSION IF NOT EXISTS pgcrypto")
+            for path in sorted(MIGRATIONS_DIR.glob('V*.sql')):
+                cursor.execute(path.read_text())
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def issue_token(user_id, minutes=60):
+    return jwt.encode(
+        {'user_id': str(user_id), 'exp': datetime.utcnow() + timedelta(minutes=minutes)},
+        os.environ.get('JWT_SECRET', 'change-me-in-production'),
+        algorithm='HS256'
+    )
+
+
+def make_event(method='GET', body=None, query=None, token=None, headers=None):
+    event_headers = dict(headers or {})
+    if token:
+        event_headers['X-Authorization'] = f'Bearer {token}'
+    return {
+        'httpMethod': method,
+        'headers': event_headers,
+        'queryStringParameters': query or {},
+        'body': json.dumps(body) if body is not None else '{}',
+        'isBase64Encoded': False
+    }
+
+
+def call(module, method='GET', body=None, query=None, token=None, headers=None):
+    response = module.handler(make_event(method, body, query, token, headers), None)
+    payload = json.loads(response['body']) if response.get('body') else None
+    return response['statusCode'], payload, response.get('headers', {})
@@ -0,0 +1,417 @@
+"""
+Импорт истории переписки: выгрузки других мессенджеров и собственные архивы.
+
+Вход — NDJSON (объект на строку) или CSV с заголовком, одна запись на сообщение:
+
+    chat        внешний id чата (обязательно)
+    sender      username отправителя (обязательно)
+    body        текст (обязательно)
+    sentAt      время отправки, ISO 8601 (обязательно)
+    chatType    direct или group (по умолчанию group)
+    chatTitle   название группы (по умолчанию внешний id чата)
+    senderName  отображаемое имя для создаваемых пользователей
+    readAt      время прочтения; без него импортированное сообщение считается прочитанным
+
+Файл читается потоком, сообщения грузятся в messages через COPY пачками по --batch
+записей. id чатов и сообщений выводятся из --source и внешних id (uuid5), поэтому
+повторный импорт того же источника попадает в те же чаты. Каждая пачка коммитится
+в базе своего шарда вместе с отметкой import_checkpoints: после обрыва запуск с тем же
+--source продолжает с первой незакоммиченной записи.
+
+--defer-indexes снимает вторичные индексы messages на время загрузки и строит их
+в конце (определения хранятся в import_deferred_indexes, так что перестройка
+доделывается и после обрыва; пока там есть записи, перезапуск не применяет
+миграции, чтобы они не строили снятые индексы заново). Только для базы без живой нагрузки — восстановления
+архива или первичного переноса. Уведомления, outbox и счётчики непрочитанных
+в реальном времени при импорте не срабатывают.
+
+    DATABASE_URL=postgresql://localhost/messenger \
+    python tools/import_history.py export.ndjson --source telegram-2024 --create-users --defer-indexes
+"""
+import os
+import csv
+import sys
+import json
+import time
+import uuid
+import secrets
+import argparse
+from collections import defaultdict
+from datetime import datetime, timezone
+
+import bcrypt
+import psycopg2
+from psycopg2.extras import execute_values
+
+from harness import apply_migrations, load_function
+from seed_dataset import CopyStream
+
+IMPORT_NAMESPACE = uuid.UUID('6f1c4a3e-9b0d-4f57-a1e2-3c8d5b7e9f10')
+DEFAULT_BATCH_RECORDS = 50000
+PROGRESS_SECONDS = 5
+REQUIRED_FIELDS = ('chat', 'sender', 'body', 'sentAt')
+CHAT_TYPES = ('direct', 'group')
+MAX_USERNAME_LENGTH = 50
+MAX_DISPLAY_NAME_LENGTH = 100
+MAX_TITLE_LENGTH = 100
+REPORTED_INVALID = 10
+COPY_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r', '\x00': ''})
+
+
+def copy_row(*values):
+    # Текстовый формат COPY: табуляция между полями, \N для NULL, спецсимволы экранируются
+    return '\t'.join(r'\N' if value is None else str(value).translate(COPY_ESCAPES) for value in values) + '\n'
+
+
+def read_records(path, fmt):
+    # (номер записи, запись, прочитано байт) — номер записи и есть позиция для возобновления
+    position = 0
+    
+    def lines(fp):
+        nonlocal position
+        for index, line in enumerate(fp):
+            position += len(line)
+            text = line.decode('utf-8')
+            yield text.lstrip('\ufeff') if index == 0 else text
+    
+    with open(path, 'rb') as fp:
+        if fmt == 'csv':
+            for number, record in enumerate(csv.DictReader(lines(fp)), start=1):
+                yield number, record, position
+            return
+        
+        number = 0
+        for line in lines(fp):
+            if not line.strip():
+                continue
+            number += 1
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            yield number, record, position
+
+
+def parse_time(value):
+    moment = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+
+def parse_record(record):
+    if not isinstance(record, dict) or any(not record.get(field) for field in REQUIRED_FIELDS):
+        return None
+    
+    sender = str(record['sender']).strip()
+    chat_type = record.get('chatType') or 'group'
+    if not sender or len(sender) > MAX_USERNAME_LENGTH or chat_type not in CHAT_TYPES:
+        return None
+    
+    try:
+        sent_at = parse_time(str(record['sentAt']))
+        read_at = parse_time(str(record['readAt'])) if record.get('readAt') else sent_at
+    except ValueError:
+        return None
+    
+    chat = str(record['chat'])
+    return {
+        'chat': chat,
+        'chatType': chat_type,
+        'chatTitle': None if chat_type == 'direct' else str(record.get('chatTitle') or chat)[:MAX_TITLE_LENGTH],
+        'sender': sender,
+        'senderName': str(record.get('senderName') or sender)[:MAX_DISPLAY_NAME_LENGTH],
+        'body': str(record['body']),
+        'sentAt': sent_at,
+        'readAt': read_at,
+    }
+
+
+def pending_deferred_indexes(url):
+    # Отложенные индексы остаются в таблице после прерванного --defer-indexes
+    conn = psycopg2.connect(url)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT to_regclass('import_deferred_indexes') IS NOT NULL")
+            if not cursor.fetchone()[0]:
+                return 0
+            cursor.execute("SELECT COUNT(*) FROM import_deferred_indexes")
+            return cursor.fetchone()[0]
+    finally:
+        conn.close()
+
+
+def defer_indexes(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT i.relname, pg_get_indexdef(i.oid)
+            FROM pg_index x
+            JOIN pg_class i ON i.oid = x.indexrelid
+            WHERE x.indrelid = 'messages'::regclass AND NOT x.indisunique
+        """)
+        indexes = cursor.fetchall()
+        if indexes:
+            execute_values(
+                cursor,
+                "INSERT INTO import_deferred_indexes (name, definition) VALUES %s ON CONFLICT (name) DO NOTHING",
+                indexes
+            )
+        for name, _ in indexes:
+            cursor.execute(f'DROP INDEX IF EXISTS "{name}"')
+    conn.commit()
+    return [name for name, _ in indexes]
+
+
+def rebuild_indexes(conn, log):
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT name, definition FROM import_deferred_indexes ORDER BY name")
+        indexes = cursor.fetchall()
+    conn.commit()
+    
+    for name, definition in indexes:
+        started = time.monotonic()
+        with conn.cursor() as cursor:
+            cursor.execute(definition.replace('CREATE INDEX', 'CREATE INDEX IF NOT EXISTS', 1))
+            cursor.execute("DELETE FROM import_deferred_indexes WHERE name = %s", (name,))
+        conn.commit()
+        log(f'индекс {name} построен за {time.monotonic() - started:.1f} с')
+    
+    if indexes:
+        with conn.cursor() as cursor:
+            cursor.execute("ANALYZE messages")
+        conn.commit()
+
+
+class HistoryImporter:
+    def __init__(self, chats_fn, source, create_users=False, log=print):
+        self.chats_fn = chats_fn
+        self.source = source
+        self.create_users = create_users
+        self.log = log
+        self.urls = chats_fn.SHARD_URLS
+        self.conns = {}
+        self.users = {}
+        self.unknown_senders = set()
+        self.password_hash = None
+    
+    def connect(self, shard):
+        conn = self.conns.get(shard)
+        if conn is None or conn.closed:
+            conn = self.conns[shard] = psycopg2.connect(self.urls[shard])
+        return conn
+    
+    def close(self):
+        for conn in self.conns.values():
+            conn.close()
+        self.conns = {}
+    
+    def checkpoints(self):
+        result = {}
+        for shard in self.urls:
+            conn = self.connect(shard)
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT record FROM import_checkpoints WHERE source = %s", (self.source,))
+                found = cursor.fetchone()
+            conn.commit()
+            result[shard] = found[0] if found else 0
+        return result
+    
+    def unusable_password(self):
+        # Созданные импортом пользователи входят только после сброса пароля
+        if self.password_hash is None:
+            self.password_hash = bcrypt.hashpw(secrets.token_bytes(32), bcrypt.gensalt()).decode('utf-8')
+        return self.password_hash
+    
+    def resolve_users(self, records):
+        names = {record['sender']: record['senderName'] for _, record in records}
+        missing = sorted(set(names) - set(self.users) - self.unknown_senders)
+        if not missing:
+            return
+        
+        conn = self.connect('main')
+        with conn.cursor() as cursor:
+            if self.create_users:
+                execute_values(
+                    cursor,
+                    "INSERT INTO users (username, display_name, password_hash) VALUES %s ON CONFLICT (username) DO NOTHING",
+                    [(username, names[username], self.unusable_password()) for username in missing]
+                )
+            cursor.execute("SELECT username, id::text FROM users WHERE username = ANY(%s)", (missing,))
+            self.users.update(cursor.fetchall())
+        conn.commit()
+        self.unknown_senders.update(username for username in missing if username not in self.users)
+    
+    def import_batch(self, records, end, checkpoints):
+        self.resolve_users(records)
+        
+        by_shard = defaultdict(list)
+        skipped = 0
+        for number, record in records:
+            sender_id = self.users.get(record['sender'])
+            if sender_id is None:
+                skipped += 1
+                continue
+            chat_id = str(uuid.uuid5(IMPORT_NAMESPACE, f"{self.source}:chat:{record['chat']}"))
+            shard = self.chats_fn.shard_for_chat(chat_id, write=True)
+            # После обрыва часть шардов могла уже закоммитить эту пачку
+            if number <= checkpoints[shard]:
+                continue
+            message_id = str(uuid.uuid5(IMPORT_NAMESPACE, f'{self.source}:message:{number}'))
+            by_shard[shard].append((chat_id, sender_id, message_id, record))
+        
+        for shard in self.urls:
+            if end > checkpoints[shard]:
+                self.load_shard(shard, by_shard.get(shard, []), end)
+                checkpoints[shard] = end
+        return sum(len(rows) for rows in by_shard.values()), skipped
+    
+    def load_shard(self, shard, rows, end):
+        conn = self.connect(shard)
+        with conn.cursor() as cursor:
+            if rows:
+                chats = {}
+                members = {}
+                counters = {}
+                for chat_id, sender_id, _, record in rows:
+                    chats.setdefault(chat_id, (chat_id, record['chatType'], record['chatTitle'], record['sentAt']))
+                    members.setdefault((chat_id, sender_id), (chat_id, sender_id, record['sentAt']))
+                    count, last_at = counters.get(chat_id, (0, record['sentAt']))
+                    counters[chat_id] = (count + 1, max(last_at, record['sentAt']))
+                
+                execute_values(
+                    cursor,
+                    "INSERT INTO chats (id, type, title, created_at) VALUES %s ON CONFLICT (id) DO NOTHING",
+                    list(chats.values())
+                )
+                execute_values(
+                    cursor,
+                    "INSERT INTO chat_members (chat_id, user_id, joined_at) VALUES %s ON CONFLICT (chat_id, user_id) DO NOTHING",
+                    list(members.values())
+                )
+                cursor.copy_expert(
+                    "COPY messages (id, chat_id, sender_id, body, created_at, read_at) FROM STDIN",
+                    CopyStream(
+                        copy_row(message_id, chat_id, sender_id, record['body'], record['sentAt'], record['readAt'])
+                        for chat_id, sender_id, message_id, record in rows
+                    )
+                )
+                execute_values(cursor, """
+                    UPDATE chats c
+                    SET message_count = c.message_count + s.count,
+                        last_message_at = GREATEST(c.last_message_at, s.last_at)
+                    FROM (VALUES %s) AS s (id, count, last_at)
+                    WHERE c.id = s.id::uuid
+                """, [(chat_id, count, last_at) for chat_id, (count, last_at) in counters.items()])
+            
+            cursor.execute("""
+                INSERT INTO import_checkpoints (source, record, messages) VALUES (%s, %s, %s)
+                ON CONFLICT (source) DO UPDATE
+                SET record = EXCLUDED.record,
+                    messages = import_checkpoints.messages + EXCLUDED.messages,
+                    updated_at = NOW()
+            """, (self.source, end, len(rows)))
+        conn.commit()
+    
+    def run(self, path, fmt, batch_size=DEFAULT_BATCH_RECORDS):
+        checkpoints = self.checkpoints()
+        resume = min(checkpoints.values())
+        if resume:
+            self.log(f'{self.source}: продолжаем после записи {resume}')
+        
+        total_bytes = os.path.getsize(path) or 1
+        started = time.monotonic()
+        next_report = started + PROGRESS_SECONDS
+        imported = skipped = invalid = 0
+        batch = []
+        last_number = resume
+        
+        for number, raw, position in read_records(path, fmt):
+            if number <= resume:
+                continue
+            last_number = number
+            
+            record = parse_record(raw)
+            if record is None:
+                invalid += 1
+                if invalid <= REPORTED_INVALID:
+                    self.log(f'запись {number}: пропущена — нет обязательных полей или неверный формат')
+            else:
+                batch.append((number, record))
+            
+            if len(batch) >= batch_size:
+                loaded, missing = self.import_batch(batch, last_number, checkpoints)
+                imported += loaded
+                skipped += missing
+                batch = []
+                if time.monotonic() >= next_report:
+                    elapsed = time.monotonic() - started
+                    self.log(
+                        f'{position / total_bytes:6.1%}  запись {number:>12}  сообщений {imported:>12}'
+                        f'  {imported / elapsed:>9.0f} в секунду'
+                    )
+                    next_report = time.monotonic() + PROGRESS_SECONDS
+        
+        if last_number > resume:
+            loaded, missing = self.import_batch(batch, last_number, checkpoints)
+            imported += loaded
+            skipped += missing
+        
+        self.log(
+            f'{self.source}: импортировано {imported} сообщений за {time.monotonic() - started:.1f} с, '
+            f'пропущено: неверных записей {invalid}, неизвестных отправителей {skipped}'
+        )
+        if self.unknown_senders:
+            shown = ', '.join(sorted(self.unknown_senders)[:REPORTED_INVALID])
+            self.log(f'нет пользователей: {shown} (всего {len(self.unknown_senders)}; создать — --create-users)')
+        return imported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='файл NDJSON или CSV')
+    parser.add_argument('--format', choices=('ndjson', 'csv'), help='по умолчанию по расширению файла')
+    parser.add_argument('--source', help='имя источника для id и возобновления (по умолчанию имя файла)')
+    parser.add_argument('--batch', type=int, default=DEFAULT_BATCH_RECORDS, help='записей в пачке')
+    parser.add_argument('--create-users', action='store_true', help='создавать неизвестных отправителей')
+    parser.add_argument('--defer-indexes', action='store_true', help='строить индексы messages после загрузки')
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    args = parser.parse_args()
+    
+    if not args.database_url:
+        sys.exit('DATABASE_URL не задан')
+    
+    fmt = args.format or ('csv' if args.path.lower().endswith('.csv') else 'ndjson')
+    source = args.source or os.path.basename(args.path)
+    
+    chats_fn = load_function('chats', {'DATABASE_URL': args.database_url})
+    for shard, url in chats_fn.SHARD_URLS.items():
+        # CREATE INDEX IF NOT EXISTS из миграций синхронно построил бы снятые индексы
+        # на уже большой таблице, а defer_indexes тут же снял бы их снова. Миграции
+        # этой базы уже применены первым запуском, поэтому до перестройки их пропускаем
+        pending = pending_deferred_indexes(url)
+        if pending:
+            print(f'{shard}: {pending} отложенных индексов от прерванного импорта, миграции пропущены')
+            continue
+        apply_migrations(url)
+    
+    importer = HistoryImporter(chats_fn, source, args.create_users)
+    try:
+        if args.defer_indexes:
+            for shard in chats_fn.SHARD_URLS:
+                dropped = defer_indexes(importer.connect(shard))
+                print(f'{shard}: индексы отложены: {", ".join(dropped) or "нет"}')
+        
+        try:
+            importer.run(args.path, fmt, args.batch)
+        except chats_fn.ShardMoving:
+            sys.exit('бакет чата переносится между шардами — повторите импорт после переноса')
+        
+        for shard in chats_fn.SHARD_URLS:
+            rebuild_indexes(importer.connect(shard), lambda line, shard=shard: print(f'{shard}: {line}'))
+    finally:
+        importer.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,256 @@
+"""
+Нагрузочный прогон облачных функций в процессе против локального Postgres.
+
+Каждый симулированный пользователь — отдельный поток, который в течение
+--duration секунд выполняет действия в пропорциях --mix. Результат —
+пропускная способность и p50/p95/p99 по каждому действию; --output сохраняет
+его в JSON, --compare печатает разницу с сохранённым прогоном.
+
+    DATABASE_URL=postgresql://localhost/messenger_load \
+    python tools/loadtest.py --users 50 --duration 60 \
+        --mix register=1,login=2,list_chats=5,messages=5,send_message=3 \
+        --output before.json
+"""
+import os
+import sys
+import json
+import math
+import time
+import random
+import secrets
+import argparse
+import subprocess
+import threading
+from datetime import datetime, timedelta
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import psycopg2
+
+from harness import ROOT_DIR, apply_migrations, call, load_function
+
+ACTIONS = ('register', 'login', 'list_chats', 'messages', 'send_message')
+DEFAULT_MIX = 'register=1,login=2,list_chats=5,messages=5,send_message=3'
+PASSWORD = 'loadtest-password'
+
+
+def parse_mix(value):
+    mix = {}
+    for part in value.split(','):
+        action, _, weight = part.partition('=')
+        if action not in ACTIONS:
+            raise argparse.ArgumentTypeError(f'неизвестное действие: {action}')
+        mix[action] = float(weight or 1)
+    return mix
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+    
+    def record(self, action, duration_ms, ok):
+        with self.lock:
+            self.latencies[action].append(duration_ms)
+            if not ok:
+                self.errors[action] += 1
+    
+    def summary(self, elapsed):
+        result = {}
+        for action, values in sorted(self.latencies.items()):
+            values = sorted(values)
+            result[action] = {
+                'count': len(values),
+                'errors': self.errors[action],
+                'throughput': round(len(values) / elapsed, 2),
+                'p50': round(percentile(values, 0.50), 2),
+                'p95': round(percentile(values, 0.95), 2),
+                'p99': round(percentile(values, 0.99), 2),
+            }
+        return result
+
+
+class SimulatedUser:
+    def __init__(self, run_id, index, functions, invite_token):
+        self.username = f'lt_{run_id}_{index}'
+        self.functions = functions
+        self.invite_token = invite_token
+        self.token = None
+        self.user_id = None
+        self.chat_ids = []
+        self.registrations = 0
+    
+    def register(self, username=None):
+        status, payload, _ = call(self.functions['auth'], 'POST', body={
+            'action': 'register',
+            'username': username or self.username,
+            'displayName': username or self.username,
+            'password': PASSWORD,
+            'inviteToken': self.invite_token,
+        })
+        if status == 201 and username is None:
+            self.token = payload['accessToken']
+            self.user_id = payload['user']['id']
+        return status == 201
+    
+    def login(self):
+        status, payload, _ = call(self.functions['auth'], 'POST', body={
+            'action': 'login', 'username': self.username, 'password': PASSWORD,
+        })
+        if status == 200:
+            self.token = payload['accessToken']
+        return status == 200
+    
+    def open_chat(self, other_user_id):
+        status, payload, _ = call(self.functions['chats'], 'POST', token=self.token, body={
+            'action': 'create_chat', 'userId': other_user_id,
+        })
+        if status in (200, 201):
+            self.chat_ids.append(payload['chatId'])
+    
+    def run(self, action):
+        if action == 'register':
+            # Регистрируем нового пользователя, не теряя сессию симулированного
+            self.registrations += 1
+            return self.register(f'{self.username}_r{self.registrations}')
+        if action == 'login':
+            return self.login()
+        if action == 'list_chats':
+            status, _, _ = call(self.functions['chats'], 'GET', query={'action': 'list_chats'}, token=self.token)
+            return status == 200
+        if action == 'messages':
+            status, _, _ = call(self.functions['chats'], 'GET', token=self.token, query={
+                'action': 'messages', 'chatId': random.choice(self.chat_ids),
+            })
+            return status == 200
+        if action == 'send_message':
+            status, _, _ = call(self.functions['chats'], 'POST', token=self.token, body={
+                'action': 'send_message',
+                'chatId': random.choice(self.chat_ids),
+                'body': secrets.token_hex(random.randint(4, 64)),
+            })
+            return status == 201
+        raise ValueError(action)
+
+
+def create_invite(database_url, max_uses):
+    token = secrets.token_urlsafe(16)
+    conn = psycopg2.connect(database_url)
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO invites (token, expires_at, max_uses) VALUES (%s, %s, %s)",
+            (token, datetime.utcnow() + timedelta(days=1), max_uses)
+        )
+    conn.commit()
+    conn.close()
+    return token
+
+
+def prepare_users(args, functions):
+    run_id = secrets.token_hex(3)
+    invite_token = create_invite(args.database_url, max_uses=1_000_000)
+    users = [SimulatedUser(run_id, index, functions, invite_token) for index in range(args.users)]
+    
+    with ThreadPoolExecutor(max_workers=min(args.users, 32)) as pool:
+        list(pool.map(lambda user: user.register(), users))
+        # У каждого пользователя несколько личных чатов со случайными собеседниками
+        def open_chats(user):
+            others = [other for other in users if other is not user and other.user_id]
+            for other in random.sample(others, min(args.chats_per_user, len(others))):
+                user.open_chat(other.user_id)
+        list(pool.map(open_chats, users))
+    
+    return [user for user in users if user.token and user.chat_ids]
+
+
+def worker(user, mix, deadline, recorder):
+    actions, weights = zip(*mix.items())
+    while time.monotonic() < deadline:
+        action = random.choices(actions, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok = user.run(action)
+        except Exception:
+            ok = False
+        recorder.record(action, (time.perf_counter() - started) * 1000, ok)
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results, baseline=None):
+    print(f"{'action':<14}{'count':>8}{'err':>6}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+    for action, row in results.items():
+        line = (f"{action:<14}{row['count']:>8}{row['errors']:>6}{row['throughput']:>9.1f}"
+                f"{row['p50']:>9.1f}{row['p95']:>9.1f}{row['p99']:>9.1f}")
+        before = (baseline or {}).get(action)
+        if before:
+            line += f"   p95 {row['p95'] - before['p95']:+.1f} ms, rps {row['throughput'] - before['throughput']:+.1f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=20, help='число одновременных пользователей')
+    parser.add_argument('--duration', type=float, default=30, help='длительность прогона в секундах')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--chats-per-user', type=int, default=3)
+    parser.add_argument('--output', help='куда сохранить результаты в JSON')
+    parser.add_argument('--compare', help='JSON предыдущего прогона для сравнения')
+    args = parser.parse_args()
+    
+    apply_migrations(args.database_url)
+    env = {'DATABASE_URL': args.database_url, 'REQUEST_LOG': '0'}
+    functions = {name: load_function(name, env) for name in ('auth', 'chats')}
+    
+    users = prepare_users(args, functions)
+    print(f'подготовлено пользователей: {len(users)}, прогон {args.duration:.0f} с')
+    
+    recorder = Recorder()
+    started = time.monotonic()
+    deadline = started + args.duration
+    with ThreadPoolExecutor(max_workers=len(users)) as pool:
+        for user in users:
+            pool.submit(worker, user, args.mix, deadline, recorder)
+    elapsed = time.monotonic() - started
+    
+    results = recorder.summary(elapsed)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)['results']
+    print_report(results, baseline)
+    
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'startedAt': datetime.utcnow().isoformat(),
+                'revision': git_revision(),
+                'config': {
+                    'users': args.users,
+                    'duration': args.duration,
+                    'mix': args.mix,
+                    'chatsPerUser': args.chats_per_user,
+                },
+                'elapsed': round(elapsed, 2),
+                'results': results,
+            }, fp, indent=2)
+    
+    return 1 if any(row['errors'] for row in results.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
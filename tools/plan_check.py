@@ -0,0 +1,358 @@
+"""
+Регрессионная проверка планов запросов функций auth, chats, users и invites.
+
+Скрипт прогоняет типичные вызовы обработчиков против засеянной базы
+(см. tools/seed_dataset.py) и перед каждым SQL, который они выполняют, снимает
+EXPLAIN (ANALYZE, BUFFERS) под точкой сохранения, откатываемой сразу после плана.
+COMMIT функций на время прогона ничего не делает, а незавершённые транзакции
+откатываются в конце запроса, поэтому сценарии записи не меняют засеянные данные
+и скрипт можно запускать повторно. То, что сценариям нужно уже закоммиченным
+(группа под управлением пользователя, вложения), скрипт создаёт сам и удаляет
+в конце; файлы вложений пишутся во временный ATTACHMENTS_DIR.
+
+Проверка падает, если в плане есть Seq Scan по большой таблице (больше
+--seq-scan-max-pages страниц), не разрешённой для этого запроса, или превышен
+бюджет буферов либо времени. Бюджеты растут с числом строк результата:
+список из сотен чатов законно читает больше, чем один профиль.
+
+    DATABASE_URL=postgresql://localhost/messenger_seed python tools/plan_check.py --max-buffers 5000 --max-ms 50
+"""
+import os
+import re
+import sys
+import json
+import base64
+import shutil
+import hashlib
+import argparse
+import tempfile
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from harness import issue_token, load_function, make_event
+
+FUNCTIONS = ('auth', 'chats', 'users', 'invites')
+EXPLAINABLE_RE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|EXECUTE)\b', re.IGNORECASE)
+PLAN_FILE = b'plan_check attachment\n'
+PLAN_FILE_SHA256 = hashlib.sha256(PLAN_FILE).hexdigest()
+
+# Запросы, которые по смыслу читают таблицу целиком
+ALLOWED_SEQ_SCANS = (
+    (re.compile(r'SELECT COUNT\(\*\) as count FROM users'), {'users'}),
+    (re.compile(r'FROM users ORDER BY display_name'), {'users'}),
+    (re.compile(r'FROM invites i JOIN users u'), {'invites', 'users'}),
+)
+
+
+def sample_ids(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT cm.user_id, COUNT(*) FROM chat_members cm GROUP BY cm.user_id ORDER BY 2 DESC LIMIT 1
+        """)
+        busy_user = str(cursor.fetchone()[0])
+        cursor.execute("""
+            SELECT m.chat_id, MIN(m.sender_id::text) FROM messages m
+            GROUP BY m.chat_id ORDER BY COUNT(*) DESC LIMIT 1
+        """)
+        busy_chat, chat_member = (str(value) for value in cursor.fetchone())
+        cursor.execute("SELECT id, username FROM users WHERE is_admin ORDER BY created_at LIMIT 1")
+        admin_id, admin_username = cursor.fetchone()
+        cursor.execute("""
+            SELECT u.id FROM users u
+            WHERE NOT EXISTS (
+                SELECT 1 FROM chat_members a JOIN chat_members b ON a.chat_id = b.chat_id
+                WHERE a.user_id = %s AND b.user_id = u.id
+            ) AND u.id != %s
+            LIMIT 1
+        """, (busy_user, busy_user))
+        stranger = str(cursor.fetchone()[0])
+        cursor.execute(
+            "SELECT token, id FROM invites WHERE revoked_at IS NULL AND expires_at > NOW() AND used_count < max_uses LIMIT 1"
+        )
+        invite = cursor.fetchone()
+        # Граница второй страницы истории: с ней сценарий читает fetch_messages_before
+        cursor.execute(
+            "SELECT id FROM messages WHERE chat_id = %s ORDER BY created_at DESC OFFSET 50 LIMIT 1",
+            (busy_chat,)
+        )
+        page_end = cursor.fetchone()
+    return {
+        'busy_user': busy_user,
+        'busy_chat': busy_chat,
+        'chat_member': chat_member,
+        'admin_id': str(admin_id),
+        'admin_username': admin_username,
+        'stranger': stranger,
+        'invite': invite[0] if invite else None,
+        'invite_id': str(invite[1]) if invite else None,
+        'page_end': str(page_end[0]) if page_end else None,
+    }
+
+
+def create_fixtures(conn, storage, ids):
+    # Группа, где busy_user владелец (для add_members/remove_members), и вложения участника
+    # чата: готовое неотправленное, готовое в сообщении (для пересылки) и недогруженное
+    with conn.cursor() as cursor:
+        cursor.execute(
+            "INSERT INTO chats (type, title, created_by) VALUES ('group', 'plan_check', %s) RETURNING id",
+            (ids['busy_user'],)
+        )
+        group = str(cursor.fetchone()[0])
+        cursor.execute("""
+            INSERT INTO chat_members (chat_id, user_id, role) VALUES (%s, %s, 'owner'), (%s, %s, 'member')
+            ON CONFLICT DO NOTHING
+        """, (group, ids['busy_user'], group, ids['chat_member']))
+        
+        attachments = {}
+        for key, status, with_message in (('ready', 'ready', False), ('forward', 'ready', True), ('uploading', 'uploading', False)):
+            cursor.execute("""
+                INSERT INTO attachments (uploader_id, message_id, chat_id, sha256, size, file_name, content_type, status)
+                VALUES (%s, %s, %s, %s, %s, 'plan_check.txt', 'text/plain', %s)
+                RETURNING id
+            """, (
+                ids['chat_member'], ids['page_end'] if with_message else None, ids['busy_chat'],
+                PLAN_FILE_SHA256, len(PLAN_FILE), status
+            ))
+            attachments[key] = str(cursor.fetchone()[0])
+    conn.commit()
+    
+    storage.append('plan_check', 0, PLAN_FILE)
+    storage.commit('plan_check', PLAN_FILE_SHA256)
+    return {'group': group, 'attachments': attachments}
+
+
+def drop_fixtures(conn, fixtures):
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM attachments WHERE id = ANY(%s::uuid[])", (list(fixtures['attachments'].values()),))
+        cursor.execute("DELETE FROM chat_members WHERE chat_id = %s", (fixtures['group'],))
+        cursor.execute("DELETE FROM chats WHERE id = %s", (fixtures['group'],))
+    conn.commit()
+
+
+def scenarios(ids, fixtures):
+    member = issue_token(ids['chat_member'])
+    busy = issue_token(ids['busy_user'])
+    admin = issue_token(ids['admin_id'])
+    chat = ids['busy_chat']
+    group = fixtures['group']
+    attachments = fixtures['attachments']
+    
+    yield 'auth', 'login', dict(method='POST', body={'action': 'login', 'username': ids['admin_username'], 'password': 'password'})
+    yield 'auth', 'current user', dict(method='GET', token=admin)
+    if ids['invite']:
+        yield 'auth', 'register', dict(method='POST', body={
+            'action': 'register', 'username': f"plan_{os.getpid()}", 'displayName': 'Plan', 'password': 'x',
+            'inviteToken': ids['invite'],
+        })
+    
+    yield 'chats', 'list_chats', dict(method='GET', query={'action': 'list_chats'}, token=busy)
+    yield 'chats', 'messages', dict(method='GET', query={'action': 'messages', 'chatId': chat}, token=member)
+    if ids['page_end']:
+        yield 'chats', 'messages before', dict(method='GET', query={'action': 'messages', 'chatId': chat, 'before': ids['page_end']}, token=member)
+    yield 'chats', 'send_message', dict(method='POST', body={'action': 'send_message', 'chatId': chat, 'body': 'plan'}, token=member)
+    yield 'chats', 'send attached', dict(method='POST', body={
+        'action': 'send_message', 'chatId': chat, 'body': '', 'attachmentIds': [attachments['ready']],
+    }, token=member)
+    yield 'chats', 'send forwarded', dict(method='POST', body={
+        'action': 'send_message', 'chatId': chat, 'body': '', 'attachmentIds': [attachments['forward']],
+    }, token=member)
+    yield 'chats', 'members', dict(method='GET', query={'action': 'members', 'chatId': chat}, token=member)
+    yield 'chats', 'members after', dict(method='GET', query={'action': 'members', 'chatId': chat, 'after': ids['chat_member']}, token=member)
+    yield 'chats', 'create_chat', dict(method='POST', body={'action': 'create_chat', 'userId': ids['stranger']}, token=busy)
+    yield 'chats', 'create_group', dict(method='POST', body={
+        'action': 'create_group', 'title': 'Plan', 'memberIds': [ids['chat_member'], ids['stranger']],
+    }, token=busy)
+    yield 'chats', 'add_members', dict(method='POST', body={'action': 'add_members', 'chatId': group, 'userIds': [ids['stranger']]}, token=busy)
+    yield 'chats', 'remove_members', dict(method='POST', body={'action': 'remove_members', 'chatId': group, 'userIds': [ids['chat_member']]}, token=busy)
+    yield 'chats', 'signal', dict(method='POST', body={'action': 'signal', 'chatId': chat, 'kind': 'typing'}, token=member)
+    yield 'chats', 'init_upload', dict(method='POST', body={
+        'action': 'init_upload', 'chatId': chat, 'fileName': 'plan.txt', 'contentType': 'text/plain',
+        'size': len(PLAN_FILE), 'sha256': PLAN_FILE_SHA256,
+    }, token=member)
+    yield 'chats', 'upload_status', dict(method='GET', query={'action': 'upload_status', 'chatId': chat, 'attachmentId': attachments['uploading']}, token=member)
+    yield 'chats', 'upload_chunk', dict(method='POST', body={
+        'action': 'upload_chunk', 'chatId': chat, 'attachmentId': attachments['uploading'], 'offset': 0,
+        'data': base64.b64encode(PLAN_FILE).decode('ascii'),
+    }, token=member)
+    yield 'chats', 'complete_upload', dict(method='POST', body={'action': 'complete_upload', 'chatId': chat, 'attachmentId': attachments['uploading']}, token=member)
+    yield 'chats', 'attachment', dict(method='GET', query={'action': 'attachment', 'chatId': chat, 'attachmentId': attachments['ready']}, token=member)
+    yield 'chats', 'batch', dict(method='POST', body={'action': 'batch', 'requests': [
+        {'action': 'current_user'},
+        {'action': 'list_chats'},
+        {'action': 'users'},
+        {'action': 'messages', 'chatId': chat},
+        {'action': 'members', 'chatId': chat},
+    ]}, token=member)
+    
+    yield 'users', 'list', dict(method='GET', token=member)
+    yield 'invites', 'list', dict(method='GET', token=admin)
+    yield 'invites', 'create', dict(method='POST', body={'maxUses': 1, 'daysValid': 1}, token=admin)
+    if ids['invite_id']:
+        yield 'invites', 'revoke', dict(method='DELETE', body={'inviteId': ids['invite_id']}, token=admin)
+
+
+_no_commit_classes = {}
+
+
+def no_commit_factory(factory):
+    # Подкласс фабрики соединений функции (в том числе PooledConnection), у которого
+    # COMMIT ничего не делает: транзакция запроса откатится в release_connections или при close
+    if factory not in _no_commit_classes:
+        _no_commit_classes[factory] = type(f'NoCommit{factory.__name__}', (factory,), {'commit': lambda self: None})
+    return _no_commit_classes[factory]
+
+
+@contextmanager
+def uncommitted():
+    original = psycopg2.connect
+    
+    def connect(*args, connection_factory=None, **kwargs):
+        factory = no_commit_factory(connection_factory or psycopg2.extensions.connection)
+        return original(*args, connection_factory=factory, **kwargs)
+    
+    psycopg2.connect = connect
+    try:
+        yield
+    finally:
+        psycopg2.connect = original
+
+
+def explaining_cursor(module, captured):
+    class ExplainingCursor(module.TimedCursor):
+        def execute(self, query, vars=None):
+            # План снимается на том же соединении и в той же транзакции, что и сам запрос:
+            # видны незакоммиченные записи сценария и уже подготовленные EXECUTE.
+            # EXPLAIN ANALYZE выполняет запись по-настоящему, поэтому откатываем её до точки сохранения
+            if isinstance(query, str) and EXPLAINABLE_RE.match(query) and not self.connection.autocommit:
+                RealDictCursor.execute(self, "SAVEPOINT plan_check")
+                try:
+                    RealDictCursor.execute(self, f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", vars)
+                    captured.append((module.__name__, query, self.fetchone()['QUERY PLAN'][0]))
+                except psycopg2.Error:
+                    # Ошибку (например, нарушение уникальности) функция получит от самого запроса ниже
+                    pass
+                RealDictCursor.execute(self, "ROLLBACK TO SAVEPOINT plan_check")
+            return super().execute(query, vars)
+    return ExplainingCursor
+
+
+def capture(functions, ids, fixtures):
+    captured = []
+    for module in functions.values():
+        module.TimedCursor = explaining_cursor(module, captured)
+    
+    with uncommitted():
+        for name, label, request in scenarios(ids, fixtures):
+            before = len(captured)
+            # Обработчик вызывается напрямую: тело скачивания вложения — base64, а не JSON
+            response = functions[name].handler(make_event(**request), None)
+            if response['statusCode'] >= 500:
+                raise RuntimeError(f"{name} {label}: {response['statusCode']} {response.get('body')}")
+            for index in range(before, len(captured)):
+                captured[index] = (f'{name} {label}',) + captured[index][1:]
+    return captured
+
+
+def relation_pages(conn):
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname, c.relpages FROM pg_class c
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE c.relkind = 'r' AND n.nspname = current_schema()
+        """)
+        return dict(cursor.fetchall())
+
+
+def walk(node):
+    yield node
+    for child in node.get('Plans', []):
+        yield from walk(child)
+
+
+def check(label, query, result, pages, args):
+    plan = result['Plan']
+    statement = ' '.join(query.split())
+    allowed = set()
+    for pattern, tables in ALLOWED_SEQ_SCANS:
+        if pattern.search(statement):
+            allowed |= tables
+    
+    problems = []
+    for node in walk(plan):
+        # Маленькую таблицу (приглашения, карта шардов) дешевле прочитать целиком, чем по индексу
+        relation = node.get('Relation Name')
+        if node['Node Type'] == 'Seq Scan' and relation not in allowed and pages.get(relation, 0) > args.seq_scan_max_pages:
+            problems.append(f"Seq Scan по {relation} ({pages[relation]} стр.)")
+    
+    rows = plan.get('Actual Rows', 0) * plan.get('Actual Loops', 1)
+    buffers = plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0)
+    max_buffers = args.max_buffers + rows * args.buffers_per_row
+    max_ms = args.max_ms + rows * args.ms_per_row
+    if buffers > max_buffers:
+        problems.append(f'буферов {buffers} > {max_buffers:.0f} (строк {rows})')
+    if result['Execution Time'] > max_ms:
+        problems.append(f"{result['Execution Time']:.1f} мс > {max_ms:.1f} мс (строк {rows})")
+    
+    return {
+        'scenario': label,
+        'statement': statement[:120],
+        'rows': rows,
+        'buffers': buffers,
+        'executionMs': round(result['Execution Time'], 3),
+        'problems': problems,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--max-buffers', type=int, default=5000, help='бюджет shared-буферов на запрос')
+    parser.add_argument('--buffers-per-row', type=float, default=20, help='добавка к бюджету буферов на строку результата')
+    parser.add_argument('--max-ms', type=float, default=50, help='бюджет времени выполнения на запрос')
+    parser.add_argument('--ms-per-row', type=float, default=0.1, help='добавка к бюджету времени на строку результата')
+    parser.add_argument('--seq-scan-max-pages', type=int, default=1000, help='Seq Scan по таблице до стольких страниц не считается проблемой')
+    parser.add_argument('--output', help='куда сохранить отчёт в JSON')
+    args = parser.parse_args()
+    
+    attachments_dir = tempfile.mkdtemp(prefix='plan_check-')
+    env = {
+        'DATABASE_URL': args.database_url,
+        'DATABASE_READ_URL': None,
+        'REQUEST_LOG': '0',
+        'ATTACHMENT_STORAGE': 'local',
+        'ATTACHMENTS_DIR': attachments_dir,
+    }
+    functions = {name: load_function(name, env) for name in FUNCTIONS}
+    
+    conn = psycopg2.connect(args.database_url)
+    ids = sample_ids(conn)
+    pages = relation_pages(conn)
+    fixtures = create_fixtures(conn, functions['chats'].get_storage(), ids)
+    try:
+        captured = capture(functions, ids, fixtures)
+    finally:
+        drop_fixtures(conn, fixtures)
+        conn.close()
+        shutil.rmtree(attachments_dir, ignore_errors=True)
+    
+    report = [check(label, query, result, pages, args) for label, query, result in captured]
+    
+    failed = [row for row in report if row['problems']]
+    for row in report:
+        mark = 'FAIL' if row['problems'] else 'ok'
+        print(f"{mark:<5}{row['scenario']:<22}{row['executionMs']:>9.2f} мс{row['buffers']:>8} буф  {row['statement'][:70]}")
+        for problem in row['problems']:
+            print(f'       - {problem}')
+    
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2, ensure_ascii=False)
+    
+    print(f'\nзапросов: {len(report)}, с проблемами: {len(failed)}')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Сводка профилей запросов, сохранённых функцией chats в PROFILE_DIR.
+
+Складывает все .pstats (или только профили одного действия) и печатает самые
+дорогие функции; --stacks дополнительно печатает самые частые свёрнутые стеки из
+.collapsed, а --merge-stacks сохраняет их суммой в один файл для flamegraph.pl.
+
+    python tools/profile_summary.py --action list_chats --top 25
+    python tools/profile_summary.py /tmp/messenger-profiles --merge-stacks all.collapsed
+"""
+import os
+import sys
+import glob
+import pstats
+import argparse
+from collections import Counter
+
+SORT_KEYS = ('cumulative', 'tottime', 'ncalls')
+
+
+def profile_paths(directory, action=None):
+    # Имя профиля: <время>-<действие>-<id>.pstats
+    paths = sorted(glob.glob(os.path.join(directory, '*.pstats')))
+    if action:
+        paths = [path for path in paths if os.path.basename(path).split('-')[1] == action]
+    return paths
+
+
+def merge_stacks(paths):
+    stacks = Counter()
+    for path in paths:
+        collapsed = path[:-len('.pstats')] + '.collapsed'
+        if not os.path.exists(collapsed):
+            continue
+        with open(collapsed) as fp:
+            for line in fp:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('directory', nargs='?', default=os.environ.get('PROFILE_DIR', '/tmp/messenger-profiles'))
+    parser.add_argument('--action', help='только профили этого действия (list_chats, messages, ...)')
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--sort', choices=SORT_KEYS, default='cumulative')
+    parser.add_argument('--stacks', action='store_true', help='напечатать самые частые стеки')
+    parser.add_argument('--merge-stacks', help='сохранить сумму свёрнутых стеков в файл')
+    args = parser.parse_args()
+    
+    paths = profile_paths(args.directory, args.action)
+    if not paths:
+        sys.exit(f'нет профилей в {args.directory}')
+    
+    print(f'профилей: {len(paths)} ({os.path.basename(paths[0])} … {os.path.basename(paths[-1])})')
+    stats = pstats.Stats(*paths)
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+    
+    if args.stacks or args.merge_stacks:
+        stacks = merge_stacks(paths)
+        if args.stacks:
+            total = sum(stacks.values()) or 1
+            for stack, count in stacks.most_common(args.top):
+                print(f'{count / total:6.1%}  {stack}')
+        if args.merge_stacks:
+            with open(args.merge_stacks, 'w') as fp:
+                fp.writelines(f'{stack} {count}\n' for stack, count in stacks.most_common())
+            print(f'стеки сохранены в {args.merge_stacks}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,260 @@
+"""
+Управление шардами чатов: подготовка баз шардов, сводка и онлайн-перенос бакетов.
+
+Чат живёт на шарде своего бакета chat_bucket(chat_id) по карте chat_shard_buckets
+в основной базе (DATABASE_URL); бакеты без записи остаются в ней самой (шард main).
+Перенос не останавливает сервис:
+
+1. строки бакетов копируются на целевой шард, пока запись продолжается;
+2. бакеты помечаются moving — функция chats отвечает на запись в них 503, чтение
+   продолжает идти со старого шарда; выжидаем, пока все инстансы перечитают карту;
+3. повторное копирование догоняет изменения, сделанные за первый проход;
+4. карта переключается на новый шард, и после ещё одной паузы строки удаляются
+   со старого.
+
+    DATABASE_URL=... CHAT_SHARD_URLS=s1=postgresql://...,s2=postgresql://... \
+    python tools/rebalance_shards.py init
+    python tools/rebalance_shards.py status
+    python tools/rebalance_shards.py move --buckets 0-511 --to s1
+"""
+import os
+import sys
+import time
+import argparse
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+from harness import apply_migrations
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+SHARD_BUCKETS = 1024
+# Пауза должна перекрывать SHARD_MAP_TTL_SECONDS функции chats и время самого долгого запроса
+DEFAULT_GRACE_SECONDS = 8
+COPY_BATCH_ROWS = 5000
+
+# На шардах нет users: внешние ключи на неё снимаются, id проверяет функция chats
+USER_FOREIGN_KEYS = (
+    ('chats', 'chats_created_by_fkey'),
+    ('chat_members', 'chat_members_user_id_fkey'),
+    ('messages', 'messages_sender_id_fkey'),
+    ('attachments', 'attachments_uploader_id_fkey'),
+)
+
+# Таблица, условие выбора строк бакетов, ключ конфликта. Порядок — порядок внешних ключей
+BUCKET_TABLES = (
+    ('chats', 'chat_bucket(id, %(buckets)s) = ANY(%(ids)s)', ('id',)),
+    ('chat_members', 'chat_bucket(chat_id, %(buckets)s) = ANY(%(ids)s)', ('chat_id', 'user_id')),
+    ('messages', 'chat_bucket(chat_id, %(buckets)s) = ANY(%(ids)s)', ('id',)),
+    (
+        'attachment_blobs',
+        'sha256 IN (SELECT sha256 FROM attachments WHERE chat_bucket(chat_id, %(buckets)s) = ANY(%(ids)s))',
+        ('sha256',),
+    ),
+    ('attachments', 'chat_bucket(chat_id, %(buckets)s) = ANY(%(ids)s)', ('id',)),
+)
+
+
+def shard_urls(database_url=DATABASE_URL, chat_shard_urls=None):
+    if chat_shard_urls is None:
+        chat_shard_urls = os.environ.get('CHAT_SHARD_URLS', '')
+    return {
+        'main': database_url,
+        **dict(entry.strip().split('=', 1) for entry in chat_shard_urls.split(',') if entry.strip())
+    }
+
+
+def parse_buckets(value):
+    buckets = set()
+    for part in value.split(','):
+        start, _, end = part.partition('-')
+        buckets.update(range(int(start), int(end or start) + 1))
+    if not buckets or min(buckets) < 0 or max(buckets) >= SHARD_BUCKETS:
+        raise argparse.ArgumentTypeError(f'бакеты должны быть в диапазоне 0-{SHARD_BUCKETS - 1}')
+    return sorted(buckets)
+
+
+def init_shards(urls):
+    for shard, url in urls.items():
+        apply_migrations(url)
+        if shard == 'main':
+            continue
+        conn = psycopg2.connect(url)
+        with conn.cursor() as cursor:
+            for table, constraint in USER_FOREIGN_KEYS:
+                cursor.execute(f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {constraint}")
+        conn.commit()
+        conn.close()
+        print(f'{shard}: схема готова')
+
+
+def load_map(global_conn, buckets=None):
+    with global_conn.cursor() as cursor:
+        cursor.execute("SELECT bucket, shard, state FROM chat_shard_buckets")
+        mapped = {bucket: (shard, state) for bucket, shard, state in cursor.fetchall()}
+    global_conn.commit()
+    buckets = range(SHARD_BUCKETS) if buckets is None else buckets
+    return {bucket: mapped.get(bucket, ('main', 'active')) for bucket in buckets}
+
+
+def print_status(urls):
+    global_conn = psycopg2.connect(urls['main'])
+    shard_map = load_map(global_conn)
+    global_conn.close()
+
+    for shard, url in urls.items():
+        buckets = sorted(bucket for bucket, (owner, _) in shard_map.items() if owner == shard)
+        moving = sum(1 for bucket in buckets if shard_map[bucket][1] != 'active')
+        conn = psycopg2.connect(url)
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM chats")
+            chats = cursor.fetchone()[0]
+            cursor.execute("SELECT COUNT(*) FROM messages")
+            messages = cursor.fetchone()[0]
+        conn.close()
+        print(f'{shard:>8}: бакетов {len(buckets):>5} (переносится {moving}), чатов {chats:>9}, сообщений {messages:>11}')
+
+
+def copy_buckets(source_conn, target_conn, buckets):
+    params = {'buckets': SHARD_BUCKETS, 'ids': buckets}
+    copied = {}
+    for table, condition, conflict in BUCKET_TABLES:
+        count = 0
+        with source_conn.cursor(name=f'copy_{table}') as source:
+            source.itersize = COPY_BATCH_ROWS
+            source.execute(f"SELECT * FROM {table} WHERE {condition}", params)
+            while True:
+                rows = source.fetchmany(COPY_BATCH_ROWS)
+                if not rows:
+                    break
+                columns = [column.name for column in source.description]
+                updates = [column for column in columns if column not in conflict]
+                action = (
+                    'DO UPDATE SET ' + ', '.join(f'{column} = EXCLUDED.{column}' for column in updates)
+                    if updates and table != 'attachment_blobs' else 'DO NOTHING'
+                )
+                with target_conn.cursor() as target:
+                    execute_values(
+                        target,
+                        f"INSERT INTO {table} ({', '.join(columns)}) VALUES %s ON CONFLICT ({', '.join(conflict)}) {action}",
+                        rows
+                    )
+                count += len(rows)
+        copied[table] = count
+    source_conn.commit()
+
+    # Участники, удалённые из группы за время первого прохода
+    with source_conn.cursor() as source:
+        source.execute(
+            "SELECT chat_id, user_id FROM chat_members WHERE chat_bucket(chat_id, %(buckets)s) = ANY(%(ids)s)", params
+        )
+        members = source.fetchall()
+    source_conn.commit()
+    with target_conn.cursor() as target:
+        target.execute("""
+            DELETE FROM chat_members cm
+            WHERE chat_bucket(cm.chat_id, %(buckets)s) = ANY(%(ids)s)
+            AND (cm.chat_id, cm.user_id) NOT IN (SELECT * FROM unnest(%(chat_ids)s::uuid[], %(user_ids)s::uuid[]))
+        """, {**params, 'chat_ids': [row[0] for row in members], 'user_ids': [row[1] for row in members]})
+    target_conn.commit()
+    return copied
+
+
+def delete_buckets(conn, buckets):
+    params = {'buckets': SHARD_BUCKETS, 'ids': buckets}
+    with conn.cursor() as cursor:
+        for table, condition, _ in reversed(BUCKET_TABLES):
+            # Содержимое файлов общее для всех шардов: blob может понадобиться другим вложениям
+            if table != 'attachment_blobs':
+                cursor.execute(f"DELETE FROM {table} WHERE {condition}", params)
+    conn.commit()
+
+
+def set_state(global_conn, buckets, state, shard=None):
+    with global_conn.cursor() as cursor:
+        if shard is None:
+            cursor.execute(
+                "UPDATE chat_shard_buckets SET state = %s, updated_at = NOW() WHERE bucket = ANY(%s)",
+                (state, buckets)
+            )
+        else:
+            cursor.execute(
+                "UPDATE chat_shard_buckets SET shard = %s, state = %s, updated_at = NOW() WHERE bucket = ANY(%s)",
+                (shard, state, buckets)
+            )
+    global_conn.commit()
+
+
+def move_buckets(urls, buckets, target, grace=DEFAULT_GRACE_SECONDS, log=print):
+    if target not in urls:
+        raise ValueError(f'неизвестный шард {target}')
+
+    global_conn = psycopg2.connect(urls['main'])
+    try:
+        by_source = {}
+        for bucket, (shard, _) in load_map(global_conn, buckets).items():
+            if shard != target:
+                by_source.setdefault(shard, []).append(bucket)
+
+        for source, source_buckets in by_source.items():
+            with global_conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO chat_shard_buckets (bucket, shard)
+                    SELECT unnest(%s::integer[]), %s
+                    ON CONFLICT (bucket) DO NOTHING
+                """, (source_buckets, source))
+            global_conn.commit()
+
+            source_conn = psycopg2.connect(urls[source])
+            target_conn = psycopg2.connect(urls[target])
+            try:
+                started = time.perf_counter()
+                copied = copy_buckets(source_conn, target_conn, source_buckets)
+                log(f'{source} -> {target}: {len(source_buckets)} бакетов, первый проход {copied}')
+
+                set_state(global_conn, source_buckets, 'moving')
+                try:
+                    time.sleep(grace)
+                    copied = copy_buckets(source_conn, target_conn, source_buckets)
+                    set_state(global_conn, source_buckets, 'active', target)
+                except Exception:
+                    set_state(global_conn, source_buckets, 'active')
+                    raise
+                log(f'{source} -> {target}: догоняющий проход {copied}, карта переключена')
+
+                time.sleep(grace)
+                delete_buckets(source_conn, source_buckets)
+                log(f'{source} -> {target}: готово за {time.perf_counter() - started:.1f} с')
+            finally:
+                source_conn.close()
+                target_conn.close()
+    finally:
+        global_conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Шарды чатов мессенджера')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('init', help='применить миграции к шардам и снять внешние ключи на users')
+    commands.add_parser('status', help='бакеты, чаты и сообщения по шардам')
+    move = commands.add_parser('move', help='перенести бакеты на шард')
+    move.add_argument('--buckets', type=parse_buckets, required=True, help='например 0-255 или 3,17,100-120')
+    move.add_argument('--to', required=True, help='имя шарда из CHAT_SHARD_URLS или main')
+    move.add_argument('--grace', type=float, default=DEFAULT_GRACE_SECONDS, help='пауза на обновление карты, с')
+    args = parser.parse_args()
+
+    if not DATABASE_URL:
+        sys.exit('DATABASE_URL не задан')
+
+    urls = shard_urls()
+    if args.command == 'init':
+        init_shards(urls)
+    elif args.command == 'status':
+        print_status(urls)
+    else:
+        move_buckets(urls, args.buckets, args.to, args.grace)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""
+Генератор синтетических данных для схемы из db_migrations.
+
+Данные грузятся через COPY потоком, без промежуточных файлов. Распределения
+скошены по Ципфу: немногие пользователи состоят в большинстве чатов, а немногие
+чаты содержат большую часть сообщений — как в реальном мессенджере.
+
+    DATABASE_URL=postgresql://localhost/messenger_seed \
+    python tools/seed_dataset.py --users 10000 --chats 50000 --messages 2000000 --reset
+
+Все пользователи получают пароль `password`, первый из них — администратор.
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import itertools
+from datetime import datetime, timedelta
+
+import bcrypt
+import psycopg2
+
+from harness import apply_migrations
+
+WORDS = (
+    'привет как дела что нового когда встречаемся завтра сегодня давай посмотрим '
+    'отлично спасибо хорошо договорились позвоню напишу файл отправил ссылка проект '
+    'ok yes no maybe later lunch meeting deploy review merge fix test release'
+).split()
+
+
+class CopyStream:
+    # Файлоподобная обёртка над генератором строк для cursor.copy_expert
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.pending = ''
+    
+    def read(self, size=-1):
+        parts = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            parts.append(row)
+            length += len(row)
+        data = ''.join(parts)
+        if size < 0:
+            self.pending = ''
+            return data
+        self.pending = data[size:]
+        return data[:size]
+    
+    readline = read
+
+
+def copy_rows(cursor, table, columns, rows):
+    started = time.monotonic()
+    counter = itertools.count(1)
+    counted = (row for row, _ in zip(rows, counter))
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", CopyStream(counted))
+    total = next(counter) - 1
+    print(f'{table:<14}{total:>12} строк за {time.monotonic() - started:.1f} с')
+
+
+def zipf_weights(count, skew):
+    return [1 / (rank + 1) ** skew for rank in range(count)]
+
+
+def split_total(total, weights):
+    weight_sum = sum(weights)
+    counts = [int(total * weight / weight_sum) for weight in weights]
+    for index in random.choices(range(len(weights)), weights, k=total - sum(counts)):
+        counts[index] += 1
+    return counts
+
+
+def row(*values):
+    return '\t'.join(r'\N' if value is None else str(value) for value in values) + '\n'
+
+
+def generate(args, now):
+    users = [(uuid.uuid4(), now - timedelta(days=random.uniform(30, 730))) for _ in range(args.users)]
+    password_hash = bcrypt.hashpw(b'password', bcrypt.gensalt()).decode('utf-8')
+    
+    def user_rows():
+        for index, (user_id, created_at) in enumerate(users):
+            last_seen = now - timedelta(minutes=random.expovariate(1 / 600))
+            yield row(user_id, f'user{index}', f'User {index}', password_hash, index == 0, created_at, last_seen)
+    
+    # Пары собеседников: популярность пользователей скошена
+    popularity = zipf_weights(len(users), args.skew)
+    pairs = set()
+    max_pairs = len(users) * (len(users) - 1) // 2
+    while len(pairs) < min(args.chats, max_pairs):
+        first, second = random.choices(range(len(users)), popularity, k=2)
+        if first != second:
+            pairs.add((min(first, second), max(first, second)))
+    
+    chats = []
+    for first, second in pairs:
+        created_at = max(users[first][1], users[second][1]) + timedelta(days=random.uniform(0, 20))
+        chats.append((uuid.uuid4(), min(created_at, now), users[first][0], users[second][0]))
+    random.shuffle(chats)
+    
+    def chat_rows():
+        for chat_id, created_at, _, _ in chats:
+            yield row(chat_id, 'direct', created_at)
+    
+    def member_rows():
+        for chat_id, created_at, first, second in chats:
+            yield row(chat_id, first, created_at)
+            yield row(chat_id, second, created_at)
+    
+    # Размеры чатов скошены: первые по порядку чаты получают большую часть сообщений
+    message_counts = split_total(args.messages, zipf_weights(len(chats), args.skew))
+    
+    def message_rows():
+        for (chat_id, created_at, first, second), count in zip(chats, message_counts):
+            span = (now - created_at).total_seconds()
+            offsets = sorted(random.uniform(0, span) for _ in range(count))
+            unread_from = count - random.randint(0, min(count, 20))
+            for position, offset in enumerate(offsets):
+                sent_at = created_at + timedelta(seconds=offset)
+                body = ' '.join(random.choices(WORDS, k=random.randint(1, 25)))
+                read_at = sent_at + timedelta(seconds=random.uniform(1, 3600)) if position < unread_from else None
+                yield row(uuid.uuid4(), chat_id, random.choice((first, second)), body, sent_at, read_at)
+    
+    def invite_rows():
+        for index in range(args.invites):
+            yield row(uuid.uuid4(), f'seed-invite-{index}-{uuid.uuid4().hex[:8]}', now - timedelta(days=index % 60),
+                      now + timedelta(days=30 - index % 60), 5, index % 5, None, users[0][0])
+    
+    return [
+        ('users', ('id', 'username', 'display_name', 'password_hash', 'is_admin', 'created_at', 'last_seen'), user_rows()),
+        ('chats', ('id', 'type', 'created_at'), chat_rows()),
+        ('chat_members', ('chat_id', 'user_id', 'joined_at'), member_rows()),
+        ('messages', ('id', 'chat_id', 'sender_id', 'body', 'created_at', 'read_at'), message_rows()),
+        ('invites', ('id', 'token', 'created_at', 'expires_at', 'max_uses', 'used_count', 'revoked_at', 'created_by_user_id'), invite_rows()),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.environ.get('DATABASE_URL'))
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=10000)
+    parser.add_argument('--messages', type=int, default=500000)
+    parser.add_argument('--invites', type=int, default=200)
+    parser.add_argument('--skew', type=float, default=1.1, help='показатель распределения Ципфа')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--reset', action='store_true', help='очистить таблицы перед загрузкой')
+    args = parser.parse_args()
+    
+    random.seed(args.seed)
+    apply_migrations(args.database_url)
+    
+    conn = psycopg2.connect(args.database_url)
+    with conn.cursor() as cursor:
+        if args.reset:
+            cursor.execute("TRUNCATE messages, chat_members, chats, invites, refresh_tokens, users CASCADE")
+        for table, columns, rows in generate(args, datetime.utcnow()):
+            copy_rows(cursor, table, columns, rows)
+    conn.commit()
+    
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute("VACUUM ANALYZE")
+    conn.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())